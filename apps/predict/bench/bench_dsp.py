@@ -0,0 +1,28 @@
+"""
+Benchmark of crosszero against the previous loop implementation.
+$ python bench_dsp.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'tests'))
+
+from test_dsp import crosszero, crosszeroLoop
+
+def main(n=1000000, thres=5e-4):
+  rand = np.random.RandomState(0)
+  v = np.convolve(rand.normal(scale=1e-3, size=n), np.full(12, 1. / 12),
+                  mode='same')
+  loop = timeit.timeit(lambda:crosszeroLoop(v, thres=thres), number=1)
+  vectorized = min(timeit.repeat(lambda:crosszero(v, thres=thres),
+                                 number=1, repeat=5))
+  assert np.array_equal(crosszero(v, thres=thres),
+                        crosszeroLoop(v, thres=thres))
+  print('crosszero, n={n}, loop={l:.3f}s, vectorized={v:.3f}s, x{r:.0f}'
+        .format(n=n, l=loop, v=vectorized, r=loop / vectorized))
+
+if __name__ == '__main__':
+  main()
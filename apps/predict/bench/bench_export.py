@@ -0,0 +1,35 @@
+"""
+Benchmark of export.completion against completion of each field in a loop,
+tests/test_export.py checks they are equal.
+$ python bench_export.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'tests'))
+
+from exampleConfig import importWithConfig
+from test_export import completionLoop, randomSummaries
+
+completion = importWithConfig('export').completion
+
+def main():
+  rand = np.random.RandomState(0)
+  for unit, step, maxN, n in [('minutely', 60, None, 500000),
+                              ('hourly', 3600, 3, 30000),
+                              ('daily', 86400, 2, 2000)]:
+    values, timestamps = randomSummaries(n, step, rand)
+    secondsLoop = min(timeit.repeat(
+      lambda:[completionLoop(values[:,c], timestamps, step, maxN)
+              for c in range(0, 5)], number=1, repeat=3))
+    seconds = min(timeit.repeat(
+      lambda:completion(values, timestamps, step, maxN=maxN),
+      number=1, repeat=3))
+    print('completion, unit={u}, n={n}, loop={l:.3f}s, elapsed={s:.3f}s'
+          .format(u=unit, n=n, l=secondsLoop, s=seconds))
+
+if __name__ == '__main__':
+  main()
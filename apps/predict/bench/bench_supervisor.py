@@ -0,0 +1,38 @@
+"""
+Benchmark of supervisor.generateAnswer for each unit.
+$ python bench_supervisor.py
+"""
+import os
+import sys
+import timeit
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'tests'))
+
+from exampleConfig import importWithConfig
+from dsp import lpfilter
+
+supervisor = importWithConfig('supervisor')
+generateAnswer = supervisor.generateAnswer
+getLPFiltersSize = supervisor.getLPFiltersSize
+
+SIZES = {
+  'daily': 365 * 3,
+  'hourly': 24 * 365 * 3,
+  'minutely': 60 * 24 * 365
+}
+
+def main():
+  rand = np.random.RandomState(0)
+  for unit in ['daily', 'hourly', 'minutely']:
+    n = SIZES[unit]
+    values = 1e6 * np.exp(np.cumsum(rand.normal(scale=1e-3, size=n)))
+    lpFilters = [lpfilter(size) for size in getLPFiltersSize(unit)]
+    seconds = min(timeit.repeat(lambda:generateAnswer(values, lpFilters),
+                                number=1, repeat=3))
+    print('generateAnswer, unit={u}, n={n}, elapsed={s:.3f}s'
+          .format(u=unit, n=n, s=seconds))
+
+if __name__ == '__main__':
+  main()
@@ -1,60 +1,175 @@
+import collections
 import numpy as np
 
 
-def SMA(k, x):
+def windowSize(k, n):
+  """
+  Returns the length of every forward window x[i:i+k] in a series of size n,
+  windows are truncated at the end of the series.
+  """
+  return np.minimum(k, n - np.arange(0, n))
+
+def windowSum(k, x):
+  """
+  Returns sums of every forward window x[i:i+k] by cumulative sum in O(n).
+  A window including NaN becomes NaN as np.sum does.
+  """
   n = x.size
-  y = np.zeros(n)
-  for i in range(1, n+1):
-    e = n - i + k + 1
-    if e > n:
-      e = n
-    y[n-i] = np.average(x[n-i:e])
+  nans = np.isnan(x)
+  c = np.zeros(n + 1)
+  np.cumsum(np.where(nans, 0., x), out=c[1:])
+  e = np.arange(0, n) + windowSize(k, n)
+  y = c[e] - c[:n]
+  if nans.any():
+    cn = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(nans, out=cn[1:])
+    y[cn[e] - cn[:n] > 0] = np.nan
   return y
 
-def Sigma(k, x):
+def SMA(k, x):
   n = x.size
-  d = x - SMA(k, x)
-  y = np.zeros(n)
-  for i in range(1, n+1):
-    e = n - i + k + 1
-    if e > n:
-      e = n
-    y[n-i] = np.sum(d[n-i:e] * d[n-i:e]) / k
-  return np.sqrt(y)
+  if n == 0:
+    return np.zeros(n)
+  # Shift values to around zero so that cumulative sum keeps its precision
+  offset = x[0] if np.isfinite(x[0]) else 0.
+  return windowSum(k + 1, x - offset) / windowSize(k + 1, n) + offset
+
+def Sigma(k, x, mean=None):
+  if mean is None:
+    mean = SMA(k, x)
+  d = x - mean
+  y = windowSum(k + 1, d * d) / k
+  # Rounding error of cumulative sum may make flat windows slightly negative
+  return np.sqrt(np.maximum(y, 0.))
+
+def windowExtrema(k, x):
+  """
+  Returns maximums and minimums of every window x[i:i+k] in O(n).
+  Series are split into blocks of size k, then each window is covered by
+  a suffix of one block and a prefix of the next one (van Herk/Gil-Werman).
+  """
+  n = x.size
+  m = -(-n // k)
+  ys = []
+  for f, pad in [(np.maximum, -np.inf), (np.minimum, np.inf)]:
+    blocks = np.full(m * k, pad)
+    blocks[:n] = x
+    blocks = blocks.reshape(m, k)
+    prefix = f.accumulate(blocks, axis=1).ravel()
+    suffix = f.accumulate(blocks[:,::-1], axis=1)[:,::-1].ravel()
+    ys.append(f(suffix[:n-k+1], prefix[k-1:n]))
+  return ys[0], ys[1]
 
 def Medium(k, x):
   n = x.size
-  y = np.zeros(n-k+1)
-  for i in range(0, n-k+1):
-    y[i] = (np.max(x[i:i+k]) + np.min(x[i:i+k])) / 2
-  return y
+  if n - k + 1 <= 0:
+    return np.zeros(n-k+1)
+  ymax, ymin = windowExtrema(k, x)
+  return (ymax + ymin) / 2
 
 def RSI(x, k, slide=None):
+  """
+  Returns RSI where y[i+1] is computed from the diffs dx[i-k+slide:i+slide],
+  sums of the windows are taken from cumulative sums of increases and
+  decreases.
+  """
   N = x.shape[0]
   if slide is None:
     slide = 0
   y = np.zeros(x.shape)
+  if N < 2:
+    return y
   dx = x[1:] - x[:N-1]
-  for i in range(0, N - 1):
-    s = i - k + slide
-    if s < 0: s = 0
-    e = i + slide
-    if e >= N - 1: e = N - 2
-    inc = np.sum(dx[s + np.where(dx[s:e] > 0)[0]])
-    dec = np.sum(dx[s + np.where(dx[s:e] < 0)[0]])
-    if inc - dec == 0:
-      y[i+1] = 0
-    else:
-      y[i+1] = inc / (inc - dec)
+  i = np.arange(0, N - 1)
+  e = np.minimum(i + slide, N - 2)
+  s = np.minimum(np.maximum(i - k + slide, 0), e)
+  sums = []
+  for positive in [dx > 0, dx < 0]:
+    c = np.zeros(N)
+    np.cumsum(np.where(positive, dx, 0.), out=c[1:])
+    n = np.zeros(N, dtype=np.int64)
+    np.cumsum(positive, out=n[1:])
+    # Windows without any move must be exactly zero as before
+    sums.append(np.where(n[e] - n[s] > 0, c[e] - c[s], 0.))
+  inc, dec = sums
+  total = inc - dec
+  y[1:] = np.divide(inc, total, out=np.zeros(N - 1), where=total != 0)
   return y
 
+class RSIStream(object):
+  """
+  Incremental RSI, `update` takes the newest value and returns
+  the same value as RSI(x, k)[-1] in O(1).
+  """
+  def __init__(self, k):
+    self.k = k
+    self.diffs = collections.deque()
+    self.inc = 0.
+    self.dec = 0.
+    self.countInc = 0
+    self.countDec = 0
+    self.last = None
+    self.pending = None
+  
+  def push(self, d):
+    self.diffs.append(d)
+    if d > 0:
+      self.inc += d
+      self.countInc += 1
+    elif d < 0:
+      self.dec += d
+      self.countDec += 1
+    if len(self.diffs) > self.k:
+      d = self.diffs.popleft()
+      if d > 0:
+        self.inc -= d
+        self.countInc -= 1
+      elif d < 0:
+        self.dec -= d
+        self.countDec -= 1
+    # Drop rounding errors accumulated by additions and subtractions
+    if self.countInc == 0: self.inc = 0.
+    if self.countDec == 0: self.dec = 0.
+  
+  def value(self):
+    if self.inc - self.dec == 0:
+      return 0.
+    else:
+      return self.inc / (self.inc - self.dec)
+  
+  def update(self, value):
+    if self.last is None:
+      self.last = value
+      return 0.
+    # RSI of the newest value does not include the newest diff
+    if self.pending is not None:
+      self.push(self.pending)
+    self.pending = value - self.last
+    self.last = value
+    return self.value()
+  
+  def extend(self, values):
+    y = 0.
+    for value in values:
+      y = self.update(value)
+    return y
+
 class BollingerBand(object):
   def __init__(self, x, k=28):
     self.x = x
     self.k = k
+    self.mean = None
+    self.sigma = None
+  
+  def meanLine(self):
+    if self.mean is None:
+      self.mean = SMA(self.k, self.x)
+    return self.mean
   
   def sigmaLine(self, n):
-    return SMA(self.k, self.x) + n * Sigma(self.k, self.x)
+    if self.sigma is None:
+      self.sigma = Sigma(self.k, self.x, mean=self.meanLine())
+    return self.meanLine() + n * self.sigma
 
 class Ichimoku(object):
   def __init__(self, x, kConv=9, kBase=26, kPrec=52, kLag=25, sameSize=False):
@@ -64,11 +179,17 @@ class Ichimoku(object):
     self.kPrec = kPrec
     self.kLag = kLag
     self.sameSize = sameSize
+    self.mediums = {}
+  
+  def medium(self, k):
+    if k not in self.mediums:
+      self.mediums[k] = Medium(k, self.x)
+    return self.mediums[k]
   
   def convertionLine(self, kConv=None, sameSize=None):
     if kConv is None: kConv = self.kConv
     if sameSize is None: sameSize = self.sameSize
-    conv = Medium(kConv, self.x)
+    conv = self.medium(kConv)
     if sameSize:
       y = np.zeros(self.x.shape)
       y[kConv-1:] = conv
@@ -79,7 +200,7 @@ class Ichimoku(object):
   def baseLine(self, kBase=None, sameSize=None):
     if kBase is None: kBase = self.kBase
     if sameSize is None: sameSize = self.sameSize
-    base = Medium(kBase, self.x)
+    base = self.medium(kBase)
     if sameSize:
       y = np.zeros(self.x.shape)
       y[kBase-1:] = base
@@ -106,7 +227,7 @@ class Ichimoku(object):
     if shift is None: shift = self.kBase - 1
     if kPrec is None: kPrec = self.kPrec
     if sameSize is None: sameSize = self.sameSize
-    prec = Medium(kPrec, self.x)
+    prec = self.medium(kPrec)
     if sameSize:
       y = np.zeros(self.x.shape)
       y[kPrec+shift-1:] = prec[:-shift]
@@ -3,24 +3,39 @@ import numpy as np
 def lpfilter(size):
   return np.full(size, 1.0 / size)
 
+def confirmed(pending, fire):
+  """
+  Returns indexes of pending crossings confirmed by fire events, a fire
+  confirms the latest pending crossing after the previous fire if any.
+  """
+  index = np.arange(0, len(pending))
+  lastPending = np.maximum.accumulate(np.where(pending, index, -1))
+  fires = np.where(fire)[0]
+  lastFires = np.concatenate([[-1], fires])[:-1]
+  k = lastPending[fires]
+  return k[k > lastFires]
+
 def crosszero(v, thres=0., ud=+1.0, du=-1.0):
+  """
+  Returns vector with `du` where v crosses zero downward and `ud` where
+  upward. A crossing which does not pass over thres at once is pending,
+  and is marked when v passes over thres afterwards.
+  """
   w = np.zeros(v.shape)
-  iud = idu = None
-  for i in range(1, len(v)):
-    if v[i-1] > 0. > v[i]:
-      if -thres > v[i]:
-        w[i] = du
-      else:
-        idu = i
-    elif v[i-1] > -thres > v[i] and idu is not None:
-      w[idu] = du
-      idu = None
-    elif v[i-1] < 0. < v[i]:
-      if thres < v[i]:
-        w[i] = ud
-      else:
-        iud = i
-    elif v[i-1] < thres < v[i] and iud is not None:
-      w[iud] = ud
-      iud = None
+  if len(v) < 2:
+    return w
+  v0 = v[:-1]
+  v1 = v[1:]
+  # Downward, w[i] = du at once or later when v passes over -thres
+  down = (v0 > 0.) & (0. > v1)
+  downNow = down & (-thres > v1)
+  downLater = (v0 > -thres) & (-thres > v1) & ~down
+  w[np.where(downNow)[0] + 1] = du
+  w[confirmed(down & ~downNow, downLater) + 1] = du
+  # Upward, w[i] = ud at once or later when v passes over thres
+  up = (v0 < 0.) & (0. < v1)
+  upNow = up & (thres < v1)
+  upLater = (v0 < thres) & (thres < v1) & ~up
+  w[np.where(upNow)[0] + 1] = ud
+  w[confirmed(up & ~upNow, upLater) + 1] = ud
   return w
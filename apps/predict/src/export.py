@@ -1,9 +1,11 @@
 import datetime
+import itertools
 import numpy as np
 
 from classes import Tick, Summary
-from models import Summaries
-from utils import readConfig, getDBInstance, getLogger, savenpy, StopWatch
+from models import Summaries, SUMMARY_FIELDS
+from series import readSeries, writeSeries, appendSeries
+from utils import readConfig, getDBInstance, getLogger, seriesPath, StopWatch
 
 logger = getLogger()
 logger.debug('Start export.')
@@ -11,7 +13,6 @@ logger.debug('Start export.')
 config = readConfig('predict.ini')
 
 DIR_DATA = config['export'].get('data.dir')
-FILE_DATA = config['export'].get('data.npy')
 EXCHANGERS = config['export'].getlist('exchangers')
 UNITS = config['export'].getlist('units')
 EXPORT_WITHIN_SECONDS = config['export'].getfloat('within.seconds')
@@ -20,44 +21,189 @@ MAX_COMPLETION_DAILY = config['export'].getint('completion.maxDaily')
 COMPLETION_NOISE_SCALE = config['export'].getfloat('completion.noise.scale')
 COMPLETION_CYCLE_HOURLY = config['export'].getfloat('completion.cycleHourly')
 
-def completion(f, sums, step, maxN=None, error=np.nan, noise=None):
+# Exported series and their fields in Summaries
+COMPLETION_FIELDS = {
+  'askMax': 'ask_max',
+  'askMin': 'ask_min',
+  'askAverage': 'ask_average',
+  'askOpen': 'ask_open',
+  'askClose': 'ask_close'
+}
+
+def completion(values, timestamps, step, maxN=None, error=np.nan, noise=None):
+  """
+  Returns values placed every `step` seconds from the first timestamp,
+  gaps shorter than maxN steps are linearly completed, longer ones and
+  their both ends are filled with error.
+  values is an array of shape (size,) or (size, #fields).
+  """
   if maxN is None:
     maxN = np.inf
-  size = len(sums)
+  size = len(timestamps)
   if size == 0:
     return None
-  v = np.zeros(size * 4)
-  i = -1
-  start = sums[0].date.timestamp()
-  for s in sums:
-    timestamp = s.date.timestamp()
-    j = int((timestamp - start) / step)
-    d = j - i
-    if d == 1:
-      v[j] = f(s)
-    elif d < maxN:
-      # Linear completion
-      v[i:j+1] = np.linspace(v[i], f(s), j - i + 1)
-      if noise is not None:
-        v[i:j+1] += noise(j - i + 1)
-    else:
-      v[i:j+1] = error
-    i = j
-  w = v[:i+1]
-  return w
-
-def seriesDate(sums, step):
-  if len(sums) == 0:
+  columns = values.reshape(size, -1)
+  j = ((timestamps - timestamps[0]) / step).astype(np.int64)
+  # Bars in a slot already taken are ignored
+  taken = np.diff(j, prepend=-1) > 0
+  j, columns = j[taken], columns[taken]
+  d = np.diff(j)
+  errors = d >= maxN
+  v = np.empty((j[-1] + 1, columns.shape[1]))
+  v[j] = columns
+  # Linear completion, same arithmetic as np.linspace
+  gaps = np.flatnonzero((d > 1) & ~errors)
+  if len(gaps) > 0:
+    lengths = d[gaps] - 1
+    k = np.repeat(gaps, lengths)
+    m = np.arange(len(k)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + 1
+    left = columns[k]
+    # The end of an error gap is filled too
+    left[np.r_[False, errors][k]] = error
+    right = columns[k + 1]
+    delta = (right - left) / d[k][:,None]
+    v[j[k] + m] = m[:,None] * delta + left
+  if np.any(errors):
+    gaps = np.flatnonzero(errors)
+    lengths = d[gaps] + 1
+    k = np.repeat(gaps, lengths)
+    m = np.arange(len(k)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    v[j[k] + m] = error
+  if noise is not None:
+    for g in np.flatnonzero((d > 1) & ~errors):
+      for c in range(0, v.shape[1]):
+        v[j[g]:j[g+1]+1,c] += noise(d[g] + 1)
+  if values.ndim == 1:
+    return v[:,0]
+  return v
+
+def seriesDate(timestamps, step):
+  if len(timestamps) == 0:
     return None
-  start = sums[0].date.timestamp()
-  end = sums[-1].date.timestamp()
+  start = timestamps[0]
+  end = timestamps[-1]
   return np.arange(start, end + 1.0, step)
 
+def readColumns(summaries, exchanger, unit, after):
+  """
+  Returns summaries after `after` as a dict from field to np.array.
+  """
+  chunks = list(summaries.columns(exchanger, unit, after=after))
+  return {f: np.concatenate([c[f] for c in chunks]) if len(chunks) > 0
+             else np.zeros(0)
+          for f in SUMMARY_FIELDS}
+
+def resumeOf(summaries, exchanger, unit, header):
+  """
+  Returns the timestamp of the first bar to read again and the index
+  to rewrite series from, or None if series have to be written again.
+  The last bar may be partial, and completion of a gap depends on the gaps
+  before and after it, so series are rewritten from the second last bar
+  reading one more bar before it.
+  """
+  if header is None or header.length == 0:
+    return None
+  items = summaries.all(exchanger, unit,
+                        before=header.end() + header.step / 2, order=-1)
+  recent = list(itertools.islice(items, 3))
+  if len(recent) < 3:
+    return None
+  first = recent[2].date.timestamp()
+  index = header.indexOf(recent[1].date.timestamp())
+  if first < header.start or header.indexOf(first) is None or index is None:
+    return None
+  return first, index
+
 def completionNoise(n, cycle, scale):
   base = scale * np.sin(np.array(range(0, n))/ cycle * np.pi)
   noise = np.random.normal(scale=scale * 0.5, size=n)
   return base + noise
 
+STEP_SECONDS = {
+  'minutely': 60,
+  'hourly': 60 * 60,
+  'daily': 24 * 60 * 60,
+  'weekly': 7 * 24 * 60 * 60
+}
+
+MAX_COMPLETIONS = {
+  'minutely': None,
+  'hourly': MAX_COMPLETION_HOURLY,
+  'daily': MAX_COMPLETION_DAILY,
+  'weekly': None
+}
+
+NOISE_CYCLES = {
+  'minutely': None,
+  'hourly': COMPLETION_CYCLE_HOURLY,
+  'daily': None,
+  'weekly': None
+}
+
+SERIES_TYPES = list(COMPLETION_FIELDS) + ['date']
+
+def headerOf(exchanger, unit, step):
+  """
+  Returns header of the series file if exported series in it span
+  all of rows with step.
+  """
+  header = readSeries(seriesPath(config, exchanger, unit))
+  if header is None or header.step != step:
+    return None
+  for ty in SERIES_TYPES:
+    if ty not in header.names():
+      return None
+    _, first, length = header.columnOf(ty)
+    if first != 0 or length != header.length:
+      return None
+  return header
+
+def exportSeries(summaries, exchanger, unit, within):
+  """
+  Appends bars closed since the last export to series,
+  or writes series of bars after `within` if there is no series.
+  """
+  step = STEP_SECONDS[unit]
+  header = headerOf(exchanger, unit, step)
+  resume = resumeOf(summaries, exchanger, unit, header)
+  after = within if resume is None else resume[0] - step / 2
+  sums = readColumns(summaries, exchanger, unit, after)
+  timestamps = sums['datetime']
+  logger.debug('Copying {e}\'s {u} ticks to np.array, #items={n}...'
+               .format(e=exchanger, u=unit, n=len(timestamps)))
+  if len(timestamps) == 0:
+    logger.warning('No summary to export, exchanger={e}, unit={u}.'
+                   .format(e=exchanger, u=unit))
+    return
+  maxCompletion = MAX_COMPLETIONS[unit]
+  dates = seriesDate(timestamps, step)
+  logger.debug('Completing {e}\'s {u} ticks to np.array, maxN={maxN}...'
+               .format(e=exchanger, u=unit, maxN=maxCompletion))
+  opts = {
+    'maxN': maxCompletion
+  }
+  if NOISE_CYCLES[unit] is not None:
+    opts['noise'] = lambda n:completionNoise(n, cycle=NOISE_CYCLES[unit],
+                                             scale=COMPLETION_NOISE_SCALE)
+  values = np.stack([sums[f] for f in COMPLETION_FIELDS.values()], axis=1)
+  completes = completion(values, timestamps, step, **opts)
+  if len(dates) != len(completes):
+    raise Exception('Length unmatch, #date={date}, #completed={completed}.'
+                    .format(date=len(dates), completed=len(completes)))
+  series = {ty: completes[:,i] for i, ty in enumerate(COMPLETION_FIELDS)}
+  series['date'] = dates
+  path = seriesPath(config, exchanger, unit)
+  if resume is None:
+    # Series generated from old ones are dropped
+    writeSeries(path, timestamps[0], step, len(dates),
+                {ty: (0, series[ty]) for ty in SERIES_TYPES})
+  else:
+    first, index = resume
+    skip = index - header.indexOf(first)
+    appendSeries(path, index, {ty: series[ty][skip:] for ty in SERIES_TYPES})
+  logger.debug('Exported {e}\'s {u} series, #items={n}, rewritten={r}.'
+               .format(e=exchanger, u=unit, n=len(dates), r=resume is None))
+
 def main():
   # Measure run time
   timer = StopWatch()
@@ -65,56 +211,10 @@ def main():
   # Setup models
   db = getDBInstance(config)
   summaries = Summaries(db.tick_summary_db)
-  stepSeconds = {
-    'minutely': 60,
-    'hourly': 60 * 60,
-    'daily': 24 * 60 * 60,
-    'weekly': 7 * 24 * 60 * 60
-  }
-  maxCompletions = {
-    'minutely': None,
-    'hourly': MAX_COMPLETION_HOURLY,
-    'daily': MAX_COMPLETION_DAILY,
-    'weekly': None
-  }
-  noiseCycles = {
-    'minutely': None,
-    'hourly': COMPLETION_CYCLE_HOURLY,
-    'daily': None,
-    'weekly': None
-  }
-  now = datetime.datetime.now().timestamp()
-  after = now - EXPORT_WITHIN_SECONDS
+  within = datetime.datetime.now().timestamp() - EXPORT_WITHIN_SECONDS
   for exchanger in EXCHANGERS:
     for unit in UNITS:
-      sums = list(summaries.all(exchanger, unit, after=after))
-      logger.debug('Copying {e}\'s {u} ticks to np.array, #items={n}...'
-                   .format(e=exchanger, u=unit, n=len(sums)))
-      step = stepSeconds[unit]
-      maxCompletion = maxCompletions[unit]
-      dates = seriesDate(sums, step)
-      logger.debug('Completing {e}\'s {u} ticks to np.array, maxN={maxN}...'
-                   .format(e=exchanger, u=unit, maxN=maxCompletion))
-      opts = {
-        'maxN': maxCompletion
-      }
-      if noiseCycles[unit] is not None:
-        opts['noise'] = lambda n:completionNoise(n, cycle=noiseCycles[unit],
-                                                 scale=COMPLETION_NOISE_SCALE)
-      completes = {
-        'askMax': completion(lambda s:s.askMax, sums, step, **opts),
-        'askMin': completion(lambda s:s.askMin, sums, step, **opts),
-        'askAverage': completion(lambda s:s.askAverage, sums, step, **opts),
-        'askOpen': completion(lambda s:s.askOpen, sums, step, **opts),
-        'askClose': completion(lambda s:s.askClose, sums, step, **opts)
-      }
-      for ty in completes:
-        completed = completes[ty]
-        if len(dates) != len(completed):
-          raise Exception('Length unmatch, #date={date}, #completed={completed}.'
-                          .format(date=len(dates), completed=len(completed)))
-        savenpy(config, completed, exchanger, unit, ty)
-      savenpy(config, dates, exchanger, unit, 'date')
+      exportSeries(summaries, exchanger, unit, within)
   # Finished
   seconds = timer.stop()
   logger.debug('End export, elapsed={s:.2f}s'.format(s=seconds))
@@ -0,0 +1,103 @@
+import datetime
+import numpy as np
+
+from learningUtils import windows, stackFeatures
+from utils import loadcolumns
+
+
+class Feature(object):
+  """
+  A series used as input of the model.
+  Strided features are minutely series sampled every `stride` minutes
+  until the beginning of today, followed by the current window.
+  """
+  def __init__(self, exchanger, unit, ty, stride=1):
+    self.exchanger = exchanger
+    self.unit = unit
+    self.ty = ty
+    self.stride = stride
+
+  def __str__(self):
+    return ('Feature(exchanger={e}, unit={u}, ty={ty}, stride={s})'
+            .format(e=self.exchanger, u=self.unit, ty=self.ty, s=self.stride))
+
+
+FEATURES = [
+  Feature('bitflyer', 'hourly', 'askAverage'),
+  Feature('bitflyer', 'hourly', 'askMax'),
+  Feature('bitflyer', 'hourly', 'askMin'),
+  Feature('bitflyer', 'hourly', 'askAverageBB+2'),
+  Feature('bitflyer', 'hourly', 'askAverageBB-2'),
+  Feature('bitflyer', 'hourly', 'askAverageConv'),
+  Feature('bitflyer', 'hourly', 'askAverageBase'),
+  Feature('bitflyer', 'hourly', 'askAveragePrc1'),
+  Feature('bitflyer', 'hourly', 'askAveragePrc2'),
+  Feature('bitflyer', 'minutely', 'askAverage', stride=60),
+  Feature('quoine', 'minutely', 'askAverage', stride=60)
+]
+
+
+def loadFeatures(config, specs=FEATURES, offset=0, nan=0.):
+  """
+  Returns series of each feature, `offset` old samples are skipped from
+  not strided ones. Features of an exchanger and unit are read at once.
+  """
+  groups = {}
+  for f in specs:
+    groups.setdefault((f.exchanger, f.unit), []).append(f.ty)
+  loaded = {}
+  for (exchanger, unit), tys in groups.items():
+    columns = loadcolumns(config, exchanger, unit, tys, nan=nan)
+    for ty, x in zip(tys, columns):
+      loaded[(exchanger, unit, ty)] = x
+  series = []
+  for f in specs:
+    x = loaded[(f.exchanger, f.unit, f.ty)]
+    if f.stride == 1 and offset > 0:
+      x = x[offset:]
+    series.append(x)
+  return series
+
+
+def dataSizeOf(series, specs, sampleSize):
+  """
+  Returns the number of windows available in all of not strided series.
+  """
+  availableSize = min(len(x) for x, f in zip(series, specs) if f.stride == 1)
+  return availableSize - sampleSize + 1
+
+
+def featureWindows(x, spec, sampleSize, count, date):
+  """
+  Returns the last `count` windows of a series.
+  """
+  if spec.stride == 1:
+    return windows(x, sampleSize, available=count + sampleSize - 1)
+  minutesToday = date.hour * 60 + date.minute
+  closed = x[:len(x) - minutesToday]
+  rows = windows(closed, sampleSize, stride=spec.stride,
+                 available=(count - 1) * spec.stride + sampleSize)
+  return np.concatenate([rows, x[None,-sampleSize:]])
+
+
+def buildFeatures(series, specs, sampleSize, tail=None, date=None):
+  """
+  Returns design matrix of shape (dataSize, len(specs) * sampleSize),
+  the last row is the current window.
+  With `tail`, only the last `tail` windows are built.
+  """
+  if date is None:
+    date = datetime.datetime.now()
+  count = dataSizeOf(series, specs, sampleSize)
+  if tail is not None:
+    count = min(count, tail)
+  features = [featureWindows(x, f, sampleSize, count, date)
+              for x, f in zip(series, specs)]
+  return stackFeatures(features)
+
+
+def alignTail(x, dataSize):
+  """
+  Returns the last `dataSize` items aligned with rows of the design matrix.
+  """
+  return x[len(x)-dataSize:]
@@ -13,7 +13,9 @@ if [ -f $ENVFILE ]; then
 fi
 
 help() {
-    echo "Usage: $0 [sync] [learn] [predict]"
+    echo "Usage: $0 [sync] [learn] [predict] [daemon]"
+    echo "  daemon runs predictor.py keeping the model loaded,"
+    echo "  predict triggers it, or runs predict.py --live without it."
 }
 
 sync() {
@@ -58,7 +60,7 @@ train() {
 }
 
 predict() {
-    python3 predict.py
+    python3 predictor.py --trigger || python3 predict.py --live
     if [ $? != 0 ]; then
         echo "Exited, failed prediction."
         exit 1
@@ -87,6 +89,9 @@ while [ $# != 0 ]; do
         predict
         shift 1
         ;;
+    d*)
+        exec python3 predictor.py
+        ;;
     *)
         help
         exit 1
@@ -1,25 +1,27 @@
 from keras.models import model_from_json
 from keras import backend as K
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 
-def loadModel(config, label):
+def modelPaths(config, label):
   DIR_MODEL = config['train'].get('model.dir')
   JSON_MODEL = config['train'].get('model.json')
   H5_MODEL = config['train'].get('model.h5')
   pathJSON = (DIR_MODEL + '/' + JSON_MODEL).format(label=label)
   pathH5 = (DIR_MODEL + '/' + H5_MODEL).format(label=label)
+  return pathJSON, pathH5
+
+
+def loadModel(config, label):
+  pathJSON, pathH5 = modelPaths(config, label)
   model = model_from_json(open(pathJSON).read())
   model.load_weights(pathH5)
   return model
 
 
 def saveModel(config, model, label):
-  DIR_MODEL = config['train'].get('model.dir')
-  JSON_MODEL = config['train'].get('model.json')
-  H5_MODEL = config['train'].get('model.h5')
-  pathJSON = (DIR_MODEL + '/' + JSON_MODEL).format(label=label)
-  pathH5 = (DIR_MODEL + '/' + H5_MODEL).format(label=label)
+  pathJSON, pathH5 = modelPaths(config, label)
   open(pathJSON, 'w').write(model.to_json())
   model.save_weights(pathH5)
 
@@ -59,16 +61,28 @@ def zscore(x):
   return zscore
 
 
-def to2d(X, sampleSize, stride=1, available=None):
+def windows(X, sampleSize, stride=1, available=None):
+  """
+  Returns read-only view of shape (dataSize, sampleSize) where
+  row i is X[i*stride:i*stride+sampleSize], no data is copied.
+  """
   if available is not None:
     X = X[len(X) - available:]
   dataSize = (len(X) - sampleSize + 1) // stride
-  X2 = np.zeros((dataSize, sampleSize))
-  for i in range(0, dataSize):
-    start = i * stride
-    end = i * stride + sampleSize
-    X2[i,:] = X[start:end]
-  return X2
+  return sliding_window_view(X, sampleSize)[::stride][:dataSize]
+
+
+def to2d(X, sampleSize, stride=1, available=None):
+  return np.array(windows(X, sampleSize, stride=stride, available=available))
+
+
+def stackFeatures(features):
+  """
+  Returns design matrix of shape (dataSize, featureCount * sampleSize)
+  from windows of each feature, feature j is put at columns
+  [j*sampleSize, (j+1)*sampleSize).
+  """
+  return np.concatenate(features, axis=1)
 
 
 def underSampling(X, interval):
@@ -1,6 +1,33 @@
+import bson
+import numpy as np
 from pymongo.operations import ReplaceOne
 from classes import OneTick, Summary
 
+COLUMNS_BATCH_SIZE = 65536
+
+SUMMARY_FIELDS = ('datetime', 'ask_max', 'ask_min', 'ask_average',
+                  'ask_open', 'ask_close')
+
+def columnBatches(collection, conditions, fields, order=1,
+                  batchSize=COLUMNS_BATCH_SIZE):
+  """
+  Returns a generator of dicts from field to np.array of each batch,
+  only projected fields are read as raw BSON batches.
+  """
+  projection = {f: 1 for f in fields}
+  projection['_id'] = 0
+  batches = (collection
+             .find_raw_batches(conditions, projection, batch_size=batchSize)
+             .sort('datetime', order))
+  for batch in batches:
+    items = bson.decode_all(batch)
+    if len(items) == 0:
+      continue
+    yield {f: np.fromiter((item[f] for item in items),
+                          dtype=np.float64, count=len(items))
+           for f in fields}
+
+
 class Ticks(object):
   """
   Ticks local version.
@@ -25,19 +52,34 @@ class Ticks(object):
     print(item)
     return item
   
-  def all(self, exchanger, dateStart=None, dateEnd=None, order=1):
-    collection = self.collections[exchanger]
+  @staticmethod
+  def conditionsOf(dateStart=None, dateEnd=None):
     conditions = []
     if dateStart is not None:
       conditions.append({'datetime': {'$gte': dateStart.timestamp()}})
     if dateEnd is not None:
       conditions.append({'datetime': {'$lte': dateEnd.timestamp()}})
     if len(conditions) > 0:
-      items = collection.find({'$and': conditions})
+      return {'$and': conditions}
     else:
-      items = collection.find({})
+      return {}
+
+  def all(self, exchanger, dateStart=None, dateEnd=None, order=1):
+    collection = self.collections[exchanger]
+    items = collection.find(Ticks.conditionsOf(dateStart, dateEnd))
     items = items.sort('datetime', order)
     return (OneTick.fromDict(t) for t in items)
+
+  def columns(self, exchanger, dateStart=None, dateEnd=None, order=1,
+              fields=('datetime', 'ask', 'bid'),
+              batchSize=COLUMNS_BATCH_SIZE):
+    """
+    Returns a generator of dicts from field to np.array, same ticks as all.
+    """
+    collection = self.collections[exchanger]
+    conditions = Ticks.conditionsOf(dateStart, dateEnd)
+    return columnBatches(collection, conditions, fields,
+                         order=order, batchSize=batchSize)
   
   def save(self, exchanger, tick):
     collection = self.collections[exchanger]
@@ -53,7 +95,7 @@ class Ticks(object):
       condition = {'datetime': item['datetime']}
       reqs.append(ReplaceOne(condition, item, upsert=True))
       if len(reqs) >= batch_size:
-        collection.bulk_write(reqs)
+        collection.bulk_write(reqs, ordered=False)
         reqs = []
     if len(reqs) > 0:
       collection.bulk_write(reqs, ordered=False)
@@ -90,19 +132,33 @@ class Summaries(object):
       item = Summary.fromDict(item)
     return item
   
-  def all(self, exchanger, unit, before=None, after=None, order=1):
-    collection = self.getCollection(exchanger, unit)
+  @staticmethod
+  def conditionsOf(before=None, after=None):
     conditions = []
     if before is not None:
       conditions.append({'datetime': {'$lt': before}})
     if after is not None:
       conditions.append({'datetime': {'$gt': after}})
     if len(conditions) > 0:
-      conditions = {'$and': conditions}
+      return {'$and': conditions}
     else:
-      conditions = None
+      return None
+
+  def all(self, exchanger, unit, before=None, after=None, order=1):
+    collection = self.getCollection(exchanger, unit)
+    conditions = Summaries.conditionsOf(before, after)
     items = collection.find(conditions).sort('datetime', order)
     return (Summary.fromDict(t) for t in items)
+
+  def columns(self, exchanger, unit, before=None, after=None, order=1,
+              fields=SUMMARY_FIELDS, batchSize=COLUMNS_BATCH_SIZE):
+    """
+    Returns a generator of dicts from field to np.array, same summaries as all.
+    """
+    collection = self.getCollection(exchanger, unit)
+    conditions = Summaries.conditionsOf(before, after)
+    return columnBatches(collection, conditions, fields,
+                         order=order, batchSize=batchSize)
   
   def saveAll(self, exchanger, unit, sums):
     reqs = []
@@ -117,3 +173,21 @@ class Summaries(object):
     collection = self.getCollection(exchanger, unit)
     collection.remove({})
 
+
+class Checkpoints(object):
+  """
+  Open bars of summarization for each exchanger.
+  """
+  def __init__(self, db):
+    self.collection = db.summary_checkpoints
+    self.collection.create_index('exchanger')
+
+  def one(self, exchanger):
+    return self.collection.find_one({'exchanger': exchanger})
+
+  def save(self, exchanger, timestamp, bars):
+    item = {'exchanger': exchanger, 'datetime': timestamp, 'bars': bars}
+    self.collection.replace_one({'exchanger': exchanger}, item, upsert=True)
+
+  def clear(self, exchanger):
+    self.collection.delete_one({'exchanger': exchanger})
@@ -0,0 +1,205 @@
+import argparse
+import datetime
+import os
+import socket
+import time
+
+# Numpy
+import numpy as np
+
+from dsp import crosszero
+from features import FEATURES, loadFeatures, buildFeatures
+from learningUtils import zscore, loadModel, modelPaths
+from utils import readConfig, getLogger, getDashboardIf, StopWatch
+
+# Smoothed prediction at i uses predictions in [i-n, i-2]
+SMOOTH_SIZE = 11
+LIVE_WINDOWS = SMOOTH_SIZE * 2 + 2
+
+def smoothPredicted(y, n, z=None):
+  if z is None:
+    z = lambda i:i/n
+  f = np.zeros(n * 2)
+  for i in range(0, n):
+    f[n+i] = z(i)
+  f = f / np.sum(f)
+  y = np.convolve(y, f, mode='same')
+  return y
+
+def mtimeOf(path):
+  try:
+    return os.stat(path).st_mtime
+  except FileNotFoundError:
+    return None
+
+
+class Predictor(object):
+  """
+  Keeps the model and feature series in memory,
+  both are reloaded only when their files are updated.
+  """
+  def __init__(self, config, label='trend', specs=FEATURES, logger=None):
+    self.config = config
+    self.label = label
+    self.specs = specs
+    self.sampleSize = config['predict'].getint('fitting.inputsize')
+    self.logger = logger
+    self.model = None
+    self.modelVersion = None
+    self.series = [None] * len(specs)
+
+  def refreshModel(self):
+    version = tuple(mtimeOf(p) for p in modelPaths(self.config, self.label))
+    if version == self.modelVersion:
+      return False
+    # Model may be being saved by train.py, keep the old one until it loads
+    try:
+      model = loadModel(self.config, self.label)
+    except Exception as e:
+      if self.model is None:
+        raise
+      self.logger.warning('Failed to reload model, e={e}.'.format(e=e))
+      return False
+    self.model = model
+    self.modelVersion = version
+    self.logger.info('Model loaded, label={l}.'.format(l=self.label))
+    return True
+
+  def refreshSeries(self):
+    # Series are the same objects until their files are updated
+    series = loadFeatures(self.config, self.specs, nan=0.)
+    count = sum(1 for x, y in zip(series, self.series) if x is not y)
+    self.series = series
+    if count > 0:
+      self.logger.debug('Series reloaded, #series={n}.'.format(n=count))
+    return count
+
+  def predict(self, tail=LIVE_WINDOWS):
+    """
+    (self: Predictor, tail: int?) -> (yPred, yAvr, yZero)
+    """
+    self.refreshModel()
+    self.refreshSeries()
+    Xbh = buildFeatures(self.series, self.specs, self.sampleSize, tail=tail)
+    yPred = self.model.predict(zscore(Xbh))[:,0]
+    yAvr = smoothPredicted(yPred, SMOOTH_SIZE)
+    yZero = crosszero(yAvr - 0.5, thres=5e-3)
+    return yPred, yAvr, yZero
+
+
+class PredictorServer(object):
+  """
+  Runs prediction for each request on a Unix socket,
+  and every `interval` seconds if it is given whatever requests come.
+  """
+  CommandPredict = 'predict'
+
+  def __init__(self, predictor, path, dashb, interval=None, logger=None):
+    self.predictor = predictor
+    self.path = path
+    self.dashb = dashb
+    self.interval = interval
+    self.logger = logger
+    self.stopped = False
+
+  def runOnce(self):
+    timer = StopWatch()
+    timer.start()
+    yPred, yAvr, yZero = self.predictor.predict()
+    yTrend = yPred[-1].item()
+    self.logger.warning(('Current predicts are trend={trend:0.2f}, ' +
+                         'smoothed={avr:0.2f}, signal={zero:+.0f}.')
+                        .format(trend=yTrend, avr=yAvr[-1], zero=yZero[-1]))
+    self.dashb.saveTrend(datetime.datetime.now(), yTrend)
+    seconds = timer.stop()
+    self.logger.debug('End prediction, elapsed={s:.2f}s'.format(s=seconds))
+    return yTrend
+
+  def handle(self, conn):
+    command = conn.recv(1024).decode().strip()
+    if command != PredictorServer.CommandPredict:
+      conn.sendall('error unknown command\n'.encode())
+      return
+    try:
+      yTrend = self.runOnce()
+      conn.sendall('ok {t:.3f}\n'.format(t=yTrend).encode())
+    except Exception as e:
+      self.logger.exception('Prediction failed, e={e}.'.format(e=e))
+      conn.sendall('error {e}\n'.format(e=e).encode())
+
+  def serve(self):
+    if os.path.exists(self.path):
+      os.remove(self.path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(self.path)
+    server.listen(1)
+    server.settimeout(self.interval)
+    self.logger.info('Predictor listening, path={p}.'.format(p=self.path))
+    # Interval runs are due by time, so requests do not postpone them
+    nextTime = None
+    if self.interval is not None:
+      nextTime = time.monotonic() + self.interval
+    try:
+      while not self.stopped:
+        if nextTime is not None:
+          server.settimeout(max(0., nextTime - time.monotonic()))
+        try:
+          conn, _ = server.accept()
+        except socket.timeout:
+          conn = None
+        if conn is not None:
+          with conn:
+            self.handle(conn)
+        if nextTime is not None and time.monotonic() >= nextTime:
+          nextTime = time.monotonic() + self.interval
+          try:
+            self.runOnce()
+          except Exception as e:
+            self.logger.exception('Prediction failed, e={e}.'.format(e=e))
+    finally:
+      server.close()
+      os.remove(self.path)
+
+  def stop(self):
+    """
+    Stops serving after the current request or interval.
+    """
+    self.stopped = True
+
+
+def trigger(path):
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  with client:
+    client.connect(path)
+    client.sendall((PredictorServer.CommandPredict + '\n').encode())
+    return client.recv(1024).decode().strip()
+
+def main():
+  parser = argparse.ArgumentParser(description='Prediction service.')
+  parser.add_argument('--trigger', action='store_true',
+                      help='request a running service to predict')
+  args = parser.parse_args()
+  config = readConfig('predict.ini')
+  path = config['predictor'].get('socket.path')
+  if args.trigger:
+    try:
+      result = trigger(path)
+    except OSError as e:
+      result = 'error no predictor service, e={e}'.format(e=e)
+    print(result)
+    if not result.startswith('ok'):
+      exit(1)
+    return
+  logger = getLogger()
+  interval = config['predictor'].getfloat('interval.seconds', fallback=0.)
+  if interval <= 0:
+    interval = None
+  predictor = Predictor(config, logger=logger)
+  predictor.refreshModel()
+  dashb = getDashboardIf(config, logger=logger)
+  server = PredictorServer(predictor, path, dashb,
+                           interval=interval, logger=logger)
+  server.serve()
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,240 @@
+import json
+import os
+import numpy as np
+
+# A series file holds columns of an exchanger and unit aligned by timestamp,
+# row i is at start + i * step. The file is a header, a manifest of columns
+# padded to be updated in place, and a block of `capacity` float64 values
+# for each column. Column values are rows [first, first + length).
+# The manifest has a version counted up on each write, for caches of
+# columns to tell writes in place.
+MAGIC = b'SERIES02'
+HEADER = np.dtype([('magic', 'S8'),
+                   ('start', '<f8'),
+                   ('step', '<f8'),
+                   ('length', '<i8'),
+                   ('capacity', '<i8'),
+                   ('manifestSize', '<i8')])
+DTYPE = np.dtype('<f8')
+MANIFEST_ALIGN = 4096
+MANIFEST_SPARE = 1024
+CAPACITY_ALIGN = 4096
+
+
+def alignUp(n, align):
+  return (n + align - 1) // align * align
+
+
+class Series(object):
+  """
+  Header and manifest of a series file.
+  columns: list of [name, first, length].
+  """
+  def __init__(self, start, step, length, capacity, columns,
+               manifestSize=None, version=0):
+    self.start = start
+    self.step = step
+    self.length = length
+    self.capacity = capacity
+    self.columns = columns
+    self.version = version
+    if manifestSize is None:
+      manifestSize = alignUp(len(self.manifest()) + MANIFEST_SPARE,
+                             MANIFEST_ALIGN)
+    self.manifestSize = manifestSize
+
+  def end(self):
+    """
+    Returns timestamp of the last row.
+    """
+    return self.start + (self.length - 1) * self.step
+
+  def indexOf(self, timestamp):
+    """
+    Returns row of timestamp, or None if it is not on a step.
+    """
+    i = (timestamp - self.start) / self.step
+    if abs(i - round(i)) > 1e-6:
+      return None
+    return int(round(i))
+
+  def names(self):
+    return [c[0] for c in self.columns]
+
+  def columnOf(self, name):
+    """
+    Returns (block index, first, length) of a column.
+    """
+    for k, (n, first, length) in enumerate(self.columns):
+      if n == name:
+        return k, first, length
+    raise KeyError('no column in series, name={n}.'.format(n=name))
+
+  def dataOffset(self):
+    return HEADER.itemsize + self.manifestSize
+
+  def manifest(self):
+    return json.dumps({'columns': self.columns,
+                       'version': self.version}).encode()
+
+  def toBytes(self):
+    header = np.array([(MAGIC, self.start, self.step, self.length,
+                        self.capacity, self.manifestSize)], dtype=HEADER)
+    return header.tobytes() + self.manifest().ljust(self.manifestSize)
+
+  @staticmethod
+  def fromFile(f):
+    header = np.frombuffer(f.read(HEADER.itemsize), dtype=HEADER)[0]
+    if header['magic'] != MAGIC:
+      raise ValueError('not a series file, magic={m}.'
+                       .format(m=header['magic']))
+    manifestSize = header['manifestSize'].item()
+    manifest = json.loads(f.read(manifestSize).decode())
+    return Series(header['start'].item(), header['step'].item(),
+                  header['length'].item(), header['capacity'].item(),
+                  manifest['columns'], manifestSize=manifestSize,
+                  version=manifest.get('version', 0))
+
+  def __str__(self):
+    return ('Series(start={s}, step={st}, length={n}, columns={c})'
+            .format(s=self.start, st=self.step, n=self.length,
+                    c=self.names()))
+
+
+def readSeries(path):
+  """
+  Returns header and manifest of a series file, or None if there is no file.
+  """
+  try:
+    with open(path, 'rb') as f:
+      return Series.fromFile(f)
+  except FileNotFoundError:
+    return None
+
+def openSeries(path, mode='r'):
+  """
+  Returns series and blocks of columns memory-mapped with mode of np.memmap.
+  """
+  series = readSeries(path)
+  if series is None:
+    raise FileNotFoundError('no series file, path={p}.'.format(p=path))
+  shape = (len(series.columns), series.capacity)
+  if shape[0] * shape[1] == 0:
+    return series, np.zeros(shape, dtype=DTYPE)
+  blocks = np.memmap(path, dtype=DTYPE, mode=mode,
+                     offset=series.dataOffset(), shape=shape)
+  return series, blocks
+
+def readColumns(path, names, mode='r'):
+  """
+  Returns values of columns in a series file, mapped at once.
+  """
+  series, blocks = openSeries(path, mode=mode)
+  columns = []
+  for name in names:
+    k, first, length = series.columnOf(name)
+    columns.append(blocks[k,first:first+length])
+  return columns
+
+def writeSeries(path, start, step, length, columns):
+  """
+  Replaces a series file at once.
+  columns: dict from name to (first, values).
+  """
+  old = readSeries(path)
+  version = 0 if old is None else old.version + 1
+  capacity = alignUp(length + length // 4 + 1, CAPACITY_ALIGN)
+  manifest = [[name, first, len(values)]
+              for name, (first, values) in columns.items()]
+  series = Series(start, step, length, capacity, manifest, version=version)
+  tmpPath = path + '.tmp'
+  with open(tmpPath, 'wb') as f:
+    f.write(series.toBytes())
+    for first, values in columns.values():
+      block = np.full(capacity, np.nan, dtype=DTYPE)
+      block[first:first+len(values)] = values
+      f.write(block.tobytes())
+  os.replace(tmpPath, path)
+  return series
+
+def loadAll(path):
+  """
+  Returns series and all of columns as dict from name to (first, values).
+  """
+  series, blocks = openSeries(path)
+  columns = {}
+  for k, (name, first, length) in enumerate(series.columns):
+    columns[name] = (first, np.array(blocks[k,first:first+length]))
+  return series, columns
+
+def appendSeries(path, index, columns):
+  """
+  Writes values of columns from row index, replacing the rest of them.
+  Values are written in place if blocks and manifest have room, and then
+  header and manifest are updated, otherwise the file is written again.
+  columns: dict from name to values.
+  """
+  series = readSeries(path)
+  if index < 0 or index > series.length:
+    raise IndexError('index out of series, index={i}, {s}.'
+                     .format(i=index, s=series))
+  manifest = [list(c) for c in series.columns]
+  inPlace = True
+  for name, values in columns.items():
+    if name not in series.names():
+      inPlace = False
+      continue
+    k, first, length = series.columnOf(name)
+    inPlace = inPlace and first <= index <= first + length
+    manifest[k] = [name, first, index + len(values) - first]
+  length = max([series.length] + [first + n for _, first, n in manifest])
+  updated = Series(series.start, series.step, length, series.capacity,
+                   manifest, manifestSize=series.manifestSize,
+                   version=series.version + 1)
+  inPlace = (inPlace and length <= series.capacity and
+             len(updated.manifest()) <= series.manifestSize)
+  if not inPlace:
+    _, olds = loadAll(path)
+    for name, values in columns.items():
+      first, old = olds.get(name, (index, np.zeros(0)))
+      first = min(first, index)
+      head = np.full(index - first, np.nan)
+      head[:len(old)] = old[:index-first]
+      olds[name] = (first, np.concatenate([head, values]))
+    length = max(first + len(values) for first, values in olds.values())
+    return writeSeries(path, series.start, series.step, length, olds)
+  with open(path, 'r+b') as f:
+    for name, values in columns.items():
+      k, _, _ = series.columnOf(name)
+      values = np.ascontiguousarray(values, dtype=DTYPE)
+      f.seek(series.dataOffset() +
+             (k * series.capacity + index) * DTYPE.itemsize)
+      f.write(values.tobytes())
+    f.flush()
+    f.seek(0)
+    f.write(updated.toBytes())
+  return updated
+
+def saveColumns(path, columns, start=np.nan, step=np.nan):
+  """
+  Writes columns whose last values are at the last row, other columns
+  are kept. The series is created if there is no file.
+  columns: dict from name to values.
+  """
+  series = readSeries(path)
+  if series is None:
+    olds = {}
+    length = max(len(v) for v in columns.values())
+  else:
+    _, olds = loadAll(path)
+    start, step, length = series.start, series.step, series.length
+  # Rows are added before the first one for longer columns
+  shift = max(0, max(len(v) for v in columns.values()) - length)
+  if shift > 0:
+    start = start - shift * step
+    length += shift
+    olds = {name: (first + shift, values)
+            for name, (first, values) in olds.items()}
+  for name, values in columns.items():
+    olds[name] = (length - len(values), values)
+  return writeSeries(path, start, step, length, olds)
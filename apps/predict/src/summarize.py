@@ -1,8 +1,12 @@
+import argparse
+import collections
 import datetime
+import os
+import time
 import numpy as np
 from classes import Summary
-from models import Ticks, Summaries
-from utils import readConfig, getDBInstance, getLogger, group, StopWatch
+from models import Ticks, Summaries, Checkpoints
+from utils import readConfig, getDBInstance, getLogger, StopWatch
 
 logger = getLogger()
 config = readConfig('predict.ini')
@@ -10,23 +14,6 @@ config = readConfig('predict.ini')
 EXCHANGERS = config['summarize'].getlist('exchangers')
 UNITS = ['minutely', 'hourly', 'daily', 'weekly']
 
-def summarizeTicks(allTicks, extractKey, itemsEnd, maxCount):
-  asks = np.zeros(maxCount)
-  for key, g in group(extractKey, allTicks):
-    logger.debug('New group, size={size}, key={key}, start={start}'
-                 .format(size=len(g), key=key, start=g[0].date))
-    n = len(g)
-    for i in range(0, n):
-      asks[i] = g[i].ask
-    date = datetime.datetime(*key)
-    itemsEnd = min(n, itemsEnd)
-    yield Summary(date=date,
-                  askMax=np.max(asks[:n]),
-                  askMin=np.min(asks[:n]),
-                  askAverage=np.average(asks[:n]),
-                  askOpen=np.mean(asks[0:itemsEnd]),
-                  askClose=np.mean(asks[n-itemsEnd:n]))
-
 def keyMinute(d):
   return (d.date.year, d.date.month, d.date.day, d.date.hour, d.date.minute)
 
@@ -41,30 +28,455 @@ def keyWeek(d):
   d = d.date - weekDelta
   return (d.year, d.month, d.day)
 
-def ticksBy(ticks, exchanger, unit, dateStart=None):
-  allTicks = ticks.all(exchanger, dateStart=dateStart)
-  if unit == 'minutely':
-    extractKey = keyMinute
-    itemsEnd = 8
-    maxCount = int(60)
-  elif unit == 'hourly':
-    extractKey = keyHour
-    itemsEnd = 16
-    maxCount = int(60 * 60)
-  elif unit == 'daily':
-    extractKey = keyDate
-    itemsEnd = 16 * 60
-    maxCount = int(24 * 60 * 60)
-  elif unit == 'weekly':
-    extractKey = keyWeek
-    itemsEnd = 16 * 60 * 60
-    maxCount = int(7 * 24 * 60 * 60)
+KEYS = {
+  'minutely': keyMinute,
+  'hourly': keyHour,
+  'daily': keyDate,
+  'weekly': keyWeek
+}
+
+ITEMS_END = {
+  'minutely': 8,
+  'hourly': 16,
+  'daily': 16 * 60,
+  'weekly': 16 * 60 * 60
+}
+
+# Format of bars in checkpoints, older ones kept asks of sub bars
+# only in the sub bars.
+CHECKPOINT_VERSION = 2
+
+SAVE_BATCH_SIZE = 4096
+
+# Units of $dateTrunc for each summary unit
+TRUNC_UNITS = {
+  'minutely': 'minute',
+  'hourly': 'hour',
+  'daily': 'day',
+  'weekly': 'week'
+}
+
+
+class Bar(object):
+  """
+  Running summary of asks in a period. Only the first and last `keep` asks
+  are kept for open and close, so memory does not grow with ticks.
+  """
+  def __init__(self, date, keep=0):
+    self.date = date
+    self.keep = keep
+    self.askMax = -np.inf
+    self.askMin = np.inf
+    self.askSum = 0.
+    self.count = 0
+    self.heads = []
+    self.tails = collections.deque(maxlen=keep)
+
+  def add(self, ask):
+    self.askMax = max(self.askMax, ask)
+    self.askMin = min(self.askMin, ask)
+    self.askSum += ask
+    self.count += 1
+    self.addEnds(ask)
+
+  def addEnds(self, ask):
+    """
+    Adds an ask only to open and close.
+    """
+    if len(self.heads) < self.keep:
+      self.heads.append(ask)
+    self.tails.append(ask)
+
+  def merge(self, bar, ends=True):
+    """
+    Merges a later bar, its asks for open and close are merged
+    only if `ends`.
+    """
+    self.askMax = max(self.askMax, bar.askMax)
+    self.askMin = min(self.askMin, bar.askMin)
+    self.askSum += bar.askSum
+    self.count += bar.count
+    if ends:
+      self.heads.extend(bar.heads[:self.keep - len(self.heads)])
+      self.tails.extend(bar.tails)
+
+  def summary(self, itemsEnd):
+    itemsEnd = min(self.count, itemsEnd)
+    heads = self.heads[:itemsEnd]
+    tails = list(self.tails)[len(self.tails)-itemsEnd:]
+    return Summary(date=self.date,
+                   askMax=self.askMax,
+                   askMin=self.askMin,
+                   askAverage=self.askSum / self.count,
+                   askOpen=np.mean(heads),
+                   askClose=np.mean(tails))
+
+  def toDict(self):
+    return {
+      'datetime': self.date.timestamp(),
+      'ask_max': self.askMax,
+      'ask_min': self.askMin,
+      'ask_sum': self.askSum,
+      'count': self.count,
+      'heads': self.heads,
+      'tails': list(self.tails)
+    }
+
+  @staticmethod
+  def fromDict(d, keep):
+    if d is None:
+      return None
+    bar = Bar(datetime.datetime.fromtimestamp(d['datetime']), keep=keep)
+    bar.askMax = d['ask_max']
+    bar.askMin = d['ask_min']
+    bar.askSum = d['ask_sum']
+    bar.count = d['count']
+    bar.heads = d['heads'][:bar.keep]
+    bar.tails.extend(d['tails'])
+    return bar
+
+
+class Cascade(object):
+  """
+  Rolls ticks into minute bars in a single pass, then closed minute bars
+  into hourly bars, hourly into daily and daily into weekly ones.
+  Asks for open and close are added to the open bar of each unit at once,
+  so a bar keeps only as many of them as its unit needs.
+  """
+  def __init__(self, bars=None):
+    if bars is None:
+      bars = {unit: None for unit in UNITS}
+    self.bars = bars
+    self.closed = {unit: [] for unit in UNITS}
+    # Timestamp of the open minute bar, known after the first roll
+    self.minuteStart = -np.inf
+    # Open bars other than the minute one
+    self.uppers = []
+
+  def addTick(self, tick):
+    self.addAsk(tick.date.timestamp(), tick.ask)
+
+  def addAsk(self, timestamp, ask):
+    """
+    Adds an ask at timestamp, dates are built only when the minute changes.
+    """
+    if not self.minuteStart <= timestamp < self.minuteStart + 60:
+      date = datetime.datetime.fromtimestamp(timestamp)
+      key = keyMinute(Bar(date))
+      bar = self.rollAll(datetime.datetime(*key))
+      self.minuteStart = bar.date.timestamp()
+    self.bars['minutely'].add(ask)
+    for bar in self.uppers:
+      bar.addEnds(ask)
+
+  def rollAll(self, date):
+    """
+    Rolls bars of all units to date, so that a bar is closed as soon as
+    its period ends, and returns the open minute bar.
+    """
+    for i in range(0, len(UNITS)):
+      self.roll(i, date)
+    self.uppers = [self.bars[unit] for unit in UNITS[1:]]
+    return self.bars['minutely']
+
+  def roll(self, i, date):
+    """
+    Closes the open bar of UNITS[i] if it is out of date,
+    returns the open bar including date.
+    """
+    unit = UNITS[i]
+    key = KEYS[unit](Bar(date))
+    bar = self.bars[unit]
+    if bar is not None and KEYS[unit](bar) != key:
+      self.close(i)
+      bar = None
+    if bar is None:
+      bar = Bar(datetime.datetime(*key), keep=ITEMS_END[unit])
+      self.bars[unit] = bar
+    return bar
+
+  def close(self, i):
+    unit = UNITS[i]
+    bar = self.bars[unit]
+    self.bars[unit] = None
+    self.closed[unit].append(bar.summary(ITEMS_END[unit]))
+    if i + 1 < len(UNITS):
+      # An open parent has the asks already, a new one takes them
+      parent = self.bars[UNITS[i+1]]
+      fresh = (parent is None or
+               KEYS[UNITS[i+1]](parent) != KEYS[UNITS[i+1]](bar))
+      self.roll(i + 1, bar.date).merge(bar, ends=fresh)
+
+  def partials(self):
+    """
+    Returns summaries of open bars of each unit including their open sub
+    bars. An open bar whose period ended before its sub bars, as in
+    checkpoints of older runs, is returned as it is before a new one.
+    """
+    sums = {}
+    subs = []
+    for unit in UNITS:
+      keep = ITEMS_END[unit]
+      bars = []
+      if self.bars[unit] is not None:
+        bars.append(Bar(self.bars[unit].date, keep=keep))
+        bars[0].merge(self.bars[unit])
+      for sub in subs:
+        key = KEYS[unit](sub)
+        if len(bars) == 0 or KEYS[unit](bars[-1]) != key:
+          bars.append(Bar(datetime.datetime(*key), keep=keep))
+        # Asks of sub bars are in the open bar already
+        bars[-1].merge(sub, ends=len(bars) > 1 or self.bars[unit] is None)
+      bars = [bar for bar in bars if bar.count > 0]
+      if len(bars) == 0:
+        break
+      sums[unit] = [bar.summary(ITEMS_END[unit]) for bar in bars]
+      subs = bars
+    return sums
+
+  def countClosed(self):
+    return sum(len(self.closed[unit]) for unit in UNITS)
+
+  def popClosed(self):
+    closed = self.closed
+    self.closed = {unit: [] for unit in UNITS}
+    return closed
+
+  def toDict(self):
+    d = {unit: bar.toDict() if bar is not None else None
+         for unit, bar in self.bars.items()}
+    d['version'] = CHECKPOINT_VERSION
+    return d
+
+  @staticmethod
+  def fromDict(d):
+    if d.get('version') != CHECKPOINT_VERSION:
+      # Asks of open sub bars are added to their open parents
+      d = dict(d)
+      for sub, unit in zip(UNITS[:-1], UNITS[1:]):
+        old, bar = Bar.fromDict(d.get(sub), 0), Bar.fromDict(d.get(unit), 0)
+        if old is not None and bar is not None and \
+           KEYS[unit](old) == KEYS[unit](bar):
+          d[unit] = dict(d[unit], heads=d[unit]['heads'] + d[sub]['heads'],
+                         tails=d[unit]['tails'] + d[sub]['tails'])
+    bars = {unit: Bar.fromDict(d.get(unit), ITEMS_END[unit])
+            for unit in UNITS}
+    return Cascade(bars)
+
+
+def saveClosed(summaries, exchanger, cascade):
+  for unit, sums in cascade.popClosed().items():
+    if len(sums) > 0:
+      summaries.saveAll(exchanger, unit, sums)
+
+def summarize(ticks, summaries, checkpoints, exchanger):
+  """
+  Summarizes ticks after the checkpoint of exchanger, or after the start of
+  the latest week if there is no checkpoint.
+  """
+  checkpoint = checkpoints.one(exchanger)
+  if checkpoint is not None:
+    cascade = Cascade.fromDict(checkpoint['bars'])
+    last = checkpoint['datetime']
+    start = datetime.datetime.fromtimestamp(last)
   else:
-    raise Exception('unknown unit, {unit}'.format(unit=unit))
-  return summarizeTicks(allTicks, extractKey, itemsEnd, maxCount)
+    cascade = Cascade()
+    last = None
+    latest = summaries.one(exchanger, 'weekly')
+    start = latest.date if latest is not None else None
+  count = 0
+  for chunk in ticks.columns(exchanger, dateStart=start,
+                             fields=('datetime', 'ask')):
+    timestamps, asks = chunk['datetime'], chunk['ask']
+    if last is not None:
+      newer = timestamps > last
+      timestamps, asks = timestamps[newer], asks[newer]
+    if len(timestamps) == 0:
+      continue
+    for timestamp, ask in zip(timestamps.tolist(), asks.tolist()):
+      cascade.addAsk(timestamp, ask)
+      if cascade.countClosed() >= SAVE_BATCH_SIZE:
+        saveClosed(summaries, exchanger, cascade)
+    last = timestamps[-1].item()
+    count += len(timestamps)
+  logger.info('Saving summary, exchanger={e}, #ticks={n}...'
+              .format(e=exchanger, n=count))
+  saveClosed(summaries, exchanger, cascade)
+  for unit, sums in cascade.partials().items():
+    summaries.saveAll(exchanger, unit, sums)
+  if last is not None:
+    checkpoints.save(exchanger, last, cascade.toDict())
+
+
+def localTimezone():
+  """
+  Returns the Olson name of the zone of KEYS for $dateTrunc, fixed offsets
+  of time.strftime('%z') are wrong across DST.
+  """
+  name = config['summarize'].get('timezone', '') or \
+         os.environ.get('TZ', '').lstrip(':')
+  if name == '' or name.startswith('/'):
+    # Zone files are linked from /etc/localtime on most systems
+    path = os.path.realpath(name or '/etc/localtime')
+    name = path.split('zoneinfo/', 1)[1] if 'zoneinfo/' in path else ''
+  if name == '':
+    if time.tzname[0] != 'UTC' or time.daylight:
+      raise ValueError('unknown local timezone, set [summarize] timezone')
+    name = 'UTC'
+  return name
+
+def truncatedDate(unit, timezone):
+  """
+  Returns an expression of the local beginning of the bar including a tick,
+  same as KEYS.
+  """
+  trunc = {
+    'date': {'$toDate': {'$multiply': ['$datetime', 1000]}},
+    'unit': TRUNC_UNITS[unit],
+    'timezone': timezone
+  }
+  if unit == 'weekly':
+    trunc['startOfWeek'] = 'monday'
+  return {'$dateTrunc': trunc}
+
+def pipelineOf(unit, start=None, timezone=None):
+  """
+  Returns an aggregation pipeline summarizing ticks after `start` into bars
+  of unit, open and close are averages of the first and last itemsEnd asks.
+  """
+  if timezone is None:
+    timezone = localTimezone()
+  itemsEnd = ITEMS_END[unit]
+  pipeline = []
+  if start is not None:
+    pipeline.append({'$match': {'datetime': {'$gte': start.timestamp()}}})
+  pipeline += [
+    {'$sort': {'datetime': 1}},
+    {'$group': {
+      '_id': truncatedDate(unit, timezone),
+      'ask_max': {'$max': '$ask'},
+      'ask_min': {'$min': '$ask'},
+      'ask_average': {'$avg': '$ask'},
+      'heads': {'$firstN': {'input': '$ask', 'n': itemsEnd}},
+      'tails': {'$lastN': {'input': '$ask', 'n': itemsEnd}}
+    }},
+    {'$sort': {'_id': 1}},
+    {'$project': {
+      '_id': 0,
+      'datetime': {'$divide': [{'$toLong': '$_id'}, 1000]},
+      'ask_max': 1,
+      'ask_min': 1,
+      'ask_average': 1,
+      'ask_open': {'$avg': '$heads'},
+      'ask_close': {'$avg': '$tails'}
+    }}
+  ]
+  return pipeline
+
+def aggregateUnit(ticks, exchanger, unit, start=None):
+  """
+  Returns a generator of summaries of unit computed by mongod.
+  """
+  collection = ticks.getCollection(exchanger)
+  items = collection.aggregate(pipelineOf(unit, start=start),
+                               allowDiskUse=True)
+  return (Summary.fromDict(item) for item in items)
+
+def aggregate(ticks, summaries, exchanger):
+  """
+  Summarizes ticks in the database server, bars from the latest saved one
+  are rebuilt for each unit.
+  """
+  for unit in UNITS:
+    latest = summaries.one(exchanger, unit)
+    start = latest.date if latest is not None else None
+    count = 0
+    sums = []
+    for s in aggregateUnit(ticks, exchanger, unit, start=start):
+      sums.append(s)
+      if len(sums) >= SAVE_BATCH_SIZE:
+        summaries.saveAll(exchanger, unit, sums)
+        count += len(sums)
+        sums = []
+    summaries.saveAll(exchanger, unit, sums)
+    count += len(sums)
+    logger.info('Saved summary, exchanger={e}, unit={u}, #summaries={n}.'
+                .format(e=exchanger, u=unit, n=count))
+
+
+def collectPython(ticks, exchanger, start):
+  cascade = Cascade()
+  for chunk in ticks.columns(exchanger, dateStart=start,
+                             fields=('datetime', 'ask')):
+    for timestamp, ask in zip(chunk['datetime'].tolist(),
+                              chunk['ask'].tolist()):
+      cascade.addAsk(timestamp, ask)
+  sums = cascade.popClosed()
+  for unit, partials in cascade.partials().items():
+    sums[unit].extend(partials)
+  return sums
+
+def collectAggregate(ticks, exchanger, start):
+  return {unit: list(aggregateUnit(ticks, exchanger, unit, start=start))
+          for unit in UNITS}
+
+def compareSummaries(expected, actual):
+  """
+  Returns the number of bars found in only one side and
+  the largest absolute difference of values.
+  """
+  expected = {s.date.timestamp(): s for s in expected}
+  actual = {s.date.timestamp(): s for s in actual}
+  missing = len(set(expected) ^ set(actual))
+  diff = 0.
+  for t in set(expected) & set(actual):
+    e, a = expected[t], actual[t]
+    diff = max(diff,
+               abs(e.askMax - a.askMax), abs(e.askMin - a.askMin),
+               abs(e.askAverage - a.askAverage),
+               abs(e.askOpen - a.askOpen), abs(e.askClose - a.askClose))
+  return missing, diff
+
+def compare(ticks, summaries, exchanger, start=None):
+  """
+  Runs both backends on ticks after `start` without saving,
+  and reports their elapsed times and differences.
+  Returns a dict from unit to #missing bars and the largest difference.
+  """
+  if start is None:
+    latest = summaries.one(exchanger, 'weekly')
+    start = latest.date if latest is not None else None
+  timer = StopWatch()
+  timer.start()
+  expected = collectPython(ticks, exchanger, start)
+  secondsPython = timer.stop()
+  timer.start()
+  actual = collectAggregate(ticks, exchanger, start)
+  secondsAggregate = timer.stop()
+  logger.info(('Compared backends, exchanger={e}, ' +
+               'python={p:.2f}s, aggregate={a:.2f}s.')
+              .format(e=exchanger, p=secondsPython, a=secondsAggregate))
+  differences = {}
+  for unit in UNITS:
+    missing, diff = compareSummaries(expected[unit], actual[unit])
+    differences[unit] = (missing, diff)
+    logger.info(('Differences, exchanger={e}, unit={u}, #bars={n}, ' +
+                 '#missing={m}, max={d:.6f}.')
+                .format(e=exchanger, u=unit, n=len(expected[unit]),
+                        m=missing, d=diff))
+  return differences
 
 
 def main():
+  parser = argparse.ArgumentParser(description='Summarize ticks.')
+  parser.add_argument('--backend', choices=['python', 'aggregate'],
+                      default=config['summarize'].get('backend', 'python'),
+                      help='where ticks are summarized')
+  parser.add_argument('--compare', action='store_true',
+                      help='compare outputs and timings of both backends')
+  parser.add_argument('--since', type=datetime.datetime.fromisoformat,
+                      help='first date of ticks to compare')
+  args = parser.parse_args()
   # Measure run time
   timer = StopWatch()
   timer.start()
@@ -72,18 +484,16 @@ def main():
   db = getDBInstance(config)
   ticks = Ticks(db.tick_db)
   summaries = Summaries(db.tick_summary_db)
+  checkpoints = Checkpoints(db.tick_summary_db)
   for exchanger in EXCHANGERS:
-    for unit in UNITS:
-      logger.debug('Summarizing, exchanger={exchanger}, unit={unit}.'
-                   .format(exchanger=exchanger, unit=unit))
-      latest = summaries.one(exchanger, unit)
-      if latest is not None:
-        start = latest.date
-      else:
-        start = None
-      sums = ticksBy(ticks, exchanger, unit, dateStart=start)
-      logger.info('Saving summary...')
-      summaries.saveAll(exchanger, unit, sums)
+    logger.debug('Summarizing, exchanger={exchanger}.'
+                 .format(exchanger=exchanger))
+    if args.compare:
+      compare(ticks, summaries, exchanger, start=args.since)
+    elif args.backend == 'aggregate':
+      aggregate(ticks, summaries, exchanger)
+    else:
+      summarize(ticks, summaries, checkpoints, exchanger)
   # Finished
   seconds = timer.stop()
   logger.debug('End summarization, elapsed={s:.2f}s'.format(s=seconds))
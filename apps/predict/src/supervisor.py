@@ -1,3 +1,6 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 # Numpy
 import numpy as np
 
@@ -9,7 +12,7 @@ import matplotlib.pyplot as plt
 from charts import RSI, BollingerBand, Ichimoku
 from dsp import lpfilter, crosszero
 from learningUtils import sigmoid, differentiate
-from utils import readConfig, getLogger, loadnpy, savenpy, nanIn, StopWatch
+from utils import readConfig, getLogger, loadnpy, savecolumns, nanIn, StopWatch
 
 logger = getLogger()
 config = readConfig('predict.ini')
@@ -17,89 +20,131 @@ config = readConfig('predict.ini')
 DIR_DATA = config['supervisor'].get('data.dir')
 EXCHANGERS = config['supervisor'].getlist('exchangers')
 UNITS = config['supervisor'].getlist('units')
+# Number of processes running jobs, 0 to use all cores
+WORKERS = config['supervisor'].getint('workers', fallback=1)
 
 def load(exchanger, unit, ty):
-  return loadnpy(config, exchanger, unit, ty)
-
-def save(data, exchanger, unit, ty):
-  savenpy(config, data, exchanger, unit, ty)
-
-def ranges(lst, f=lambda x:x, indexEnd=-1):
-  indexStart = 0
-  lastKey = None
-  for item in lst:
-    index, key = f(item)
-    if lastKey is not None and lastKey != key:
-      yield {'start': indexStart, 'end': index, 'key': lastKey}
-      indexStart = index + 1
-    lastKey = key
-  yield {'start': indexStart, 'end': indexEnd, 'key': lastKey}
+  # runAnswer fills NaN in place, rows exported after the last run
+  # are read to generate series of them
+  return np.array(loadnpy(config, exchanger, unit, ty, aligned=False))
+
+def runs(v2):
+  """
+  Returns first indexes and keys of runs of peeks with the same key.
+  v2: peeks vector with +1(local maximum) and -1(local minimum).
+  """
+  ks = np.where((v2 >= +1.) | (v2 <= -1.))[0]
+  keys = np.where(v2[ks] >= +1., +1, -1)
+  firsts = np.concatenate([[0], np.where(np.diff(keys) != 0)[0] + 1])
+  return ks[firsts], keys[firsts]
 
 def rectify(v1, v2):
   """
   Returns new vector where local maximum and mimimum alternate with even ones.
-  v1: a base tick data.
+  v1: a base tick data without NaN.
   v2: peeks vector with +1(local maximum) and -1(local minimum).
   """
-  k1 = [(k, +1) for k in np.where(v2 >= +1.)[0]]
-  k2 = [(k, -1) for k in np.where(v2 <= -1.)[0]]
-  ks = sorted(k1 + k2, key=lambda a:a[0])
   w = np.zeros(v1.shape)
-  rs = list(ranges(ks, indexEnd=len(v1)))
+  n = v1.shape[0]
+  firsts, keys = runs(v2)
+  if len(keys) == 0:
+    return w
+  # Extremum of each run is searched from the previous extremum to the first
+  # peek of the next run; the fixed part [starts[i], starts[i+1]) is reduced
+  # at once and only the head before it is left to each run.
+  starts = np.concatenate([[0], firsts[1:]])
+  sizes = np.diff(np.concatenate([starts, [n]]))
+  segments = np.where(keys == +1,
+                      np.maximum.reduceat(v1, starts),
+                      np.minimum.reduceat(v1, starts))
+  hits = np.where(v1 == np.repeat(segments, sizes))[0]
+  segmentsAt = hits[np.searchsorted(hits, starts)].tolist()
+  segments = segments.tolist()
+  nexts = v1[starts[1:]].tolist() + [None]
+  starts = starts.tolist()
   k = None
-  for i in range(0, len(rs)):
-    if k is None:
-      start = rs[i]['start']
-    else:
-      start = k
-    end = rs[i]['end']
-    peek = rs[i]['key']
-    if peek == +1:
-      k = np.argmax(v1[start:end+1]) + start
-    else:
-      k = np.argmin(v1[start:end+1]) + start
+  for i, peek in enumerate(keys.tolist()):
+    j, vj = segmentsAt[i], segments[i]
+    if k is not None and k < starts[i]:
+      head = v1[k:starts[i]]
+      h = (np.argmax(head) if peek == +1 else np.argmin(head)) + k
+      vh = v1[h]
+      if (vh >= vj) if peek == +1 else (vh <= vj):
+        j, vj = h, vh
+    vn = nexts[i]
+    if vn is not None and ((vn > vj) if peek == +1 else (vn < vj)):
+      j = starts[i+1]
+    k = j
     w[k] = peek
   return w
 
 def easing(v, v2, minWidth):
-  def easing_(ks, i, minWidth, fkey=lambda xy:xy[0]):
-    while i + 1 < len(ks) and fkey(ks[i+1]) - fkey(ks[i]) < minWidth:
-      ks.pop(i+1)
-  ks = [(k, v2[k]) for k in np.where(np.abs(v2) >= 1.)[0]]
-  i = 0
-  while i < len(ks) - 1:
-    easing_(ks, i, minWidth)
-    i += 1
+  """
+  Returns new vector where peeks closer than minWidth to the previous
+  remaining peek are removed.
+  """
   w = np.zeros(v.shape)
-  for k, v in ks:
-    w[k] = v
+  last = None
+  ks = []
+  for k in np.where(np.abs(v2) >= 1.)[0].tolist():
+    if last is None or k - last >= minWidth:
+      ks.append(k)
+      last = k
+  w[ks] = v2[ks]
   return w
 
+def peekOf(isPeek):
+  """
+  Returns index of the last peek at or before each element, -1 if none.
+  """
+  index = np.arange(0, isPeek.shape[0])
+  return np.maximum.accumulate(np.where(isPeek, index, -1))
+
 def trend(peeks):
-  t = np.zeros(peeks.shape)
-  k = peeks[np.where(peeks != 0)[0][-1]]
-  for i in range(0, peeks.shape[0]):
-    j = peeks.shape[0] - i - 1
-    if peeks[j] != 0:
-      k = peeks[j]
-    t[j] = k
-  return t
+  """
+  Returns vector filled backward with the next peek.
+  """
+  n = peeks.shape[0]
+  isPeek = peeks != 0
+  ks = np.where(isPeek)[0]
+  # Index of the next peek is the last one in reversed order
+  nexts = n - 1 - peekOf(isPeek[::-1])[::-1]
+  nexts[nexts == n] = ks[-1]
+  return peeks[nexts].astype(float)
 
 def trendStrength(values, vt):
-  ks = [(k, vt[k]) for k in np.where(np.abs(vt) >= 1.)[0]]
+  """
+  Returns values normalized by each segment between two peeks.
+  """
+  isPeek = np.abs(vt) >= 1.
+  ks = np.where(isPeek)[0]
   w = np.array(values)
-  for i in range(0, len(ks) - 1):
-    k0, v0 = ks[i]
-    k1, v1 = ks[i+1]
-    if k0 + 1 == k1:
-      continue
-    v = values[k0+1:k1]
-    vmax = np.max(v)
-    vmin = np.min(v)
-    if v0 <= -1. and vmin < 0: # incremental trend
-      w[k0+1:k1] = (v - vmin) / (vmax - vmin) * vmax
-    elif v0 >= +1. and vmax > 0: # decremental trend
-      w[k0+1:k1] = (vmax - v) / (vmax - vmin) * vmin
+  if len(ks) < 2:
+    return w
+  starts = ks[:-1] + 1
+  ends = ks[1:]
+  v0 = vt[ks[:-1]]
+  nonEmpty = starts < ends
+  starts, ends, v0 = starts[nonEmpty], ends[nonEmpty], v0[nonEmpty]
+  if len(starts) == 0:
+    return w
+  bounds = np.stack([starts, ends], axis=1).ravel()
+  vmax = np.maximum.reduceat(w, bounds)[::2]
+  vmin = np.minimum.reduceat(w, bounds)[::2]
+  incremental = (v0 <= -1.) & (vmin < 0)
+  decremental = (v0 >= +1.) & (vmax > 0) & ~incremental
+  # Elements between the first and last peeks except peeks themselves
+  index = np.arange(0, w.shape[0])
+  inner = ~isPeek & (peekOf(isPeek) >= 0) & (index < ks[-1])
+  sizes = ends - starts
+  v = w[inner]
+  vmax = np.repeat(vmax, sizes)
+  vmin = np.repeat(vmin, sizes)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    w[inner] = np.where(np.repeat(incremental, sizes),
+                        (v - vmin) / (vmax - vmin) * vmax,
+                        np.where(np.repeat(decremental, sizes),
+                                 (vmax - v) / (vmax - vmin) * vmin, v))
   return w
 
 def generateAnswer(v1, lpfs):
@@ -136,25 +181,31 @@ def getLPFiltersSize(unit):
     return 7, 5
   elif unit == 'hourly':
     return 24, 12
+  elif unit == 'minutely':
+    return 60, 30
 
-def runAnswer(values, exchanger, unit, ty):
+def runAnswer(values, unit, ty):
   lpSize = getLPFiltersSize(unit)
   lpFilters = [lpfilter(size) for size in lpSize]
   # Period without data may be NaN
   errorIndex = np.argwhere(np.isnan(values))
   values[errorIndex] = 1.
   answers = generateAnswer(values, lpfs=lpFilters)
+  columns = {}
   for k in answers:
     answer = answers[k]
     answer[errorIndex] = 0.5
-    save(answer, exchanger, unit, ty + k)
+    columns[ty + k] = answer
+  return columns
 
-def runBollingerBand(values, exchanger, unit, ty):
+def runBollingerBand(values, ty):
   bb = BollingerBand(values, k=28)
-  save(bb.sigmaLine(2), exchanger, unit, ty + 'BB+2')
-  save(bb.sigmaLine(-2), exchanger, unit, ty + 'BB-2')
+  return {
+    ty + 'BB+2': bb.sigmaLine(2),
+    ty + 'BB-2': bb.sigmaLine(-2)
+  }
 
-def runIchimoku(values, exchanger, unit, ty):
+def runIchimoku(values, unit, ty):
   if unit == 'daily':
     kConv = 13
     kBase = 36
@@ -164,25 +215,67 @@ def runIchimoku(values, exchanger, unit, ty):
     kBase = 31
     kPrec = 62
   ichimoku = Ichimoku(values, kConv=kConv, kBase=kBase, kPrec=kPrec)
-  save(ichimoku.convertionLine(), exchanger, unit, ty + 'Conv')
-  save(ichimoku.baseLine(), exchanger, unit, ty + 'Base')
-  save(ichimoku.precedingLine1(shift=kBase-1), exchanger, unit, ty + 'Prc1')
-  save(ichimoku.precedingLine2(shift=kBase-1), exchanger, unit, ty + 'Prc2')
-  save(ichimoku.laggingLine(), exchanger, unit, ty + 'Lag')
+  return {
+    ty + 'Conv': ichimoku.convertionLine(),
+    ty + 'Base': ichimoku.baseLine(),
+    ty + 'Prc1': ichimoku.precedingLine1(shift=kBase-1),
+    ty + 'Prc2': ichimoku.precedingLine2(shift=kBase-1),
+    ty + 'Lag': ichimoku.laggingLine()
+  }
 
 def run(exchanger, unit, ty):
+  """
+  Returns series generated from a series of exchanger and unit.
+  """
   values = load(exchanger, unit, ty)
-  runAnswer(values, exchanger, unit, ty)
-  runBollingerBand(values, exchanger, unit, ty)
-  runIchimoku(values, exchanger, unit, ty)
+  columns = {}
+  columns.update(runAnswer(values, unit, ty))
+  columns.update(runBollingerBand(values, ty))
+  columns.update(runIchimoku(values, unit, ty))
+  return columns
 
-def runForAll(exchangers, units, types):
-  for exchanger in exchangers:
-    for unit in units:
+def runJob(job):
+  exchanger, unit, ty = job
+  timer = StopWatch()
+  timer.start()
+  columns = run(exchanger, unit, ty)
+  seconds = timer.stop()
+  return job, columns, seconds
+
+def runForAll(exchangers, units, types, workers=WORKERS):
+  """
+  Runs a job for each of exchangers, units and types in `workers` processes,
+  series of an exchanger and unit are written at once after all of its jobs.
+  """
+  if workers <= 0:
+    workers = os.cpu_count()
+  jobs = [(exchanger, unit, ty)
+          for exchanger in exchangers for unit in units for ty in types]
+  pending = {(exchanger, unit): {}
+             for exchanger in exchangers for unit in units}
+  executor = None
+  if workers > 1:
+    executor = ProcessPoolExecutor(max_workers=workers)
+    results = executor.map(runJob, jobs)
+  else:
+    results = map(runJob, jobs)
+  try:
+    for (exchanger, unit, ty), columns, seconds in results:
+      logger.info(('Processed, exchanger={e}, unit={u}, type={ty}, ' +
+                   'elapsed={s:.2f}s')
+                  .format(e=exchanger, u=unit, ty=ty, s=seconds))
+      group = pending[(exchanger, unit)]
+      group[ty] = columns
+      if len(group) < len(types):
+        continue
+      series = {}
       for ty in types:
-        logger.info('Processing..., exchanger={e}, unit={u}, type={ty}'
-                    .format(e=exchanger, u=unit, ty=ty))
-        run(exchanger, unit, ty)
+        series.update(group[ty])
+      savecolumns(config, series, exchanger, unit)
+      del pending[(exchanger, unit)]
+  finally:
+    if executor is not None:
+      executor.shutdown()
 
 def main():
   # Measure run time
@@ -190,6 +283,7 @@ def main():
   timer.start()
   # Execution
   types = ['askAverage', 'askOpen', 'askClose']
+  logger.debug('Start supervising, #workers={n}.'.format(n=WORKERS))
   runForAll(EXCHANGERS, UNITS, types)
   # Finished
   seconds = timer.stop()
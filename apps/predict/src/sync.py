@@ -1,5 +1,8 @@
 import datetime
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Full
 
 from classes import OneTick
 from models import Ticks
@@ -15,38 +18,131 @@ USERNAME = config['aimai.db'].get('username')
 PASSWORD = config['aimai.db'].get('password')
 SYNC_EXCHANGERS = config['sync'].getlist('exchangers')
 SYNC_STEP_SECONDS = config['sync'].getint('step.seconds')
-SYNC_INTERVAL_SECONDS = config['sync'].getint('listen.interval.seconds')
+SYNC_RATE_MIN_SECONDS = config['sync'].getfloat('rate.min.seconds', fallback=1.)
+SYNC_RATE_MAX_SECONDS = config['sync'].getfloat('rate.max.seconds', fallback=60.)
+SYNC_RETRIES = config['sync'].getint('retries', fallback=8)
+SYNC_QUEUE_SIZE = config['sync'].getint('queue.size', fallback=8)
 SYNC_DATE_START = datetime.datetime(2016, 12, 4)
 
-def sync(dashb, ticksModel, dateStart=None):
-  finish = datetime.datetime.now().timestamp()
-  for exchanger in SYNC_EXCHANGERS:
-    if dateStart is None:
-      latest = ticksModel.one(exchanger)
-      if latest is not None:
-        dateStart = latest.date
-      else:
-        dateStart = SYNC_DATE_START
-    start = dateStart.timestamp()
-    count = 0
-    logger.debug('Start from {s} to {e}.'.format(s=start, e=finish))
-    while start < finish:
-      logger.info('Syncing {ex} after {s}.'
-                  .format(ex=exchanger,
-                          s=datetime.datetime.fromtimestamp(start).isoformat()))
+
+class RateLimiter(object):
+  """
+  Keeps an interval between requests, which is doubled on failures
+  and halved on successes within [minSeconds, maxSeconds].
+  """
+  def __init__(self, minSeconds, maxSeconds):
+    self.minSeconds = minSeconds
+    self.maxSeconds = maxSeconds
+    self.interval = minSeconds
+    self.last = None
+
+  def wait(self):
+    if self.last is not None:
+      seconds = self.last + self.interval - time.monotonic()
+      if seconds > 0:
+        time.sleep(seconds)
+    self.last = time.monotonic()
+
+  def succeeded(self):
+    self.interval = max(self.minSeconds, self.interval / 2)
+
+  def failed(self):
+    self.interval = min(self.maxSeconds, max(self.interval * 2, 1.))
+
+
+def put(queue, item, stopped):
+  """
+  Puts item into queue unless stopped while it is full.
+  """
+  while not stopped.is_set():
+    try:
+      queue.put(item, timeout=1.)
+      return True
+    except Full:
+      pass
+  return False
+
+def fetch(dashb, exchanger, start, finish, queue, stopped):
+  """
+  Requests ticks of exchanger from start until finish,
+  and puts each batch of them into queue.
+  """
+  limiter = RateLimiter(SYNC_RATE_MIN_SECONDS, SYNC_RATE_MAX_SECONDS)
+  failures = 0
+  logger.debug('Start {ex} from {s} to {e}.'
+               .format(ex=exchanger, s=start, e=finish))
+  while start < finish and not stopped.is_set():
+    logger.info('Syncing {ex} after {s}.'
+                .format(ex=exchanger,
+                        s=datetime.datetime.fromtimestamp(start).isoformat()))
+    limiter.wait()
+    try:
       res = dashb.requestTicks(exchanger, start)
-      ticks = res['ticks'][exchanger]
-      if len(ticks) > 0:
+    except Exception as e:
+      failures += 1
+      if failures > SYNC_RETRIES:
+        raise
+      limiter.failed()
+      logger.warning('Failed to request ticks, exchanger={ex}, e={e}, '
+                     'interval={i:.1f}s.'
+                     .format(ex=exchanger, e=e, i=limiter.interval))
+      continue
+    failures = 0
+    limiter.succeeded()
+    ticks = res['ticks'][exchanger]
+    last = ticks[-1]['datetime'] if len(ticks) > 0 else start
+    if last > start:
+      put(queue, (exchanger, ticks), stopped)
+      start = last
+    else:
+      # No ticks after start
+      start = start + SYNC_STEP_SECONDS
+
+def sync(newDashboard, ticksModel, dateStart=None):
+  """
+  Fetches ticks of each exchanger in its own thread, and saves them
+  in this thread while next ones are being fetched.
+  newDashboard: function returning a logged in Dashboard.
+  """
+  finish = datetime.datetime.now().timestamp()
+  queue = Queue(maxsize=SYNC_QUEUE_SIZE)
+  # Set when saving failed, fetching threads stop then
+  stopped = threading.Event()
+  def fetchAll(exchanger):
+    try:
+      start = dateStart
+      if start is None:
+        latest = ticksModel.one(exchanger)
+        start = latest.date if latest is not None else SYNC_DATE_START
+      fetch(newDashboard(), exchanger, start.timestamp(), finish,
+            queue, stopped)
+    finally:
+      put(queue, (exchanger, None), stopped)
+  counts = {exchanger: 0 for exchanger in SYNC_EXCHANGERS}
+  with ThreadPoolExecutor(max_workers=len(SYNC_EXCHANGERS)) as executor:
+    futures = [executor.submit(fetchAll, exchanger)
+               for exchanger in SYNC_EXCHANGERS]
+    running = len(futures)
+    try:
+      while running > 0:
+        exchanger, ticks = queue.get()
+        if ticks is None:
+          running -= 1
+          continue
         toSave = [OneTick.fromDict(t) for t in ticks]
-        logger.debug('Writing {count} items.'.format(count=len(ticks)))
+        logger.debug('Writing {count} items of {ex}.'
+                     .format(count=len(ticks), ex=exchanger))
         ticksModel.saveAll(exchanger, toSave)
-        start = ticks[-1]['datetime']
-        count += len(ticks)
-      else:
-        start = start + SYNC_STEP_SECONDS
-      time.sleep(SYNC_INTERVAL_SECONDS)
+        counts[exchanger] += len(ticks)
+    except:
+      stopped.set()
+      raise
+    for future in futures:
+      future.result()
+  for exchanger, count in counts.items():
     if count == 0:
-      logger.error('No ticks synchronized. Ticker may not be working!!')
+      logger.error('No ticks of {ex} synchronized. Ticker may not be working!!'
+                   .format(ex=exchanger))
 
 
 def main():
@@ -56,9 +152,11 @@ def main():
   # Setup models
   db = getDBInstance(config)
   ticksModel = Ticks(db.tick_db)
-  dashb = Dashboard(uri=AIMAI_DB_URI, logger=logger)
-  dashb.requestLogin(USERNAME, PASSWORD)
-  sync(dashb, ticksModel)
+  def newDashboard():
+    dashb = Dashboard(uri=AIMAI_DB_URI, logger=logger)
+    dashb.requestLogin(USERNAME, PASSWORD)
+    return dashb
+  sync(newDashboard, ticksModel)
   # Finished
   seconds = timer.stop()
   logger.debug('End synchronization, elapsed={s:.2f}s'.format(s=seconds))
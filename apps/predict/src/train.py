@@ -14,7 +14,8 @@ from keras.models import Model, Sequential
 from keras import backend as K
 
 from Plotter import Plotter
-from learningUtils import validated, to2d, zscore, round_binary_accuracy, underSampling, balance, saveModel
+from features import FEATURES, loadFeatures, buildFeatures, alignTail
+from learningUtils import validated, zscore, round_binary_accuracy, underSampling, balance, saveModel
 from utils import readConfig, getLogger, loadnpy, StopWatch
 
 logger = getLogger()
@@ -116,55 +117,15 @@ def plotDiff(X, ys, xlim=None, lpSize=168):
   p.savefig('../figures/diff.svg')
 
 
-Xbh1 = load('bitflyer', 'hourly', 'askAverage')[OFFSET_SAMPLES:]
-Xbh2 = load('bitflyer', 'hourly', 'askMax')[OFFSET_SAMPLES:]
-Xbh3 = load('bitflyer', 'hourly', 'askMin')[OFFSET_SAMPLES:]
-Xbhb1 = load('bitflyer', 'hourly', 'askAverageBB+2')[OFFSET_SAMPLES:]
-Xbhb2 = load('bitflyer', 'hourly', 'askAverageBB-2')[OFFSET_SAMPLES:]
-Xbhi1 = load('bitflyer', 'hourly', 'askAverageConv')[OFFSET_SAMPLES:]
-Xbhi2 = load('bitflyer', 'hourly', 'askAverageBase')[OFFSET_SAMPLES:]
-Xbhi3 = load('bitflyer', 'hourly', 'askAveragePrc1')[OFFSET_SAMPLES:]
-Xbhi4 = load('bitflyer', 'hourly', 'askAveragePrc2')[OFFSET_SAMPLES:]
-Xbm1 = load('bitflyer', 'minutely', 'askAverage')
-Xqm1 = load('quoine', 'minutely', 'askAverage')
+series = loadFeatures(config, FEATURES, offset=OFFSET_SAMPLES)
 ybh1 = load('bitflyer', 'hourly', 'askCloseTrend')[OFFSET_SAMPLES:]
 
 ybh1 = validated(ybh1)
 
 sampleSize = INPUT_SIZE
-featureCount = 11
-
-availableSize = len(Xbhi4)
-dataSize = availableSize - sampleSize + 1
-Xbh0 = np.zeros((dataSize, sampleSize, featureCount))
-Xbh0[:,:,0] = to2d(Xbh1, sampleSize, available=availableSize)
-Xbh0[:,:,1] = to2d(Xbh2, sampleSize, available=availableSize)
-Xbh0[:,:,2] = to2d(Xbh3, sampleSize, available=availableSize)
-Xbh0[:,:,3] = to2d(Xbhb1, sampleSize, available=availableSize)
-Xbh0[:,:,4] = to2d(Xbhb2, sampleSize, available=availableSize)
-Xbh0[:,:,5] = to2d(Xbhi1, sampleSize, available=availableSize)
-Xbh0[:,:,6] = to2d(Xbhi2, sampleSize, available=availableSize)
-Xbh0[:,:,7] = to2d(Xbhi3, sampleSize, available=availableSize)
-Xbh0[:,:,8] = to2d(Xbhi4, sampleSize, available=availableSize)
-# setup minutely
-availableSizeM = (dataSize - 1) * 60 + sampleSize
-d = datetime.datetime.now()
-minutesToday = d.hour * 60 + d.minute
-Xbh0[-1:,:,9] = Xbm1[-sampleSize:]
-Xbh0[:-1,:,9] = to2d(Xbm1[:-minutesToday], sampleSize,
-                     available=availableSizeM, stride=60)
-Xbh0[-1:,:,10] = Xqm1[-sampleSize:]
-Xbh0[:-1,:,10] = to2d(Xqm1[:-minutesToday], sampleSize,
-                      available=availableSizeM, stride=60)
-
-skipOld = 0
-dataSize = Xbh0.shape[0] - skipOld
-Xbh = np.zeros((dataSize, Xbh0.shape[1] * Xbh0.shape[2]))
-for i in range(0, dataSize):
-  for j in range(0, featureCount):
-    Xbh[i,j*sampleSize:(j+1)*sampleSize] = Xbh0[i+skipOld,:,j]
-
-ybh0 = ybh1[len(ybh1)-availableSize+sampleSize-1+skipOld:]
+
+Xbh = buildFeatures(series, FEATURES, sampleSize)
+ybh0 = alignTail(ybh1, Xbh.shape[0])
 
 trainRate = 1.0
 unsupervisedSize = SAMPLES_PREDICT
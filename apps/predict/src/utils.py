@@ -1,5 +1,6 @@
 import configparser
 import datetime
+import glob
 import numpy as np
 import os
 import logging
@@ -7,6 +8,7 @@ import pymongo
 
 from classes import Confidence
 from dashboard.Dashboard import Dashboard
+from series import readSeries, readColumns, saveColumns
 
 def mkdir(logfile):
   from pathlib import Path
@@ -15,17 +17,18 @@ def mkdir(logfile):
   path.mkdir(parents=True, exist_ok=True)
 
 def group(f, lst):
+  """
+  Yields key and items of each run of consecutive items with the same key.
+  """
   start = None
   current = []
   for item in lst:
-    current.append(item)
     key = f(item)
-    if start is None:
-      start = key
-    elif start != key:
-      start = key
+    if len(current) > 0 and start != key:
       yield start, current
       current = []
+    start = key
+    current.append(item)
   if len(current) > 0:
     yield start, current
 
@@ -55,20 +58,108 @@ def getDBInstance(config):
   client = pymongo.MongoClient(host=server)
   return client
 
-def loadnpy(config, exchanger, unit, ty, nan=None):
+def seriesPath(config, exchanger, unit):
   DIR_DATA = config['train'].get('data.dir')
-  NPY_DATA = config['train'].get('data.npy')
-  path = (DIR_DATA + '/' + NPY_DATA).format(exchanger=exchanger, unit=unit, ty=ty)
-  data = np.load(path)
-  if nan is not None:
-    data[np.argwhere(np.isnan(data))] = nan
-  return data
+  SERIES_DATA = config['train'].get('data.series',
+                                    fallback='summary_{exchanger}_{unit}.series')
+  return (DIR_DATA + '/' + SERIES_DATA).format(exchanger=exchanger, unit=unit)
 
-def savenpy(config, data, exchanger, unit, ty):
+def npyPath(config, exchanger, unit, ty):
+  """
+  Returns path of a npy file of the old layout, a file for each ty.
+  """
   DIR_DATA = config['train'].get('data.dir')
-  NPY_DATA = config['train'].get('data.npy')
-  path = (DIR_DATA + '/' + NPY_DATA).format(exchanger=exchanger, unit=unit, ty=ty)
-  return np.save(path, data)
+  NPY_DATA = config['train'].get('data.npy',
+                                 fallback='summary_{exchanger}_{unit}_{ty}.npy')
+  return (DIR_DATA + '/' + NPY_DATA).format(exchanger=exchanger, unit=unit,
+                                            ty=ty)
+
+def migrateNpy(config, exchanger, unit):
+  """
+  Writes columns of npy files of exchanger and unit to a new series file,
+  aligned by their tails as they were read. Returns the series, or None
+  if there is a series file or no npy file. npy files are left as they are.
+  """
+  path = seriesPath(config, exchanger, unit)
+  if os.path.exists(path):
+    return None
+  prefix, suffix = npyPath(config, exchanger, unit, '\0').split('\0')
+  columns = {}
+  for npy in glob.glob(glob.escape(prefix) + '*' + glob.escape(suffix)):
+    columns[npy[len(prefix):len(npy)-len(suffix)]] = np.load(npy)
+  if len(columns) == 0:
+    return None
+  start = step = np.nan
+  dates = columns.get('date')
+  if dates is not None and len(dates) > 1:
+    length = max(len(v) for v in columns.values())
+    step = dates[1] - dates[0]
+    start = dates[-1] - (length - 1) * step
+  return saveColumns(path, columns, start=start, step=step)
+
+# Loaded columns by (path, ty, nan), with the version of the file
+LOADED = {}
+
+def loadcolumns(config, exchanger, unit, tys, nan=None, aligned=True):
+  """
+  Returns read-only columns of the series file of exchanger and unit,
+  or copies of them with NaN replaced by `nan`. Columns are mapped at once,
+  and loaded again only if the file changed. If aligned, columns end at
+  the last row of the shortest column of the file, as generated columns
+  are behind exported ones until they are generated again.
+  """
+  path = seriesPath(config, exchanger, unit)
+  series = readSeries(path)
+  if series is None:
+    series = migrateNpy(config, exchanger, unit)
+  if series is None:
+    raise FileNotFoundError('no series file, path={p}.'.format(p=path))
+  stat = os.stat(path)
+  # Writes in place keep the inode and size, and may keep mtime
+  # within its resolution, but count up the version of the manifest
+  version = (stat.st_ino, stat.st_size, stat.st_mtime_ns, series.version)
+  end = min((first + length for _, first, length in series.columns),
+            default=series.length)
+  columns = []
+  missing = []
+  for i, ty in enumerate(tys):
+    loaded = LOADED.get((path, ty, nan))
+    if loaded is not None and loaded[0] == version:
+      columns.append(loaded[1])
+    else:
+      columns.append(None)
+      missing.append(i)
+  values = readColumns(path, [tys[i] for i in missing]) \
+           if len(missing) > 0 else []
+  for i, data in zip(missing, values):
+    if nan is not None:
+      buffer = np.empty(data.shape, dtype=data.dtype)
+      np.copyto(buffer, data)
+      np.copyto(buffer, nan, where=np.isnan(buffer))
+      data = buffer
+      data.flags.writeable = False
+    LOADED[(path, tys[i], nan)] = (version, data)
+    columns[i] = data
+  for i, ty in enumerate(tys):
+    _, first, length = series.columnOf(ty)
+    if aligned and first + length > end:
+      columns[i] = columns[i][:max(0, end - first)]
+  return columns
+
+def loadnpy(config, exchanger, unit, ty, nan=None, aligned=True):
+  return loadcolumns(config, exchanger, unit, [ty], nan=nan,
+                     aligned=aligned)[0]
+
+def savecolumns(config, columns, exchanger, unit):
+  """
+  Replaces the series file with columns at once, columns are aligned with
+  the last row of the series.
+  columns: dict from ty to values.
+  """
+  return saveColumns(seriesPath(config, exchanger, unit), columns)
+
+def savenpy(config, data, exchanger, unit, ty):
+  return savecolumns(config, {ty: data}, exchanger, unit)
 
 def nanIn(x):
   nans = np.argwhere(np.isnan(x))
@@ -0,0 +1,25 @@
+"""
+Modules reading predict.ini in the working directory at import are
+imported with predict.ini.example instead.
+"""
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(CWD, '..', 'src')
+sys.path.append(SRC)
+sys.path.append(os.path.join(CWD, '..', '..', 'trade', 'src'))
+
+def importWithConfig(name):
+  cwd = os.getcwd()
+  tmp = tempfile.mkdtemp()
+  shutil.copy(os.path.join(SRC, 'predict.ini.example'),
+              os.path.join(tmp, 'predict.ini'))
+  os.chdir(tmp)
+  try:
+    return importlib.import_module(name)
+  finally:
+    os.chdir(cwd)
@@ -0,0 +1,131 @@
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+
+from charts import *
+
+def SMALoop(k, x):
+  n = x.size
+  y = np.zeros(n)
+  for i in range(1, n+1):
+    e = n - i + k + 1
+    if e > n:
+      e = n
+    y[n-i] = np.average(x[n-i:e])
+  return y
+
+def SigmaLoop(k, x):
+  n = x.size
+  d = x - SMALoop(k, x)
+  y = np.zeros(n)
+  for i in range(1, n+1):
+    e = n - i + k + 1
+    if e > n:
+      e = n
+    y[n-i] = np.sum(d[n-i:e] * d[n-i:e]) / k
+  return np.sqrt(y)
+
+def MediumLoop(k, x):
+  n = x.size
+  y = np.zeros(n-k+1)
+  for i in range(0, n-k+1):
+    y[i] = (np.max(x[i:i+k]) + np.min(x[i:i+k])) / 2
+  return y
+
+def RSILoop(x, k, slide=None):
+  N = x.shape[0]
+  if slide is None:
+    slide = 0
+  y = np.zeros(x.shape)
+  dx = x[1:] - x[:N-1]
+  for i in range(0, N - 1):
+    s = i - k + slide
+    if s < 0: s = 0
+    e = i + slide
+    if e >= N - 1: e = N - 2
+    inc = np.sum(dx[s + np.where(dx[s:e] > 0)[0]])
+    dec = np.sum(dx[s + np.where(dx[s:e] < 0)[0]])
+    if inc - dec == 0:
+      y[i+1] = 0
+    else:
+      y[i+1] = inc / (inc - dec)
+  return y
+
+def randomWalk(n, seed=0):
+  rand = np.random.RandomState(seed)
+  return 1e6 + np.cumsum(rand.normal(scale=1e3, size=n))
+
+def test_SMA_equivalent():
+  x = randomWalk(2000)
+  for k in [1, 7, 28, 2000, 3000]:
+    assert np.allclose(SMA(k, x), SMALoop(k, x), rtol=1e-12, atol=1e-6)
+
+def test_Sigma_equivalent():
+  x = randomWalk(2000)
+  for k in [1, 7, 28, 2000]:
+    assert np.allclose(Sigma(k, x), SigmaLoop(k, x), rtol=1e-9, atol=1e-6)
+
+def test_Sigma_flat():
+  x = np.full(100, 123456.7)
+  assert np.all(Sigma(28, x) == 0.)
+
+def test_SMA_nan():
+  x = randomWalk(100)
+  x[50] = np.nan
+  y = SMA(5, x)
+  assert np.all(np.isnan(y[45:51]))
+  assert not np.any(np.isnan(y[:45]))
+  assert not np.any(np.isnan(y[51:]))
+
+def test_BollingerBand_sigmaLine():
+  x = randomWalk(500)
+  bb = BollingerBand(x, k=28)
+  expect = SMALoop(28, x) + 2 * SigmaLoop(28, x)
+  assert np.allclose(bb.sigmaLine(2), expect, rtol=1e-9)
+  expect = SMALoop(28, x) - 2 * SigmaLoop(28, x)
+  assert np.allclose(bb.sigmaLine(-2), expect, rtol=1e-9)
+
+def test_Medium_equivalent():
+  x = randomWalk(1000)
+  for k in [1, 2, 9, 26, 52, 999, 1000]:
+    assert np.array_equal(Medium(k, x), MediumLoop(k, x))
+
+def test_Medium_nan():
+  x = randomWalk(100)
+  x[50] = np.nan
+  y = Medium(9, x)
+  assert np.all(np.isnan(y[42:51]))
+  assert not np.any(np.isnan(y[:42]))
+  assert not np.any(np.isnan(y[51:]))
+
+def test_Ichimoku_memoized():
+  x = randomWalk(500)
+  ichimoku = Ichimoku(x, kConv=11, kBase=31, kPrec=62)
+  ichimoku.convertionLine()
+  ichimoku.baseLine()
+  ichimoku.precedingLine1(shift=30)
+  ichimoku.precedingLine2(shift=30)
+  assert sorted(ichimoku.mediums.keys()) == [11, 31, 62]
+  assert np.array_equal(ichimoku.baseLine(), MediumLoop(31, x))
+
+def test_RSI_equivalent():
+  x = np.log10(randomWalk(1000))
+  for k in [1, 14, 23, 1000]:
+    for slide in [None, 0, 11, 30]:
+      assert np.allclose(RSI(x, k, slide=slide), RSILoop(x, k, slide=slide),
+                         rtol=1e-9, atol=1e-12)
+
+def test_RSI_flat():
+  x = np.concatenate([np.full(50, 3.), np.arange(0., 50.)])
+  assert np.array_equal(RSI(x, 10), RSILoop(x, 10))
+  assert np.array_equal(RSI(x[:1], 10), np.zeros(1))
+
+def test_RSIStream_equivalent():
+  x = np.log10(randomWalk(300))
+  x[100:120] = x[100]
+  stream = RSIStream(23)
+  y = np.array([stream.update(v) for v in x])
+  assert np.allclose(y, RSILoop(x, 23), rtol=1e-9, atol=1e-12)
@@ -0,0 +1,62 @@
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+
+from dsp import *
+
+def crosszeroLoop(v, thres=0., ud=+1.0, du=-1.0):
+  w = np.zeros(v.shape)
+  iud = idu = None
+  for i in range(1, len(v)):
+    if v[i-1] > 0. > v[i]:
+      if -thres > v[i]:
+        w[i] = du
+      else:
+        idu = i
+    elif v[i-1] > -thres > v[i] and idu is not None:
+      w[idu] = du
+      idu = None
+    elif v[i-1] < 0. < v[i]:
+      if thres < v[i]:
+        w[i] = ud
+      else:
+        iud = i
+    elif v[i-1] < thres < v[i] and iud is not None:
+      w[iud] = ud
+      iud = None
+  return w
+
+def assertEquivalent(v, **kwargs):
+  assert np.array_equal(crosszero(v, **kwargs), crosszeroLoop(v, **kwargs))
+
+def test_crosszero_random():
+  rand = np.random.RandomState(0)
+  for thres in [0., 5e-4, 0.1, 0.5, 2.]:
+    assertEquivalent(rand.normal(size=5000), thres=thres)
+    assertEquivalent(np.cumsum(rand.normal(size=5000)) * 1e-2, thres=thres)
+
+def test_crosszero_quantized():
+  # Many exact zeros and values on the threshold
+  rand = np.random.RandomState(1)
+  v = rand.randint(-3, 4, size=5000) * 0.5
+  for thres in [0., 0.5, 1., 1.5]:
+    assertEquivalent(v, thres=thres)
+    assertEquivalent(v, thres=thres, ud=2., du=-3.)
+
+def test_crosszero_pending():
+  v = np.array([0.5, -0.5, 0.5, -2., -0.5, -2., 0.5, 2., -0.5, 0.5, 2.])
+  assertEquivalent(v, thres=1.)
+  w = crosszero(v, thres=1.)
+  assert w[1] == -1. and w[3] == -1. and w[6] == +1.
+
+def test_crosszero_nan():
+  v = np.array([1., np.nan, -1., -2., 1., np.nan, 2., -0.1, -3.])
+  for thres in [0., 0.5]:
+    assertEquivalent(v, thres=thres)
+
+def test_crosszero_short():
+  for v in [np.zeros(0), np.ones(1), np.array([1., -1.])]:
+    assertEquivalent(v, thres=0.5)
@@ -0,0 +1,146 @@
+import datetime
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CWD)
+
+from exampleConfig import importWithConfig
+
+export = importWithConfig('export')
+from classes import Summary
+from models import SUMMARY_FIELDS
+from series import readSeries, writeSeries, loadAll
+from utils import seriesPath
+
+def completionLoop(values, timestamps, step, maxN=None, error=np.nan):
+  if maxN is None:
+    maxN = np.inf
+  size = len(timestamps)
+  v = np.zeros(size * 4)
+  i = -1
+  start = timestamps[0]
+  for timestamp, value in zip(timestamps, values):
+    j = int((timestamp - start) / step)
+    d = j - i
+    if d == 1:
+      v[j] = value
+    elif d < maxN:
+      v[i:j+1] = np.linspace(v[i], value, j - i + 1)
+    else:
+      v[i:j+1] = error
+    i = j
+  return v[:i+1]
+
+def randomSummaries(n, step, rand):
+  slots = np.cumsum(rand.geometric(0.7, size=n)) - 1
+  timestamps = 1.5e9 + slots * step
+  values = 1e6 * np.exp(np.cumsum(rand.normal(scale=1e-3, size=(n, 5)), axis=0))
+  return values, timestamps
+
+def test_completion():
+  rand = np.random.RandomState(0)
+  for step, maxN in [(60, None), (3600, 3), (86400, 2)]:
+    values, timestamps = randomSummaries(5000, step, rand)
+    expected = np.stack([completionLoop(values[:,c], timestamps, step, maxN)
+                         for c in range(0, 5)], axis=1)
+    actual = export.completion(values, timestamps, step, maxN=maxN)
+    assert np.array_equal(expected, actual, equal_nan=True)
+    actual = export.completion(values[:,0], timestamps, step, maxN=maxN)
+    assert np.array_equal(expected[:,0], actual, equal_nan=True)
+
+class SummariesDummy(object):
+  """
+  Summaries of an exchanger and unit, the last one may be partial.
+  """
+  def __init__(self, sums):
+    self.sums = sums
+
+  def columns(self, exchanger, unit, after=None):
+    sums = [s for s in self.sums
+            if after is None or s.date.timestamp() > after]
+    if len(sums) > 0:
+      yield {f: np.array([s.toDict()[f] for s in sums])
+             for f in SUMMARY_FIELDS}
+
+  def all(self, exchanger, unit, before=None, after=None, order=1):
+    sums = [s for s in self.sums
+            if before is None or s.date.timestamp() < before]
+    return iter(sums if order > 0 else sums[::-1])
+
+def randomHourly(n, rand):
+  # Gaps completed, and gaps over completion.maxHourly filled with NaN
+  gaps = np.where(rand.uniform(size=n) < 0.05, rand.randint(2, 40, size=n),
+                  rand.geometric(0.8, size=n))
+  start = datetime.datetime(2019, 4, 4).timestamp()
+  timestamps = start + (np.cumsum(gaps) - gaps[0]) * 3600.
+  values = 1e6 * np.exp(np.cumsum(rand.normal(scale=1e-3, size=(n, 5)), axis=0))
+  return [Summary(datetime.datetime.fromtimestamp(t), *v)
+          for t, v in zip(timestamps.tolist(), values.tolist())]
+
+def partial(s):
+  return Summary(s.date, s.askMax * 0.9, s.askMin * 1.1, s.askAverage,
+                 s.askOpen, s.askAverage)
+
+def exportedIn(tmp_path, monkeypatch, name, runs):
+  """
+  Exports each summaries of runs in turn, returns the series exported.
+  """
+  path = tmp_path / name
+  path.mkdir()
+  monkeypatch.setitem(export.config['train'], 'data.dir', str(path))
+  for sums in runs:
+    export.exportSeries(SummariesDummy(sums), 'bitflyer', 'hourly', 0.)
+  return loadAll(seriesPath(export.config, 'bitflyer', 'hourly'))
+
+def assertSeries(expected, actual):
+  expectedSeries, expectedColumns = expected
+  actualSeries, actualColumns = actual
+  assert actualSeries.start == expectedSeries.start
+  assert actualSeries.length == expectedSeries.length
+  for ty in export.SERIES_TYPES:
+    assert actualColumns[ty][0] == expectedColumns[ty][0]
+    assert np.array_equal(actualColumns[ty][1], expectedColumns[ty][1],
+                          equal_nan=True)
+
+def test_exportSeries_incremental(tmp_path, monkeypatch):
+  sums = randomHourly(3000, np.random.RandomState(0))
+  expected = exportedIn(tmp_path, monkeypatch, 'full', [sums])
+  # Runs end at random bars, and around gaps of completion or errors so
+  # that the last or the second last bar follows a gap, each of them with
+  # the last bar partial
+  rand = np.random.RandomState(1)
+  gaps = [i for i in range(0, len(sums) - 1)
+          if (sums[i+1].date - sums[i].date).total_seconds() > 3600.]
+  ends = rand.randint(3, len(sums), size=20).tolist()
+  ends += [i + k for i in gaps[::4] for k in [1, 2, 3]]
+  ends = sorted(set(e for e in ends if 3 <= e < len(sums)))
+  runs = [sums[:end-1] + [partial(sums[end-1])] for end in ends] + [sums]
+  assertSeries(expected, exportedIn(tmp_path, monkeypatch, 'incremental',
+                                    runs))
+
+def test_exportSeries_appended(tmp_path, monkeypatch):
+  sums = randomHourly(200, np.random.RandomState(2))
+  exportedIn(tmp_path, monkeypatch, 'a', [sums[:100]])
+  path = seriesPath(export.config, 'bitflyer', 'hourly')
+  series, columns = loadAll(path)
+  # Generated columns are kept on append
+  columns['askAverageTrend'] = (0, np.ones(series.length))
+  writeSeries(path, series.start, series.step, series.length, columns)
+  export.exportSeries(SummariesDummy(sums), 'bitflyer', 'hourly', 0.)
+  assert 'askAverageTrend' in readSeries(path).names()
+  assertSeries(exportedIn(tmp_path, monkeypatch, 'b', [sums]), loadAll(path))
+
+def test_exportSeries_rewritten(tmp_path, monkeypatch):
+  sums = randomHourly(200, np.random.RandomState(3))
+  exportedIn(tmp_path, monkeypatch, 'a', [sums[:100]])
+  path = seriesPath(export.config, 'bitflyer', 'hourly')
+  series, columns = loadAll(path)
+  # Series without an exported column are written again
+  del columns['date']
+  columns['askAverageTrend'] = (0, np.ones(series.length))
+  writeSeries(path, series.start, series.step, series.length, columns)
+  export.exportSeries(SummariesDummy(sums), 'bitflyer', 'hourly', 0.)
+  assert 'askAverageTrend' not in readSeries(path).names()
+  assertSeries(exportedIn(tmp_path, monkeypatch, 'b', [sums]), loadAll(path))
@@ -0,0 +1,61 @@
+import datetime
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+sys.path.append(os.path.join(CWD, '..', '..', 'trade', 'src'))
+
+from features import *
+from test_learningUtils import to2dLoop
+
+def buildLoop(series, sampleSize, d):
+  availableSize = len(series[8])
+  dataSize = availableSize - sampleSize + 1
+  Xbh0 = np.zeros((dataSize, sampleSize, 11))
+  for j in range(0, 9):
+    Xbh0[:,:,j] = to2dLoop(series[j], sampleSize, available=availableSize)
+  availableSizeM = (dataSize - 1) * 60 + sampleSize
+  minutesToday = d.hour * 60 + d.minute
+  for j in [9, 10]:
+    Xbh0[-1:,:,j] = series[j][-sampleSize:]
+    Xbh0[:-1,:,j] = to2dLoop(series[j][:-minutesToday], sampleSize,
+                             available=availableSizeM, stride=60)
+  Xbh = np.zeros((dataSize, sampleSize * 11))
+  for i in range(0, dataSize):
+    for j in range(0, 11):
+      Xbh[i,j*sampleSize:(j+1)*sampleSize] = Xbh0[i,:,j]
+  return Xbh
+
+def randomSeries(hours=400):
+  rand = np.random.RandomState(0)
+  series = [rand.normal(size=hours) for j in range(0, 8)]
+  series.append(rand.normal(size=hours - 61))
+  series += [rand.normal(size=hours * 60 + 500) for j in range(0, 2)]
+  return series
+
+def test_buildFeatures_equivalent():
+  series = randomSeries()
+  d = datetime.datetime(2019, 5, 1, 13, 21)
+  Xbh = buildFeatures(series, FEATURES, 24, date=d)
+  assert np.array_equal(Xbh, buildLoop(series, 24, d))
+
+def test_buildFeatures_tail():
+  series = randomSeries()
+  d = datetime.datetime(2019, 5, 1, 13, 21)
+  Xbh = buildFeatures(series, FEATURES, 24, date=d)
+  for tail in [1, 2, 11, Xbh.shape[0], Xbh.shape[0] + 10]:
+    Xtail = buildFeatures(series, FEATURES, 24, tail=tail, date=d)
+    assert np.array_equal(Xtail, Xbh[-tail:])
+
+def test_buildFeatures_midnight():
+  series = randomSeries()
+  d = datetime.datetime(2019, 5, 1, 0, 0)
+  Xbh = buildFeatures(series, FEATURES, 24, date=d)
+  assert Xbh.shape == (len(series[8]) - 24 + 1, 24 * 11)
+  assert np.array_equal(Xbh[-2,-24:], series[10][-24-60:-60])
+
+def test_alignTail():
+  x = np.arange(0, 10)
+  assert np.array_equal(alignTail(x, 3), [7, 8, 9])
@@ -0,0 +1,48 @@
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+
+from learningUtils import *
+
+def to2dLoop(X, sampleSize, stride=1, available=None):
+  if available is not None:
+    X = X[len(X) - available:]
+  dataSize = (len(X) - sampleSize + 1) // stride
+  X2 = np.zeros((dataSize, sampleSize))
+  for i in range(0, dataSize):
+    start = i * stride
+    end = i * stride + sampleSize
+    X2[i,:] = X[start:end]
+  return X2
+
+def test_windows_equivalent():
+  X = np.random.RandomState(0).normal(size=1000)
+  for sampleSize, stride, available in [(1, 1, None), (168, 1, None),
+                                        (168, 1, 500), (168, 60, 900),
+                                        (10, 7, None), (1000, 1, None)]:
+    W = windows(X, sampleSize, stride=stride, available=available)
+    assert np.array_equal(W, to2dLoop(X, sampleSize, stride=stride,
+                                      available=available))
+    assert np.array_equal(to2d(X, sampleSize, stride=stride,
+                               available=available), W)
+
+def test_windows_view():
+  X = np.arange(0., 100.)
+  W = windows(X, 10, stride=3)
+  assert np.shares_memory(W, X)
+  assert not W.flags.writeable
+
+def test_stackFeatures():
+  rand = np.random.RandomState(0)
+  Xs = [rand.normal(size=300) for j in range(0, 3)]
+  sampleSize = 24
+  features = [windows(X, sampleSize) for X in Xs]
+  Xbh = stackFeatures(features)
+  assert Xbh.shape == (300 - sampleSize + 1, 3 * sampleSize)
+  for i in range(0, Xbh.shape[0]):
+    for j in range(0, 3):
+      assert np.array_equal(Xbh[i,j*sampleSize:(j+1)*sampleSize],
+                            Xs[j][i:i+sampleSize])
@@ -0,0 +1,43 @@
+import os
+import sys
+import bson
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+sys.path.append(os.path.join(CWD, '..', '..', 'trade', 'src'))
+
+from models import columnBatches
+
+class RawBatchesCollection(object):
+  """
+  Collection returning documents as raw BSON batches like pymongo.
+  """
+  def __init__(self, items):
+    self.items = items
+
+  def find_raw_batches(self, conditions, projection, batch_size):
+    self.projection = projection
+    self.batchSize = batch_size
+    return self
+
+  def sort(self, key, order):
+    items = sorted(self.items, key=lambda item:item[key] * order)
+    fields = [f for f in self.projection if self.projection[f]]
+    items = [{f: item[f] for f in fields} for item in items]
+    return (b''.join(bson.encode(item) for item in items[i:i+self.batchSize])
+            for i in range(0, len(items), self.batchSize))
+
+def test_columnBatches():
+  items = [{'_id': i, 'datetime': float(i), 'ask': i * 2., 'bid': i * 2. - 1}
+           for i in range(100, 0, -1)]
+  collection = RawBatchesCollection(items)
+  chunks = list(columnBatches(collection, {}, ('datetime', 'ask'),
+                              batchSize=30))
+  assert [len(c['datetime']) for c in chunks] == [30, 30, 30, 10]
+  assert all(set(c) == {'datetime', 'ask'} for c in chunks)
+  timestamps = np.concatenate([c['datetime'] for c in chunks])
+  asks = np.concatenate([c['ask'] for c in chunks])
+  assert np.array_equal(timestamps, np.arange(1., 101.))
+  assert np.array_equal(asks, timestamps * 2.)
+  assert collection.projection == {'datetime': 1, 'ask': 1, '_id': 0}
@@ -0,0 +1,57 @@
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+sys.path.append(os.path.join(CWD, '..', '..', 'trade', 'src'))
+
+from predictor import PredictorServer, trigger
+
+class PredictorDummy(object):
+  def __init__(self):
+    self.count = 0
+
+  def predict(self):
+    self.count += 1
+    y = np.full(3, 0.75)
+    return y, y, np.zeros(3)
+
+class DashboardDummy(object):
+  def __init__(self):
+    self.trends = []
+
+  def saveTrend(self, date, trend):
+    self.trends.append(trend)
+
+def quietLogger():
+  logger = logging.getLogger('test_predictor')
+  logger.propagate = False
+  return logger
+
+def test_PredictorServer_interval(tmp_path):
+  path = str(tmp_path / 'predictor.sock')
+  predictor = PredictorDummy()
+  dashb = DashboardDummy()
+  server = PredictorServer(predictor, path, dashb, interval=0.2,
+                           logger=quietLogger())
+  thread = threading.Thread(target=server.serve, daemon=True)
+  thread.start()
+  while not os.path.exists(path):
+    time.sleep(0.01)
+  try:
+    triggers = 0
+    start = time.monotonic()
+    # Steady triggers do not starve interval runs
+    while time.monotonic() - start < 1.:
+      assert trigger(path) == 'ok 0.750'
+      triggers += 1
+    assert predictor.count - triggers >= 3
+  finally:
+    server.stop()
+    thread.join(timeout=1.)
+  assert not thread.is_alive()
+  assert len(dashb.trends) == predictor.count
@@ -0,0 +1,79 @@
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+
+from series import *
+
+def writeSample(path):
+  return writeSeries(path, 1000., 60., 10, {
+    'x': (0, np.arange(0., 10.)),
+    'y': (4, np.arange(0., 6.) * 10.)
+  })
+
+def test_writeSeries(tmp_path):
+  path = str(tmp_path / 'a.series')
+  writeSample(path)
+  series = readSeries(path)
+  assert (series.start, series.step, series.length) == (1000., 60., 10)
+  assert series.end() == 1000. + 9 * 60.
+  assert series.names() == ['x', 'y']
+  x, y = readColumns(path, ['x', 'y'])
+  assert np.array_equal(x, np.arange(0., 10.))
+  assert np.array_equal(y, np.arange(0., 6.) * 10.)
+  assert not x.flags.writeable
+  assert not os.path.exists(path + '.tmp')
+  assert series.version == 0
+  assert writeSample(path).version == 1
+
+def test_appendSeries_inPlace(tmp_path):
+  path = str(tmp_path / 'a.series')
+  capacity = writeSample(path).capacity
+  size = os.path.getsize(path)
+  series = appendSeries(path, 8, {'x': np.array([80., 90., 100.])})
+  assert series.length == 11
+  assert readSeries(path).version == 1
+  assert series.capacity == capacity
+  assert os.path.getsize(path) == size
+  x, y = readColumns(path, ['x', 'y'])
+  assert np.array_equal(x, np.r_[np.arange(0., 8.), 80., 90., 100.])
+  assert np.array_equal(y, np.arange(0., 6.) * 10.)
+
+def test_appendSeries_grow(tmp_path):
+  path = str(tmp_path / 'a.series')
+  capacity = writeSample(path).capacity
+  x = np.arange(0., capacity)
+  series = appendSeries(path, 10, {'x': x, 'z': x})
+  assert series.length == 10 + capacity
+  assert series.capacity > series.length
+  x1, y1, z1 = readColumns(path, ['x', 'y', 'z'])
+  assert np.array_equal(x1, np.r_[np.arange(0., 10.), x])
+  assert np.array_equal(y1, np.arange(0., 6.) * 10.)
+  assert np.array_equal(z1, x)
+  assert series.columnOf('z') == (2, 10, capacity)
+
+def test_saveColumns(tmp_path):
+  path = str(tmp_path / 'a.series')
+  writeSample(path)
+  saveColumns(path, {'y': np.arange(0., 3.), 'w': np.arange(0., 12.)})
+  series = readSeries(path)
+  assert (series.start, series.length) == (1000. - 2 * 60., 12)
+  assert series.columnOf('x') == (0, 2, 10)
+  assert series.columnOf('y') == (1, 9, 3)
+  x, w = readColumns(path, ['x', 'w'])
+  assert np.array_equal(x, np.arange(0., 10.))
+  assert np.array_equal(w, np.arange(0., 12.))
+
+def test_saveColumns_new(tmp_path):
+  path = str(tmp_path / 'a.series')
+  saveColumns(path, {'x': np.arange(0., 3.)})
+  assert readSeries(path).length == 3
+  assert np.array_equal(readColumns(path, ['x'])[0], np.arange(0., 3.))
+
+def test_indexOf():
+  series = Series(1000., 60., 10, 4096, [])
+  assert series.indexOf(1120.) == 2
+  assert series.indexOf(1130.) is None
+  assert readSeries('/nonexistent/a.series') is None
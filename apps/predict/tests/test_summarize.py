@@ -0,0 +1,257 @@
+import datetime
+import itertools
+import os
+import sys
+import numpy as np
+import pymongo
+import pytest
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CWD)
+
+from exampleConfig import importWithConfig
+
+summarize = importWithConfig('summarize')
+from summarize import Cascade, Bar, KEYS, ITEMS_END, UNITS, TRUNC_UNITS, \
+  pipelineOf, compare, compareSummaries
+from classes import Summary
+from models import Ticks, Summaries, SUMMARY_FIELDS
+
+class Ask(object):
+  def __init__(self, timestamp, ask):
+    self.date = datetime.datetime.fromtimestamp(timestamp)
+    self.ask = ask
+
+def summariesNaive(timestamps, asks):
+  """
+  Summaries of each unit by grouping all asks by period at once.
+  """
+  items = [Ask(t, a) for t, a in zip(timestamps, asks)]
+  sums = {}
+  for unit in UNITS:
+    sums[unit] = []
+    for key, group in itertools.groupby(items, KEYS[unit]):
+      values = np.array([item.ask for item in group])
+      n = min(len(values), ITEMS_END[unit])
+      sums[unit].append((datetime.datetime(*key), values.max(), values.min(),
+                         values.mean(), values[:n].mean(),
+                         values[len(values)-n:].mean()))
+  return sums
+
+def summariesOf(closed, partials):
+  sums = {}
+  for unit in UNITS:
+    sums[unit] = [(s.date, s.askMax, s.askMin, s.askAverage, s.askOpen,
+                   s.askClose)
+                  for s in closed[unit] + partials.get(unit, [])]
+  return sums
+
+def assertSummaries(expected, actual):
+  for unit in UNITS:
+    assert [s[0] for s in actual[unit]] == [s[0] for s in expected[unit]]
+    assert np.allclose([s[1:] for s in actual[unit]],
+                       [s[1:] for s in expected[unit]])
+
+def randomAsks(n, rand):
+  # Bursts of ticks and gaps of hours, so that some bars have few asks
+  gaps = np.where(rand.uniform(size=n) < 0.001,
+                  rand.uniform(3600., 4 * 3600., size=n),
+                  rand.exponential(20., size=n))
+  timestamps = datetime.datetime(2019, 4, 4, 10, 30).timestamp() + \
+               np.cumsum(gaps)
+  asks = 1e6 * np.exp(np.cumsum(rand.normal(scale=1e-3, size=n)))
+  return timestamps, asks
+
+def summarizeAll(timestamps, asks, splits=()):
+  closed = {unit: [] for unit in UNITS}
+  cascade = Cascade()
+  for i, (timestamp, ask) in enumerate(zip(timestamps.tolist(),
+                                           asks.tolist())):
+    if i in splits:
+      # Restarts from a checkpoint as summarize does
+      for unit, sums in cascade.popClosed().items():
+        closed[unit] += sums
+      cascade = Cascade.fromDict(cascade.toDict())
+    cascade.addAsk(timestamp, ask)
+  for unit, sums in cascade.popClosed().items():
+    closed[unit] += sums
+  return summariesOf(closed, cascade.partials())
+
+def test_Cascade():
+  timestamps, asks = randomAsks(50000, np.random.RandomState(0))
+  assertSummaries(summariesNaive(timestamps, asks),
+                  summarizeAll(timestamps, asks))
+
+def test_Cascade_checkpoints():
+  timestamps, asks = randomAsks(50000, np.random.RandomState(1))
+  assertSummaries(summariesNaive(timestamps, asks),
+                  summarizeAll(timestamps, asks,
+                               splits=set([1, 777, 12345, 30000, 49999])))
+
+def test_Cascade_partials_newHour():
+  start = datetime.datetime(2019, 4, 8, 11, 58).timestamp()
+  timestamps = np.array([start, start + 60., start + 120.])
+  asks = np.array([100., 100., 200.])
+  actual = summarizeAll(timestamps, asks)
+  assertSummaries(summariesNaive(timestamps, asks), actual)
+  assert [s[1] for s in actual['hourly']] == [100., 200.]
+
+def test_Cascade_partials_staleCheckpoint():
+  # Checkpoints of older runs may keep a bar of an ended period open
+  cascade = Cascade()
+  cascade.addAsk(datetime.datetime(2019, 4, 8, 11, 58).timestamp(), 100.)
+  cascade.addAsk(datetime.datetime(2019, 4, 8, 11, 59).timestamp(), 100.)
+  bars = cascade.toDict()
+  del bars['version']
+  # The open minute bar moves to the next hour before the hourly bar closes
+  minute = Bar(datetime.datetime(2019, 4, 8, 12, 0), keep=8)
+  minute.add(200.)
+  bars['minutely'] = minute.toDict()
+  partials = Cascade.fromDict(bars).partials()
+  assert [(s.date.hour, s.askMax) for s in partials['hourly']] == \
+         [(11, 100.), (12, 200.)]
+  assert [s.askAverage for s in partials['daily']] == [150.]
+
+def test_Cascade_checkpointBounded():
+  # An open week with many asks a minute
+  timestamps = datetime.datetime(2019, 4, 8).timestamp() + \
+               np.arange(0., 5 * 24 * 3600., 2.)
+  asks = np.linspace(100., 200., len(timestamps))
+  cascade = Cascade()
+  for timestamp, ask in zip(timestamps.tolist(), asks.tolist()):
+    cascade.addAsk(timestamp, ask)
+  bars = cascade.toDict()
+  for unit in UNITS:
+    assert len(bars[unit]['heads']) <= ITEMS_END[unit]
+    assert len(bars[unit]['tails']) <= ITEMS_END[unit]
+  restored = Cascade.fromDict(bars)
+  assert restored.toDict() == bars
+  expected = summariesNaive(timestamps, asks)
+  actual = summariesOf(cascade.popClosed(), restored.partials())
+  assertSummaries(expected, actual)
+
+def test_Cascade_oldCheckpoint():
+  # Older checkpoints kept asks of open sub bars only in the sub bars
+  timestamps, asks = randomAsks(5000, np.random.RandomState(2))
+  split = 2500
+  cascade = Cascade()
+  for timestamp, ask in zip(timestamps[:split].tolist(),
+                            asks[:split].tolist()):
+    cascade.addAsk(timestamp, ask)
+  closed = cascade.popClosed()
+  old = {}
+  for sub, unit in zip([None] + UNITS[:-1], UNITS):
+    old[unit] = cascade.bars[unit].toDict()
+    start = cascade.bars[unit].date.timestamp()
+    end = cascade.bars[sub].date.timestamp() if sub is not None else np.inf
+    inBar = (timestamps[:split] >= start) & (timestamps[:split] < end)
+    old[unit]['heads'] = asks[:split][inBar][:57600].tolist()
+    old[unit]['tails'] = asks[:split][inBar][-57600:].tolist()
+  cascade = Cascade.fromDict(old)
+  for timestamp, ask in zip(timestamps[split:].tolist(),
+                            asks[split:].tolist()):
+    cascade.addAsk(timestamp, ask)
+  for unit, sums in cascade.popClosed().items():
+    closed[unit] += sums
+  assertSummaries(summariesNaive(timestamps, asks),
+                  summariesOf(closed, cascade.partials()))
+
+def test_pipelineOf():
+  start = datetime.datetime(2019, 4, 4, 10, 30)
+  for unit in UNITS:
+    pipeline = pipelineOf(unit, start=start, timezone='Asia/Tokyo')
+    assert pipeline[0] == {'$match': {'datetime': {'$gte': start.timestamp()}}}
+    assert pipeline[1] == {'$sort': {'datetime': 1}}
+    group = pipeline[2]['$group']
+    trunc = group['_id']['$dateTrunc']
+    assert trunc['timezone'] == 'Asia/Tokyo'
+    assert trunc.get('startOfWeek') == ('monday' if unit == 'weekly' else None)
+    assert group['heads']['$firstN']['n'] == ITEMS_END[unit]
+    assert group['tails']['$lastN']['n'] == ITEMS_END[unit]
+  assert pipelineOf('daily', timezone='UTC')[0] == {'$sort': {'datetime': 1}}
+
+def test_compareSummaries():
+  date = datetime.datetime(2019, 4, 4, 10)
+  hour = datetime.timedelta(hours=1)
+  expected = [Summary(date, 3., 1., 2., 1., 3.),
+              Summary(date + hour, 4., 2., 3., 2., 4.)]
+  actual = [Summary(date, 3., 1., 2.5, 1., 3.),
+            Summary(date + 2 * hour, 4., 2., 3., 2., 4.)]
+  assert compareSummaries(expected, expected) == (0, 0.)
+  assert compareSummaries(expected, actual) == (2, 0.5)
+
+class AggregatedCollection(object):
+  """
+  Returns summaries of each unit of $dateTrunc as mongod would aggregate.
+  """
+  def __init__(self, sums):
+    self.sums = sums
+
+  def aggregate(self, pipeline, allowDiskUse=False):
+    group = [p['$group'] for p in pipeline if '$group' in p][0]
+    trunc = group['_id']['$dateTrunc']['unit']
+    unit = [u for u in UNITS if TRUNC_UNITS[u] == trunc][0]
+    return [dict(zip(SUMMARY_FIELDS, (s[0].timestamp(),) + s[1:]))
+            for s in self.sums[unit]]
+
+class ColumnTicks(object):
+  def __init__(self, timestamps, asks, sums):
+    self.timestamps = timestamps
+    self.asks = asks
+    self.collection = AggregatedCollection(sums)
+
+  def columns(self, exchanger, dateStart=None, fields=()):
+    yield {'datetime': self.timestamps, 'ask': self.asks}
+
+  def getCollection(self, exchanger):
+    return self.collection
+
+class NoSummaries(object):
+  def one(self, exchanger, unit):
+    return None
+
+def test_compare_backends():
+  timestamps, asks = randomAsks(20000, np.random.RandomState(2))
+  sums = summariesNaive(timestamps, asks)
+  differences = compare(ColumnTicks(timestamps, asks, sums), NoSummaries(),
+                        'bitflyer')
+  for unit in UNITS:
+    missing, diff = differences[unit]
+    assert missing == 0
+    assert diff < 1e-9 * asks.max()
+  # A bar missing in the aggregation and a different one are reported
+  sums['hourly'] = sums['hourly'][1:]
+  first = sums['daily'][0]
+  sums['daily'][0] = first[:3] + (first[3] + 1.,) + first[4:]
+  differences = compare(ColumnTicks(timestamps, asks, sums), NoSummaries(),
+                        'bitflyer')
+  assert differences['hourly'][0] == 1
+  assert np.isclose(differences['daily'][1], 1.)
+
+def test_compare():
+  client = pymongo.MongoClient(serverSelectionTimeoutMS=500)
+  try:
+    info = client.server_info()
+  except pymongo.errors.ServerSelectionTimeoutError:
+    pytest.skip('no mongod to aggregate ticks')
+  if tuple(info['versionArray'][:2]) < (5, 2):
+    pytest.skip('no $firstN before mongod 5.2')
+  client.drop_database('test_btctai_summarize')
+  try:
+    db = client.test_btctai_summarize
+    ticks = Ticks(db)
+    # Three weeks of asks every 10s, weekly bars over ITEMS_END asks
+    timestamps = datetime.datetime(2019, 3, 4).timestamp() + \
+                 10. * np.arange(3 * 7 * 24 * 360)
+    asks = 1e6 * np.exp(np.cumsum(
+      np.random.RandomState(0).normal(scale=1e-3, size=len(timestamps))))
+    ticks.getCollection('bitflyer').insert_many(
+      [{'datetime': t, 'ask': a, 'bid': a}
+       for t, a in zip(timestamps.tolist(), asks.tolist())])
+    differences = compare(ticks, Summaries(db), 'bitflyer')
+    for unit in UNITS:
+      missing, diff = differences[unit]
+      assert missing == 0
+      assert diff < 1e-9 * asks.max()
+  finally:
+    client.drop_database('test_btctai_summarize')
@@ -0,0 +1,127 @@
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CWD)
+
+from exampleConfig import importWithConfig
+
+supervisor = importWithConfig('supervisor')
+
+def ranges(lst, f=lambda x:x, indexEnd=-1):
+  indexStart = 0
+  lastKey = None
+  for item in lst:
+    index, key = f(item)
+    if lastKey is not None and lastKey != key:
+      yield {'start': indexStart, 'end': index, 'key': lastKey}
+      indexStart = index + 1
+    lastKey = key
+  yield {'start': indexStart, 'end': indexEnd, 'key': lastKey}
+
+def rectifyLoop(v1, v2):
+  k1 = [(k, +1) for k in np.where(v2 >= +1.)[0]]
+  k2 = [(k, -1) for k in np.where(v2 <= -1.)[0]]
+  ks = sorted(k1 + k2, key=lambda a:a[0])
+  w = np.zeros(v1.shape)
+  rs = list(ranges(ks, indexEnd=len(v1)))
+  k = None
+  for i in range(0, len(rs)):
+    if k is None:
+      start = rs[i]['start']
+    else:
+      start = k
+    end = rs[i]['end']
+    peek = rs[i]['key']
+    if peek == +1:
+      k = np.argmax(v1[start:end+1]) + start
+    else:
+      k = np.argmin(v1[start:end+1]) + start
+    w[k] = peek
+  return w
+
+def easingLoop(v, v2, minWidth):
+  def easing_(ks, i, minWidth, fkey=lambda xy:xy[0]):
+    while i + 1 < len(ks) and fkey(ks[i+1]) - fkey(ks[i]) < minWidth:
+      ks.pop(i+1)
+  ks = [(k, v2[k]) for k in np.where(np.abs(v2) >= 1.)[0]]
+  i = 0
+  while i < len(ks) - 1:
+    easing_(ks, i, minWidth)
+    i += 1
+  w = np.zeros(v.shape)
+  for k, v in ks:
+    w[k] = v
+  return w
+
+def randomPeeks(n, density, rand):
+  v2 = np.zeros(n)
+  ks = rand.choice(n, size=int(n * density), replace=False)
+  v2[ks] = rand.choice([-1., 1.], size=len(ks))
+  return v2
+
+def randomSeries(rand):
+  for n, density, ties in [(50, 0.3, False), (1000, 0.05, False),
+                           (1000, 0.5, False), (1000, 0.2, True)]:
+    v1 = np.cumsum(rand.normal(size=n))
+    if ties:
+      v1 = np.round(v1)
+    yield v1, randomPeeks(n, density, rand)
+
+def test_rectify():
+  rand = np.random.RandomState(0)
+  for _ in range(0, 20):
+    for v1, v2 in randomSeries(rand):
+      assert np.array_equal(supervisor.rectify(v1, v2), rectifyLoop(v1, v2))
+
+def test_easing():
+  rand = np.random.RandomState(1)
+  for _ in range(0, 20):
+    for v1, v2 in randomSeries(rand):
+      for minWidth in [1, 3, 11]:
+        assert np.array_equal(supervisor.easing(v1, v2, minWidth),
+                              easingLoop(v1, v2, minWidth))
+
+def trendLoop(peeks):
+  t = np.zeros(peeks.shape)
+  k = peeks[np.where(peeks != 0)[0][-1]]
+  for i in range(0, peeks.shape[0]):
+    j = peeks.shape[0] - i - 1
+    if peeks[j] != 0:
+      k = peeks[j]
+    t[j] = k
+  return t
+
+def trendStrengthLoop(values, vt):
+  ks = [(k, vt[k]) for k in np.where(np.abs(vt) >= 1.)[0]]
+  w = np.array(values)
+  for i in range(0, len(ks) - 1):
+    k0, v0 = ks[i]
+    k1, v1 = ks[i+1]
+    if k0 + 1 == k1:
+      continue
+    v = values[k0+1:k1]
+    vmax = np.max(v)
+    vmin = np.min(v)
+    if v0 <= -1. and vmin < 0: # incremental trend
+      w[k0+1:k1] = (v - vmin) / (vmax - vmin) * vmax
+    elif v0 >= +1. and vmax > 0: # decremental trend
+      w[k0+1:k1] = (vmax - v) / (vmax - vmin) * vmin
+  return w
+
+def test_trend():
+  rand = np.random.RandomState(2)
+  for _ in range(0, 20):
+    for _, v2 in randomSeries(rand):
+      assert np.array_equal(supervisor.trend(v2), trendLoop(v2))
+
+def test_trendStrength():
+  rand = np.random.RandomState(3)
+  for _ in range(0, 20):
+    for v1, v2 in randomSeries(rand):
+      values = np.tanh(np.diff(v1, prepend=0.)) * 0.5
+      with np.errstate(divide='ignore', invalid='ignore'):
+        expected = trendStrengthLoop(values, v2)
+      assert np.array_equal(supervisor.trendStrength(values, v2), expected,
+                            equal_nan=True)
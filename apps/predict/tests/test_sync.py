@@ -0,0 +1,138 @@
+import datetime
+import os
+import sys
+import threading
+import time
+import pytest
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(CWD)
+
+from exampleConfig import importWithConfig
+
+sync = importWithConfig('sync')
+RateLimiter = sync.RateLimiter
+
+class Clock(object):
+  def __init__(self):
+    self.now = 1000.
+    self.slept = []
+
+  def monotonic(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.slept.append(seconds)
+    self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+  c = Clock()
+  monkeypatch.setattr(time, 'monotonic', c.monotonic)
+  monkeypatch.setattr(time, 'sleep', c.sleep)
+  return c
+
+def test_RateLimiter_wait(clock):
+  limiter = RateLimiter(1., 60.)
+  limiter.wait()
+  assert clock.slept == []
+  clock.now += 0.25
+  limiter.wait()
+  assert clock.slept == [0.75]
+  clock.now += 2.
+  limiter.wait()
+  assert clock.slept == [0.75]
+
+def test_RateLimiter_interval(clock):
+  limiter = RateLimiter(1., 6.)
+  assert limiter.interval == 1.
+  for expected in [2., 4., 6., 6.]:
+    limiter.failed()
+    assert limiter.interval == expected
+  for expected in [3., 1.5, 1., 1.]:
+    limiter.succeeded()
+    assert limiter.interval == expected
+  # Failures back off from a zero interval too
+  limiter = RateLimiter(0., 6.)
+  limiter.failed()
+  assert limiter.interval == 1.
+  limiter.succeeded()
+  limiter.succeeded()
+  assert limiter.interval == 0.25
+
+def test_rateDefault():
+  assert sync.SYNC_RATE_MIN_SECONDS == 1.
+
+
+class DashboardDummy(object):
+  """
+  Returns count ticks a second apart after start, failing every
+  failEvery-th request.
+  """
+  def __init__(self, count=50, failEvery=None):
+    self.count = count
+    self.failEvery = failEvery
+    self.requests = 0
+
+  def requestTicks(self, exchanger, start):
+    self.requests += 1
+    if self.failEvery is not None and self.requests % self.failEvery == 0:
+      raise IOError('unavailable')
+    ticks = [{'ask': 100. + i, 'bid': 99. + i, 'datetime': start + i + 1.}
+             for i in range(self.count)]
+    return {'ticks': {exchanger: ticks}}
+
+class TicksDummy(object):
+  def __init__(self, failAt=None):
+    self.failAt = failAt
+    self.saved = {}
+    self.calls = 0
+
+  def one(self, exchanger):
+    return None
+
+  def saveAll(self, exchanger, ticks):
+    self.calls += 1
+    if self.failAt is not None and self.calls >= self.failAt:
+      raise IOError('cannot write')
+    self.saved.setdefault(exchanger, []).extend(ticks)
+
+@pytest.fixture
+def fast(monkeypatch):
+  monkeypatch.setattr(sync, 'SYNC_RATE_MIN_SECONDS', 0.)
+  monkeypatch.setattr(sync, 'SYNC_RATE_MAX_SECONDS', 0.)
+  monkeypatch.setattr(sync, 'SYNC_QUEUE_SIZE', 2)
+
+def test_sync(fast):
+  dateStart = datetime.datetime.now() - datetime.timedelta(seconds=1000)
+  ticksModel = TicksDummy()
+  sync.sync(lambda: DashboardDummy(failEvery=7), ticksModel, dateStart)
+  assert sorted(ticksModel.saved.keys()) == sorted(sync.SYNC_EXCHANGERS)
+  for ticks in ticksModel.saved.values():
+    dates = [t.date.timestamp() for t in ticks]
+    assert dates == sorted(set(dates))
+    assert dates[0] == pytest.approx(dateStart.timestamp() + 1.)
+    assert len(dates) >= 1000
+
+def test_sync_stopsOnSaveFailure(fast):
+  # Far more pages than the queue holds, fetching threads must stop
+  dateStart = datetime.datetime(2016, 12, 4)
+  ticksModel = TicksDummy(failAt=2)
+  dashboards = []
+  def newDashboard():
+    dashb = DashboardDummy(count=10)
+    dashboards.append(dashb)
+    return dashb
+  result = {}
+  def run():
+    try:
+      sync.sync(newDashboard, ticksModel, dateStart)
+    except IOError as e:
+      result['error'] = e
+  thread = threading.Thread(target=run, daemon=True)
+  thread.start()
+  thread.join(timeout=30)
+  assert not thread.is_alive()
+  assert str(result['error']) == 'cannot write'
+  assert ticksModel.calls == 2
+  assert all(d.requests < 100 for d in dashboards)
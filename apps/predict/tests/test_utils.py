@@ -0,0 +1,91 @@
+import os
+import sys
+import numpy as np
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+sys.path.append(os.path.join(CWD, '..', '..', 'trade', 'src'))
+
+from utils import readConfig, loadnpy, loadcolumns, savenpy, seriesPath, group
+from utils import npyPath, migrateNpy
+from series import readSeries, appendSeries
+
+def configIn(path):
+  config = readConfig('')
+  config['train'] = {'data.dir': str(path)}
+  return config
+
+def test_loadnpy_cache(tmp_path):
+  config = configIn(tmp_path)
+  savenpy(config, np.array([1., np.nan, 3.]), 'bitflyer', 'hourly', 'x')
+  x = loadnpy(config, 'bitflyer', 'hourly', 'x')
+  assert np.isnan(x[1])
+  assert not x.flags.writeable
+  assert loadnpy(config, 'bitflyer', 'hourly', 'x') is x
+  y = loadnpy(config, 'bitflyer', 'hourly', 'x', nan=0.)
+  assert np.array_equal(y, [1., 0., 3.])
+  assert not y.flags.writeable
+  assert np.isnan(loadnpy(config, 'bitflyer', 'hourly', 'x')[1])
+  savenpy(config, np.array([4., 5.]), 'bitflyer', 'hourly', 'x')
+  assert np.array_equal(loadnpy(config, 'bitflyer', 'hourly', 'x'), [4., 5.])
+
+def test_loadnpy_appended(tmp_path):
+  config = configIn(tmp_path)
+  savenpy(config, np.array([1., 2., 3.]), 'bitflyer', 'hourly', 'x')
+  path = seriesPath(config, 'bitflyer', 'hourly')
+  stat = os.stat(path)
+  x = loadnpy(config, 'bitflyer', 'hourly', 'x', nan=0.)
+  assert np.array_equal(x, [1., 2., 3.])
+  # Same inode, size and mtime as a write in place within mtime resolution,
+  # copies with NaN replaced are loaded again
+  appendSeries(path, 2, {'x': np.array([4.])})
+  os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+  x = loadnpy(config, 'bitflyer', 'hourly', 'x', nan=0.)
+  assert np.array_equal(x, [1., 2., 4.])
+
+def test_loadcolumns(tmp_path):
+  config = configIn(tmp_path)
+  savenpy(config, np.array([1., np.nan, 3.]), 'bitflyer', 'hourly', 'x')
+  savenpy(config, np.array([np.nan, 6.]), 'bitflyer', 'hourly', 'y')
+  x, y = loadcolumns(config, 'bitflyer', 'hourly', ['x', 'y'], nan=-1.)
+  assert np.array_equal(x, [1., -1., 3.])
+  assert np.array_equal(y, [-1., 6.])
+  assert loadnpy(config, 'bitflyer', 'hourly', 'y', nan=-1.) is y
+
+def test_loadcolumns_aligned(tmp_path):
+  config = configIn(tmp_path)
+  savenpy(config, np.array([1., 2., 3.]), 'bitflyer', 'hourly', 'x')
+  savenpy(config, np.array([20., 30.]), 'bitflyer', 'hourly', 'y')
+  # Exported rows appended after y was generated
+  path = seriesPath(config, 'bitflyer', 'hourly')
+  appendSeries(path, 3, {'x': np.array([4., 5.])})
+  x, y = loadcolumns(config, 'bitflyer', 'hourly', ['x', 'y'])
+  assert np.array_equal(x, [1., 2., 3.])
+  assert np.array_equal(y, [20., 30.])
+  assert np.array_equal(loadnpy(config, 'bitflyer', 'hourly', 'x'), [1., 2., 3.])
+  x = loadnpy(config, 'bitflyer', 'hourly', 'x', aligned=False)
+  assert np.array_equal(x, [1., 2., 3., 4., 5.])
+
+def test_migrateNpy(tmp_path):
+  config = configIn(tmp_path)
+  dates = 1000. + 60. * np.arange(4)
+  np.save(npyPath(config, 'bitflyer', 'hourly', 'date'), dates)
+  np.save(npyPath(config, 'bitflyer', 'hourly', 'askAverage'),
+          np.array([1., 2., 3., 4.]))
+  np.save(npyPath(config, 'bitflyer', 'hourly', 'askAverageBB+2'),
+          np.array([30., 40.]))
+  np.save(npyPath(config, 'bitflyer', 'daily', 'date'), dates)
+  x, y = loadcolumns(config, 'bitflyer', 'hourly',
+                     ['askAverage', 'askAverageBB+2'])
+  assert np.array_equal(x, [1., 2., 3., 4.])
+  assert np.array_equal(y, [30., 40.])
+  series = readSeries(seriesPath(config, 'bitflyer', 'hourly'))
+  assert (series.start, series.step, series.length) == (1000., 60., 4)
+  assert sorted(series.names()) == ['askAverage', 'askAverageBB+2', 'date']
+  assert migrateNpy(config, 'bitflyer', 'hourly') is None
+
+def test_group():
+  items = [1, 2, 12, 13, 14, 3, 25]
+  groups = list(group(lambda x:x // 10, items))
+  assert groups == [(0, [1, 2]), (1, [12, 13, 14]), (0, [3]), (2, [25])]
+  assert list(group(lambda x:x, [])) == []
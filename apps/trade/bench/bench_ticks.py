@@ -0,0 +1,70 @@
+"""
+Benchmark of tick storage modes of Ticks, insert throughput of Ticks.save
+and latency of range scans of Ticks.all. Needs mongod on localhost,
+ticks are written to bench_tick_db dropped after each mode.
+No results of it are recorded, storage modes are not chosen by speed yet.
+$ python bench_ticks.py [#ticks]
+"""
+import datetime
+import os
+import sys
+import timeit
+import numpy as np
+import pymongo
+
+CWD = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(CWD, '..', 'src'))
+
+from Models import Ticks
+from classes import Tick, OneTick
+
+DB_NAME = 'bench_tick_db'
+SCANS = 200
+SCAN_SECONDS = 60 * 60
+
+def randomTicks(n, rand, start=1.5e9, interval=30.):
+  asks = 1e6 * np.exp(np.cumsum(rand.normal(scale=1e-4, size=n)))
+  return [OneTick(ask, ask - 100., datetime.datetime.fromtimestamp(
+                    start + i * interval))
+          for i, ask in enumerate(asks)]
+
+def bench(client, storage, ones, rand):
+  client.drop_database(DB_NAME)
+  try:
+    ticks = Ticks(client[DB_NAME], storage=storage)
+    exchangers = [Tick.BitFlyer]
+    begin = timeit.default_timer()
+    for one in ones:
+      ticks.save(Tick({Tick.BitFlyer: one}), exchangers=exchangers)
+    inserted = len(ones) / (timeit.default_timer() - begin)
+    first = ones[0].date.timestamp()
+    last = ones[-1].date.timestamp()
+    starts = rand.uniform(first, last - SCAN_SECONDS, size=SCANS)
+    latencies = []
+    for start in starts:
+      begin = timeit.default_timer()
+      ticks.all(exchangers=exchangers, start=start,
+                end=start + SCAN_SECONDS, limit=1000)
+      latencies.append(timeit.default_timer() - begin)
+    print('storage={s}, #ticks={n}, insert={i:.0f}/s, '
+          'scan median={m:.2f}ms, p95={p:.2f}ms'
+          .format(s=storage, n=len(ones), i=inserted,
+                  m=np.median(latencies) * 1e3,
+                  p=np.percentile(latencies, 95) * 1e3))
+  finally:
+    client.drop_database(DB_NAME)
+
+def main():
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+  client = pymongo.MongoClient(serverSelectionTimeoutMS=2000)
+  info = client.server_info()
+  rand = np.random.RandomState(0)
+  ones = randomTicks(n, rand)
+  storages = [Ticks.Upsert, Ticks.Insert]
+  if tuple(info['versionArray'][:2]) >= (5, 0):
+    storages.append(Ticks.TimeSeries)
+  for storage in storages:
+    bench(client, storage, ones, rand)
+
+if __name__ == '__main__':
+  main()
@@ -17,6 +17,26 @@ QUOINE_TICK_SIZE = 0.1
 MONGO_HOST = 'localhost'
 MONGO_PORT = 27017
 SAVE_TICKDATE_IN_STRING = False
+# Values設定のキャッシュ秒数 (0で無効), change streamで変更を即時反映
+VALUES_CACHE_SECONDS = 60
+VALUES_CACHE_WATCH = True
+# 最新Tickのスナップショット秒数, change streamで保存を即時反映
+# Tickerは最新Tickをこの秒数に1回だけ書き込む
+TICKS_SNAPSHOT_SECONDS = 3
+TICKS_SNAPSHOT_WATCH = True
+# 保存からこの秒数を過ぎたTickは売買判断に使わない
+TICKS_MAX_SECONDS = 120
+# Tickの保存方法 'upsert', 'insert' (datetimeでunique) or 'timeseries'
+TICKS_STORAGE = 'upsert'
+# 取引所ごとのTick保持秒数と間引き秒数, e.g. {'bitflyer': 90 * 24 * 60 * 60}
+TICKS_RETENTION_SECONDS = {}
+TICKS_DOWNSAMPLE_SECONDS = {}
+# Tickerの書き込み, N件ごとかMミリ秒ごとにまとめて保存, 溢れた古いTickは破棄
+TICKS_WRITE_BATCH = 50
+TICKS_WRITE_MILLIS = 5000
+TICKS_WRITE_BUFFER = 100000
+# 一時的な障害で書き込めないTickを再送する回数, 超えると破棄
+TICKS_WRITE_RETRIES = 60
 
 # Binance設定
 BINANCE_API_KEY = None
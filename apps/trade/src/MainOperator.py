@@ -9,9 +9,11 @@ class MainOperatorDBException(RuntimeError):
   pass
 
 class MainOperator(object):
-  def __init__(self, models, accountId, logger=None):
+  def __init__(self, models, accountId, logger=None, ticksMaxSeconds=None):
     self.models = models
     self.accountId = accountId
+    # Ticks saved more than ticksMaxSeconds ago are not used
+    self.ticksMaxSeconds = ticksMaxSeconds
     if logger is None:
       logger = logging.getLogger()
     self.logger = logger
@@ -96,8 +98,17 @@ class MainOperator(object):
     return result
 
   def getPositionVariation(self):
-    tick = self.models.Ticks.one()
+    tick = self.models.Ticks.one(maxSeconds=self.ticksMaxSeconds)
     longs, shorts = self.getOpenPositions()
+    exchangers = {o.exchanger for p in longs + shorts for o in p.positions}
+    stale = [e for e in exchangers if tick.exchanger(e) is None]
+    if len(stale) > 0:
+      self.logger.warning('No recent tick for variations, exchangers={e}.'
+                          .format(e=stale))
+      return {
+        'long': [],
+        'short': []
+      }
     onePosition = None
     varLongs = []
     varShorts = []
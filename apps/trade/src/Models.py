@@ -1,17 +1,119 @@
+import collections
 import itertools
 import datetime
+import logging
+import threading
+import time
 import pymongo
 
 from classes import Tick, OneTick, OnePosition, Confidence, TrendStrength, Trade, Position, datetimeToStr
 
+ASC = pymongo.ASCENDING
+DESC = pymongo.DESCENDING
+
+# Fields of text indexes created formerly, on account_id, and on account_id
+# and k
+FORMER_TEXT_FIELDS = [{'account_id'}, {'account_id', 'k'}]
+
+def isFormerTextIndex(info):
+  """
+  (info: dict) -> bool
+  Returns True if an index of index_information is a text index created
+  formerly, fields of text indexes are listed in weights over _fts.
+  """
+  key = info['key']
+  if not any(v == pymongo.TEXT for _, v in key):
+    return False
+  fields = {k for k, v in key if v == pymongo.TEXT and k != '_fts'}
+  fields |= set(info.get('weights', {}))
+  return fields in FORMER_TEXT_FIELDS
+
+def ensureIndexes(collection, indexes, logger=None):
+  """
+  (collection: Collection, indexes: [[(str, int)] | ([(str, int)], dict)],
+   logger: Logger?) -> [str]
+  Creates indexes missing in a collection and returns their names.
+  An index is its keys, or its keys and options of create_index.
+  An index of the same keys but other options is created again, the old
+  one is restored if the new one fails.
+  Text indexes on account_id created formerly are dropped, they are not
+  used by equality conditions and sorts of the queries. Other text indexes
+  are kept.
+  """
+  if logger is None:
+    logger = logging.getLogger()
+  infos = collection.index_information()
+  existing = {}
+  for name, info in infos.items():
+    key = tuple((k, v) for k, v in info['key'])
+    if isFormerTextIndex(info):
+      logger.info('Dropping text index, collection={c}, name={n}.'
+                  .format(c=collection.name, n=name))
+      collection.drop_index(name)
+    else:
+      existing[key] = (name, info)
+  created = []
+  for index in indexes:
+    keys, options = index if isinstance(index, tuple) else (index, {})
+    found = existing.get(tuple(keys))
+    if found is not None:
+      name, info = found
+      if all(info.get(k) == v for k, v in options.items()):
+        continue
+      logger.info('Dropping index of other options, collection={c}, '
+                  'name={n}.'.format(c=collection.name, n=name))
+      collection.drop_index(name)
+    else:
+      info = None
+    logger.info('Creating index, collection={c}, key={k}, options={o}.'
+                .format(c=collection.name, k=keys, o=options))
+    try:
+      created.append(collection.create_index(keys, **options))
+    except pymongo.errors.OperationFailure:
+      if info is not None:
+        logger.warning('Restoring index, collection={c}, name={n}.'
+                       .format(c=collection.name, n=name))
+        olds = {k: v for k, v in info.items() if k not in ['v', 'key', 'ns']}
+        collection.create_index(info['key'], name=name, **olds)
+      raise
+  return created
+
+def watchCollection(collection, onChange, onStop, logger=None):
+  """
+  (collection: Collection, onChange: dict -> any, onStop: () -> any,
+   logger: Logger?) -> Thread
+  Starts a thread calling onChange with each change of a collection,
+  and onStop when the change stream stops.
+  Change streams need a replica set, the stream stops at once without it.
+  """
+  if logger is None:
+    logger = logging.getLogger()
+  def _watch():
+    try:
+      with collection.watch(full_document='updateLookup') as stream:
+        for change in stream:
+          onChange(change)
+    except pymongo.errors.PyMongoError as e:
+      logger.warning('Change stream stopped, collection={c}, e={e}.'
+                     .format(c=collection.name, e=e))
+    onStop()
+  thread = threading.Thread(target=_watch, daemon=True)
+  thread.start()
+  return thread
+
 class Models(object):
-    def __init__(self, dbs, saveTickDateInString=False):
+    def __init__(self, dbs, saveTickDateInString=False, valuesCacheSeconds=0,
+                 ticksSnapshotSeconds=1, ticksStorage='upsert',
+                 ticksRetentions=None, ticksDownsamples=None):
       btctai_db = dbs.btctai_db
       tick_db = dbs.tick_db
-      self.Values = Values(btctai_db)
+      self.Values = Values(btctai_db, cacheSeconds=valuesCacheSeconds)
       self.Confidences = Confidences(btctai_db)
       self.TrendStrengths = TrendStrengths(btctai_db)
-      self.Ticks = Ticks(tick_db, saveDateInString=saveTickDateInString)
+      self.Ticks = Ticks(tick_db, saveDateInString=saveTickDateInString,
+                         snapshotSeconds=ticksSnapshotSeconds,
+                         storage=ticksStorage, retentions=ticksRetentions,
+                         downsamples=ticksDownsamples)
       self.Trades = Trades(btctai_db)
       self.Positions = Positions(btctai_db)
 
@@ -34,8 +136,18 @@ class Models(object):
       return self.Positions
 
 
+class TicksStorageError(RuntimeError):
+  pass
+
 class Ticks(object):
-  def __init__(self, db, saveDateInString=False):
+  # Storage modes, ticks are upserted by datetime, inserted with unique
+  # datetime, or inserted to time-series collections
+  Upsert = 'upsert'
+  Insert = 'insert'
+  TimeSeries = 'timeseries'
+
+  def __init__(self, db, saveDateInString=False, snapshotSeconds=1,
+               storage='upsert', retentions=None, downsamples=None):
     self.db = db
     self.collections = {
       Tick.BitFlyer: self.db.tick_bitflyer,
@@ -44,20 +156,200 @@ class Ticks(object):
       Tick.BinanceETHBTC: self.db.tick_binance_ethbtc,
       Tick.BinanceXRPBTC: self.db.tick_binance_xrpbtc
     }
+    # The latest tick of each exchanger, saved by the ticker
+    self.latestCollection = self.db.tick_latest
     self.saveDateInString = saveDateInString
+    # Snapshot of the latest ticks is loaded again after snapshotSeconds,
+    # and the latest tick of each exchanger is written at most once in it
+    self.snapshotSeconds = snapshotSeconds
+    self.snapshot = {}
+    self.savedAt = {}
+    self.loadedAt = None
+    self.publishedAt = {}
+    self.lock = threading.Lock()
+    if storage not in [Ticks.Upsert, Ticks.Insert, Ticks.TimeSeries]:
+      raise ValueError('unknown tick storage, storage={s}.'.format(s=storage))
+    self.storage = storage
+    # Seconds to keep ticks, and to skip ticks after a saved one,
+    # of each exchanger
+    self.retentions = retentions or {}
+    self.downsamples = downsamples or {}
+    self.lastDates = {}
+    self.setup()
+
+  def indexesOf(self, exchanger):
+    """
+    (self: Ticks, exchanger: str) -> [[(str, int)] | ([(str, int)], dict)]
+    """
+    if self.storage == Ticks.TimeSeries:
+      # Time-series collections expire ticks by themselves
+      return [[('date', DESC)]]
+    if self.storage == Ticks.Insert:
+      indexes = [([('datetime', DESC)], {'unique': True})]
+    else:
+      indexes = [[('datetime', DESC)]]
+    retention = self.retentions.get(exchanger)
+    if retention is not None:
+      indexes.append(([('date', ASC)], {'expireAfterSeconds': retention}))
+    return indexes
 
   def setup(self):
-    for k, collection in self.collections:
-      collection.create_index([('datetime', pymongo.DESCENDING)])
+    """
+    Creates collections and indexes of the storage mode.
+    Collections of ticks are not converted to time-series ones, to migrate
+    ticks of an exchanger, rename its collection, run setup to create
+    the time-series one, insert documents of old ticks with date as BSON
+    date (see documentOf), and drop the renamed collection.
+    Ticks saved without date do not expire by the TTL index, they are
+    removed here instead once older than the retention.
+    """
+    if self.storage == Ticks.TimeSeries:
+      infos = {info['name']: info for info in self.db.list_collections()}
+      for e, collection in self.collections.items():
+        self.setupTimeSeries(collection, infos.get(collection.name),
+                             self.retentions.get(e))
+    for e, collection in self.collections.items():
+      try:
+        ensureIndexes(collection, self.indexesOf(e))
+      except pymongo.errors.OperationFailure as err:
+        if err.code != 11000:
+          raise
+        raise TicksStorageError(
+          'Duplicate ticks of datetime, remove them to insert ticks with '
+          'unique datetime, collection={c}.'.format(c=collection.name)) \
+          from err
+      retention = self.retentions.get(e)
+      if self.storage != Ticks.TimeSeries and retention is not None:
+        self.removeUndated(collection, retention)
+
+  def removeUndated(self, collection, retention):
+    """
+    Removes ticks without date older than retention seconds.
+    """
+    oldest = datetime.datetime.now() - datetime.timedelta(seconds=retention)
+    if self.saveDateInString:
+      oldest = datetimeToStr(oldest)
+    else:
+      oldest = oldest.timestamp()
+    collection.delete_many({'date': {'$exists': False},
+                            'datetime': {'$lt': oldest}})
+
+  def setupTimeSeries(self, collection, info, retention):
+    """
+    Creates a time-series collection, or updates expiry of an existing one.
+    """
+    if info is None:
+      options = {
+        'timeseries': {'timeField': 'date', 'granularity': 'seconds'}
+      }
+      if retention is not None:
+        options['expireAfterSeconds'] = retention
+      self.db.create_collection(collection.name, **options)
+    elif info.get('type') != 'timeseries':
+      raise TicksStorageError(
+        'Not a time-series collection of ticks, migrate it as Ticks.setup '
+        'describes, collection={c}.'.format(c=collection.name))
+    elif info.get('options', {}).get('expireAfterSeconds') != retention:
+      self.db.command('collMod', collection.name,
+                      expireAfterSeconds='off' if retention is None
+                      else retention)
 
-  def one(self, exchangers=None):
+  def update(self, exchanger, obj, savedAt):
     """
-    (self: Ticks, exchangers: [str]?) -> Tick
+    Keeps a tick in snapshot unless a newer one is there, or the same
+    one saved later.
+    """
+    one = OneTick.fromDict(obj)
+    with self.lock:
+      old = self.snapshot.get(exchanger)
+      if (old is None or old.date < one.date or
+          (old.date == one.date and self.savedAt[exchanger] <= savedAt)):
+        self.snapshot[exchanger] = one
+        self.savedAt[exchanger] = savedAt
+
+  def publishing(self, exchanger):
+    """
+    Returns True if the latest tick of exchanger is to be written to the
+    latest collection, at most once in snapshotSeconds.
+    """
+    now = time.monotonic()
+    with self.lock:
+      last = self.publishedAt.get(exchanger)
+      if last is not None and now - last < self.snapshotSeconds:
+        return False
+      self.publishedAt[exchanger] = now
+      return True
+
+  def latest(self):
+    """
+    (self: Ticks) -> ({str: OneTick}, {str: float})
+    Returns snapshot of the latest ticks and when they were saved,
+    loading them from the latest collection at once if snapshot expired.
+    """
+    now = time.monotonic()
+    with self.lock:
+      loadedAt = self.loadedAt
+    if loadedAt is None or now - loadedAt >= self.snapshotSeconds:
+      for obj in self.latestCollection.find():
+        self.update(obj['_id'], obj['tick'], obj['saved_at'])
+      with self.lock:
+        self.loadedAt = now
+    with self.lock:
+      return dict(self.snapshot), dict(self.savedAt)
+
+  def watch(self, logger=None):
+    """
+    (self: Ticks, logger: Logger?) -> Thread
+    Starts a thread updating snapshot on saves of the latest ticks.
+    Without a replica set snapshot is just loaded again when it expires.
+    """
+    def onChange(change):
+      obj = change.get('fullDocument')
+      if obj is not None:
+        self.update(obj['_id'], obj['tick'], obj['saved_at'])
+    def onStop():
+      with self.lock:
+        self.loadedAt = None
+    return watchCollection(self.latestCollection, onChange, onStop,
+                           logger=logger)
+
+  def one(self, exchangers=None, maxSeconds=None):
+    """
+    (self: Ticks, exchangers: [str]?, maxSeconds: float?) -> Tick
+    Ticks saved more than maxSeconds ago are None.
     """
     if exchangers is None:
       exchangers = Tick.exchangers()
+    snapshot, savedAt = self.latest()
+    result = {e: snapshot.get(e) for e in exchangers}
+    # Exchangers never saved to the latest collection
+    missing = [e for e in exchangers if e not in snapshot]
+    if len(missing) > 0:
+      result.update(self.oneOf(missing).ticks)
+    if maxSeconds is not None:
+      now = time.time()
+      for e in exchangers:
+        if now - savedAt.get(e, -float('inf')) > maxSeconds:
+          result[e] = None
+    return Tick(result)
+
+  def lastSaved(self, exchanger):
+    """
+    (self: Ticks, exchanger: str) -> float?
+    Returns the timestamp when the latest tick of exchanger was saved.
+    """
+    _, savedAt = self.latest()
+    return savedAt.get(exchanger)
+
+  def oneOf(self, exchangers):
+    """
+    (self: Ticks, exchangers: [str]) -> Tick
+    Returns the latest ticks reading collections of exchangers.
+    """
     collections = [self.collections[e] for e in exchangers]
-    curs = [c.find().sort('datetime', -1).limit(1) for c in collections]
+    # Time-series collections are indexed by date only
+    field = 'date' if self.storage == Ticks.TimeSeries else 'datetime'
+    curs = [c.find().sort(field, -1).limit(1) for c in collections]
     result = {}
     for e, cur in zip(exchangers, curs):
       t = next(cur, None)
@@ -75,6 +367,8 @@ class Ticks(object):
     if exchangers is None:
       exchangers = Tick.exchangers()
     order = 1 if order > 0 else -1
+    if self.storage == Ticks.TimeSeries:
+      return self.allTimeSeries(exchangers, start, end, limit, order)
     collections = [self.collections[e] for e in exchangers]
     conditions = []
     if start is not None:
@@ -101,9 +395,70 @@ class Ticks(object):
       result[e] = [OneTick.fromDict(t) for t in cur]
     return result
 
+  def allTimeSeries(self, exchangers, start, end, limit, order):
+    """
+    Returns ticks of time-series collections, which are ranged by date.
+    """
+    conditions = {}
+    if start is not None:
+      conditions['$gt'] = datetime.datetime.fromtimestamp(
+        start, tz=datetime.timezone.utc)
+    if end is not None:
+      conditions['$lt'] = datetime.datetime.fromtimestamp(
+        end, tz=datetime.timezone.utc)
+    conditions = {'date': conditions} if len(conditions) > 0 else {}
+    result = {}
+    for e in exchangers:
+      cur = self.collections[e].find(conditions).sort('date', order)
+      result[e] = [OneTick.fromDict(t) for t in cur.limit(limit)]
+    return result
+
+  def documentOf(self, exchanger, onetick):
+    """
+    (self: Ticks, exchanger: str, onetick: OneTick) -> dict
+    Ticks have date as BSON date too, if they are in a time-series
+    collection or expire.
+    """
+    obj = onetick.toDict(dateInString=self.saveDateInString)
+    if (self.storage == Ticks.TimeSeries or
+        self.retentions.get(exchanger) is not None):
+      obj['date'] = datetime.datetime.fromtimestamp(
+        onetick.date.timestamp(), tz=datetime.timezone.utc)
+    return obj
+
+  def downsampled(self, exchanger, onetick):
+    """
+    Returns True if a tick comes within downsampling seconds of the last
+    saved one, which is not saved.
+    """
+    seconds = self.downsamples.get(exchanger)
+    timestamp = onetick.date.timestamp()
+    last = self.lastDates.get(exchanger)
+    if seconds is not None and last is not None and timestamp - last < seconds:
+      return True
+    self.lastDates[exchanger] = timestamp
+    return False
+
+  def write(self, exchanger, obj):
+    """
+    Writes a tick by storage mode, returns True if it is newly stored.
+    """
+    collection = self.collections[exchanger]
+    if self.storage == Ticks.Upsert:
+      result = collection.replace_one({'datetime': obj['datetime']},
+                                      obj, upsert=True)
+      return result.upserted_id is not None
+    try:
+      # insert_one sets _id to the document
+      collection.insert_one(dict(obj))
+    except pymongo.errors.DuplicateKeyError:
+      return False
+    return True
+
   def save(self, tick, exchangers=None):
     """
-    (self: Ticks, tick: Tick, exchangers: [str]?) -> Tick
+    (self: Ticks, tick: Tick, exchangers: [str]?) -> {str: OneTick}
+    Returns ticks newly stored, and None for the other exchangers.
     """
     if exchangers is None:
       exchangers = tick.exchangers()
@@ -111,13 +466,189 @@ class Ticks(object):
     for e in exchangers:
       if tick.exchanger(e) is not None:
         t = tick.exchanger(e)
-        obj = t.toDict(dateInString=self.saveDateInString)
-        result = self.collections[e].replace_one({'datetime': obj['datetime']},
-                                                 obj, upsert=True)
-        if result.matched_count != 0:
+        obj = self.documentOf(e, t)
+        if not self.downsampled(e, t) and self.write(e, obj):
           results[e] = t
+        savedAt = time.time()
+        if self.publishing(e):
+          self.latestCollection.replace_one(
+            {'_id': e}, {'_id': e, 'tick': obj, 'saved_at': savedAt},
+            upsert=True)
+        self.update(e, obj, savedAt)
     return results
 
+  def operationOf(self, obj):
+    """
+    Returns an operation of bulk_write to write a tick by storage mode.
+    """
+    if self.storage == Ticks.Upsert:
+      return pymongo.ReplaceOne({'datetime': obj['datetime']}, obj,
+                                upsert=True)
+    return pymongo.InsertOne(dict(obj))
+
+  def saveAll(self, items, logger=None):
+    """
+    (self: Ticks, items: [(exchanger: str, obj: dict, store: bool)],
+     logger: Logger?) -> (int, [(str, dict, bool)])
+    Writes documents of ticks with an unordered bulk_write for each
+    exchanger, and returns the number of newly stored ones, as save,
+    and items of exchangers failed by transient errors to be written again.
+    Ticks failed by other errors are logged and dropped. Ticks not to store
+    only update the latest ones.
+    """
+    if logger is None:
+      logger = logging.getLogger()
+    operations = {}
+    latest = {}
+    for e, obj, store in items:
+      if store:
+        operations.setdefault(e, []).append(self.operationOf(obj))
+      latest[e] = obj
+    written = 0
+    failed = []
+    for e, ops in operations.items():
+      try:
+        result = self.collections[e].bulk_write(ops, ordered=False)
+        details = result.bulk_api_result
+      except pymongo.errors.BulkWriteError as err:
+        details = err.details
+        # Ticks written already are skipped with unique datetime
+        errors = [x for x in details['writeErrors'] if x['code'] != 11000]
+        if len(errors) > 0:
+          logger.error('Dropped ticks failed to write, exchanger={e}, '
+                       '#failed={n}, error={x}.'
+                       .format(e=e, n=len(errors), x=errors[0].get('errmsg')))
+      except pymongo.errors.AutoReconnect as err:
+        # NetworkTimeout too, ticks written partly are skipped or written
+        # again by storage mode
+        logger.warning('Failed to write ticks, exchanger={e}, #ticks={n}, '
+                       'e={err}.'.format(e=e, n=len(ops), err=err))
+        failed += [item for item in items if item[0] == e and item[2]]
+        continue
+      except pymongo.errors.PyMongoError as err:
+        logger.error('Dropped ticks failed to write, exchanger={e}, '
+                     '#ticks={n}, e={err}.'.format(e=e, n=len(ops), err=err))
+        continue
+      written += details['nInserted'] + details['nUpserted']
+    savedAt = time.time()
+    published = [pymongo.ReplaceOne({'_id': e},
+                                    {'_id': e, 'tick': obj,
+                                     'saved_at': savedAt},
+                                    upsert=True)
+                 for e, obj in latest.items() if self.publishing(e)]
+    if len(published) > 0:
+      try:
+        self.latestCollection.bulk_write(published, ordered=False)
+      except pymongo.errors.PyMongoError as err:
+        logger.warning('Failed to write the latest ticks, e={err}.'
+                       .format(err=err))
+    for e, obj in latest.items():
+      self.update(e, obj, savedAt)
+    return written, failed
+
+
+class TicksWriter(object):
+  """
+  Buffers ticks saved by Ticker threads, and a thread writes them with
+  Ticks.saveAll every batchSize ticks or flushSeconds, so that fetching
+  ticks never waits for Mongo. While Mongo is slow or down, ticks are kept
+  up to maxBuffer and the oldest ones are dropped beyond it. Ticks failed
+  by transient errors are written again, and dropped after maxRetries
+  failures in a row.
+  """
+  def __init__(self, ticks, batchSize=100, flushSeconds=1.0, maxBuffer=10000,
+               maxRetries=60, logger=None):
+    self.ticks = ticks
+    self.batchSize = batchSize
+    self.flushSeconds = flushSeconds
+    self.maxBuffer = maxBuffer
+    self.maxRetries = maxRetries
+    self.retries = 0
+    if logger is None:
+      logger = logging.getLogger()
+    self.logger = logger
+    self.buffer = collections.deque()
+    self.dropped = 0
+    self.stopped = False
+    self.condition = threading.Condition()
+    self.thread = None
+
+  def start(self):
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    """
+    Writes buffered ticks and stops the thread.
+    """
+    with self.condition:
+      self.stopped = True
+      self.condition.notify()
+    if self.thread is not None:
+      self.thread.join()
+
+  def push(self, items, front=False):
+    with self.condition:
+      if front:
+        self.buffer.extendleft(reversed(items))
+      else:
+        self.buffer.extend(items)
+      while len(self.buffer) > self.maxBuffer:
+        self.buffer.popleft()
+        self.dropped += 1
+      if len(self.buffer) >= self.batchSize:
+        self.condition.notify()
+
+  def save(self, tick, exchangers=None):
+    """
+    (self: TicksWriter, tick: Tick, exchangers: [str]?) -> {str: OneTick}
+    Same as Ticks.save but ticks are buffered to be written later.
+    """
+    if exchangers is None:
+      exchangers = tick.exchangers()
+    items = []
+    for e in exchangers:
+      t = tick.exchanger(e)
+      if t is not None:
+        store = not self.ticks.downsampled(e, t)
+        items.append((e, self.ticks.documentOf(e, t), store))
+    self.push(items)
+    return {e: tick.exchanger(e) for e in exchangers}
+
+  def run(self):
+    while True:
+      with self.condition:
+        self.condition.wait_for(
+          lambda: self.stopped or len(self.buffer) >= self.batchSize,
+          timeout=self.flushSeconds)
+        items = list(self.buffer)
+        self.buffer.clear()
+        dropped, self.dropped = self.dropped, 0
+        stopped = self.stopped
+      if dropped > 0:
+        self.logger.warning('TicksWriter dropped old ticks, #dropped={n}.'
+                            .format(n=dropped))
+      if len(items) > 0:
+        written, failed = self.ticks.saveAll(items, logger=self.logger)
+        self.logger.debug('TicksWriter wrote ticks, #items={n}, '
+                          '#written={w}, #failed={f}.'
+                          .format(n=len(items), w=written, f=len(failed)))
+        if len(failed) == 0:
+          self.retries = 0
+        elif stopped or self.retries >= self.maxRetries:
+          self.logger.error('TicksWriter dropped ticks failed to write, '
+                            '#failed={f}, #retries={r}.'
+                            .format(f=len(failed), r=self.retries))
+          self.retries = 0
+        else:
+          # Written again with next ticks, after a while
+          self.retries += 1
+          self.push(failed, front=True)
+          time.sleep(self.flushSeconds)
+      if stopped:
+        break
+
 
 class Values(object):
   Enabled = 'monitor.enabled'
@@ -182,23 +713,79 @@ class Values(object):
     PositionThresLossCut: 'float'
   }
   
-  def __init__(self, db):
+  def __init__(self, db, cacheSeconds=0):
     self.collection = db.values
+    # Values of an account are cached for cacheSeconds, 0 disables cache
+    self.cacheSeconds = cacheSeconds
+    self.caches = {}
+    self.generation = 0
+    self.lock = threading.Lock()
     self.setup()
   
+  Indexes = [[('account_id', ASC), ('k', ASC)]]
+
   def setup(self):
-    self.collection.create_index([('account_id', pymongo.TEXT),
-                                  ('k', pymongo.TEXT)])
+    ensureIndexes(self.collection, Values.Indexes)
   
+  def load(self, accountId):
+    """
+    (self: Values, accountId: str) -> {str: any}
+    """
+    objs = self.collection.find({'account_id': accountId})
+    return {kv['k']: kv['v'] for kv in objs}
+
+  def cached(self, accountId):
+    """
+    (self: Values, accountId: str) -> {str: any}
+    Returns all of values of an account, loaded at once and kept until
+    they expire or are invalidated.
+    """
+    if self.cacheSeconds <= 0:
+      return self.load(accountId)
+    now = time.monotonic()
+    with self.lock:
+      cache = self.caches.get(accountId)
+      generation = self.generation
+    if cache is not None and now - cache[0] < self.cacheSeconds:
+      return cache[1]
+    kvs = self.load(accountId)
+    with self.lock:
+      # Values loaded before an invalidation are not kept
+      if generation == self.generation:
+        self.caches[accountId] = (now, kvs)
+    return kvs
+
+  def invalidate(self, accountId=None):
+    """
+    Drops cached values of an account, or of all accounts if it is None.
+    """
+    with self.lock:
+      self.generation += 1
+      if accountId is None:
+        self.caches.clear()
+      else:
+        self.caches.pop(accountId, None)
+
+  def watch(self, logger=None):
+    """
+    (self: Values, logger: Logger?) -> Thread
+    Starts a thread invalidating cached values on changes of the collection.
+    Without a replica set values just expire.
+    """
+    def onChange(change):
+      # Deleted documents have no account_id
+      obj = change.get('fullDocument') or {}
+      self.invalidate(obj.get('account_id'))
+    return watchCollection(self.collection, onChange, self.invalidate,
+                           logger=logger)
+
   def all(self, accountId):
     """
     (self: Values, accountId: str) -> {str: (value: any, type: str)}
     """
     kvs = {k: (None, Values.AllTypes[k]) for k in Values.AllKeys}
-    conditions = {'account_id': accountId}
-    objs = self.collection.find(conditions)
-    for kv in objs:
-      kvs[kv['k']] = (kv['v'], Values.AllTypes[kv['k']])
+    for k, v in self.cached(accountId).items():
+      kvs[k] = (v, Values.AllTypes[k])
     return kvs
 
   def get(self, key, accountId):
@@ -207,14 +794,7 @@ class Values(object):
     """
     if key not in Values.AllKeys:
       raise KeyError(key)
-    conditions = {
-      '$and': [{'account_id': accountId}, {'k': key}]
-    }
-    kv = self.collection.find_one(conditions)
-    if kv is None:
-      return None
-    else:
-      return kv['v']
+    return self.cached(accountId).get(key)
   
   def set(self, key, value, accountId):
     """
@@ -226,9 +806,17 @@ class Values(object):
     conditions = {'$and': [{'account_id': accountId}, {'k': key}]}
     result = self.collection.replace_one(conditions, kv, upsert=True)
     if result.upserted_id is None and result.matched_count == 0:
+      self.invalidate(accountId)
       return None
-    else:
-      return value
+    with self.lock:
+      self.generation += 1
+      cache = self.caches.get(accountId)
+      if cache is not None:
+        # Cached dict is replaced as readers may iterate it
+        kvs = dict(cache[1])
+        kvs[key] = value
+        self.caches[accountId] = (cache[0], kvs)
+    return value
 
   def getType(self, key):
     return Values.AllTypes[key]
@@ -251,9 +839,13 @@ class Confidences(object):
     self.collection = db.confidences
     self.setup()
 
+  Indexes = [
+    [('account_id', ASC), ('timestamp', DESC)],
+    [('account_id', ASC), ('status', ASC), ('timestamp', DESC)]
+  ]
+
   def setup(self):
-    self.collection.create_index([('account_id', pymongo.TEXT),
-                                  ('timestamp', pymongo.DESCENDING)])
+    ensureIndexes(self.collection, Confidences.Indexes)
 
   def oneNew(self, accountId):
     """
@@ -317,9 +909,10 @@ class TrendStrengths(object):
     self.collection = db.trendstrength
     self.setup()
 
+  Indexes = [[('account_id', ASC), ('timestamp', DESC)]]
+
   def setup(self):
-    self.collection.create_index([('account_id', pymongo.TEXT),
-                                  ('timestamp', pymongo.DESCENDING)])
+    ensureIndexes(self.collection, TrendStrengths.Indexes)
 
   def oneNew(self, accountId):
     """
@@ -383,9 +976,10 @@ class Trades(object):
     self.collection = db.conditions
     self.setup()
   
+  Indexes = [[('account_id', ASC), ('timestamp', DESC)]]
+
   def setup(self):
-    self.collection.create_index([('account_id', pymongo.TEXT),
-                                  ('timestamp', pymongo.DESCENDING)])
+    ensureIndexes(self.collection, Trades.Indexes)
 
   def all(self, accountId, before=None, count=None):
     """
@@ -422,11 +1016,13 @@ class Positions(object):
     self.collection = db.positions
     self.setup()
   
+  Indexes = [
+    [('account_id', ASC), ('timestamp', DESC)],
+    [('account_id', ASC), ('status', ASC), ('timestamp', DESC)]
+  ]
+
   def setup(self):
-    self.collection.create_index([('account_id', pymongo.TEXT),
-                                  ('timestamp', pymongo.DESCENDING)])
-    self.collection.create_index([('account_id', pymongo.DESCENDING),
-                                  ('status', pymongo.DESCENDING)])
+    ensureIndexes(self.collection, Positions.Indexes)
   
   def one(self, accountId, timestamp=None):
     """
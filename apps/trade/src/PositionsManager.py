@@ -7,9 +7,11 @@ class PositionsManagerDBException(RuntimeError):
   pass
 
 class PositionsManager(object):
-  def __init__(self, models, accountId, logger=None):
+  def __init__(self, models, accountId, logger=None, ticksMaxSeconds=None):
     self.models = models
     self.accountId = accountId
+    # Ticks saved more than ticksMaxSeconds ago are not used
+    self.ticksMaxSeconds = ticksMaxSeconds
     if logger is None:
       logger = logging.getLogger()
     self.logger = logger
@@ -44,10 +46,14 @@ class PositionsManager(object):
     return current / created
   
   def makeDecision(self, positions):
-    tick = self.models.Ticks.one()
+    tick = self.models.Ticks.one(maxSeconds=self.ticksMaxSeconds)
     for p in positions:
       onePosition = p.positions[0]
-      oneTick = tick[onePosition.exchanger]
+      oneTick = tick.exchanger(onePosition.exchanger)
+      if oneTick is None:
+        self.logger.warning('No recent tick for decision, exchanger={e}.'
+                            .format(e=onePosition.exchanger))
+        continue
       var = PositionsManager.calcVariation(oneTick, onePosition)
       if onePosition.side == OnePosition.SideLong:
         if var >= self.profitThres:
@@ -49,7 +49,16 @@ def getDBInstance(host=None, port=None):
 
 def getModels(client):
   saveTickDateInString = Properties.SAVE_TICKDATE_IN_STRING
-  models = Models(client, saveTickDateInString=saveTickDateInString)
+  models = Models(client, saveTickDateInString=saveTickDateInString,
+                  valuesCacheSeconds=Properties.VALUES_CACHE_SECONDS,
+                  ticksSnapshotSeconds=Properties.TICKS_SNAPSHOT_SECONDS,
+                  ticksStorage=Properties.TICKS_STORAGE,
+                  ticksRetentions=Properties.TICKS_RETENTION_SECONDS,
+                  ticksDownsamples=Properties.TICKS_DOWNSAMPLE_SECONDS)
+  if Properties.VALUES_CACHE_WATCH:
+    models.Values.watch()
+  if Properties.TICKS_SNAPSHOT_WATCH:
+    models.Ticks.watch()
   return models
 
 
@@ -73,7 +82,8 @@ def checkProperties():
   return True
 
 def defaultTrendMonitor(models, accountId, logger=None):
-  creator = MainOperator(models, accountId=accountId, logger=logger)
+  creator = MainOperator(models, accountId=accountId, logger=logger,
+                         ticksMaxSeconds=Properties.TICKS_MAX_SECONDS)
   executor = TradeExecutor(models, accountId=accountId, logger=logger)
   #executor = NothingExecutor(models, accountId=accountId, logger=logger)
   player = TrendPlayer(models, accountId=accountId, logger=logger,
@@ -82,7 +92,8 @@ def defaultTrendMonitor(models, accountId, logger=None):
                       player=player)
 
 def defaultPositionsMonitor(models, accountId, logger=None):
-  creator = PositionsManager(models, accountId=accountId, logger=logger)
+  creator = PositionsManager(models, accountId=accountId, logger=logger,
+                             ticksMaxSeconds=Properties.TICKS_MAX_SECONDS)
   executor = TradeExecutor(models, accountId=accountId, logger=logger)
   player = PositionsPlayer(models, accountId=accountId, logger=logger,
                            actionCreator=creator, actionExecutor=executor)
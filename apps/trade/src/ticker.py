@@ -9,7 +9,7 @@ CWD = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(CWD, '..', 'conf'))
 
 import Properties
-from Models import Models
+from Models import Models, TicksWriter
 from Markets import Markets
 from market.Binance import Binance
 from market.BitFlyer import BitFlyer
@@ -39,7 +39,11 @@ def getDBInstance(host=None, port=None):
   return client
 
 def getModels(client):
-  models = Models(client)
+  models = Models(client,
+                  ticksSnapshotSeconds=Properties.TICKS_SNAPSHOT_SECONDS,
+                  ticksStorage=Properties.TICKS_STORAGE,
+                  ticksRetentions=Properties.TICKS_RETENTION_SECONDS,
+                  ticksDownsamples=Properties.TICKS_DOWNSAMPLE_SECONDS)
   return models
 
 class Ticker(object):
@@ -63,17 +67,21 @@ class Ticker(object):
   def start(self):
     exchanger = self.exchanger
     self.logger.info('Ticker, start `{e}`.'.format(e=exchanger))
+    # Ticks are fetched every interval from the start, however long
+    # fetching and saving take
+    nextTime = time.monotonic()
     while self.count is None or self.count >= 0:
       try:
         onetick = self.ticker()
         self.logger.debug('Ticker exchanger={e}, tick={t}.'
                           .format(e=exchanger, t=onetick))
         self.model.save(Tick({exchanger: onetick}), exchangers=[exchanger])
-        time.sleep(self.interval)
         if self.count is not None:
           self.count -= 1
       except Exception as e:
         self.logger.exception('Exception occur, e:{e}.'.format(e=e))
+      nextTime = max(nextTime + self.interval, time.monotonic())
+      time.sleep(nextTime - time.monotonic())
     self.logger.info('Ticker, stopped `{e}`.'.format(e=exchanger))
 
 def main():
@@ -91,11 +99,21 @@ def main():
     'interval': 30,
     'logger': logger
   }
-  tickers = (Ticker(models.Ticks, name, getTick, **options)
+  # Ticks of all tickers are written together
+  writer = TicksWriter(models.Ticks,
+                       batchSize=Properties.TICKS_WRITE_BATCH,
+                       flushSeconds=Properties.TICKS_WRITE_MILLIS / 1000.,
+                       maxBuffer=Properties.TICKS_WRITE_BUFFER,
+                       maxRetries=Properties.TICKS_WRITE_RETRIES,
+                       logger=logger).start()
+  tickers = (Ticker(writer, name, getTick, **options)
              for name, getTick in entries)
   threads = [Thread(target=t.start) for t in tickers]
   for thread in threads:
     thread.start()
+  for thread in threads:
+    thread.join()
+  writer.stop()
   logger.debug('Ticker all closed.')
 
 if __name__ == '__main__':
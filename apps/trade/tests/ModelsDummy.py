@@ -1,5 +1,7 @@
+import datetime
 import os
 import sys
+import time
 
 CWD = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(CWD, '..', 'src'))
@@ -50,12 +52,18 @@ def ModelsDummy():
   class TicksDummy(object):
     def __init__(self):
       self.collection = {}
+      self.savedAt = {}
 
-    def one(self):
-      k = sorted(self.collection.keys())[0]
+    def one(self, maxSeconds=None):
       obj = {}
+      if len(self.collection) == 0:
+        return Tick(obj)
+      k = sorted(self.collection.keys())[-1]
       for e, t in self.collection[k].items():
         obj[e] = OneTick.fromDict(t)
+      if maxSeconds is not None and \
+         time.time() - self.savedAt[k] > maxSeconds:
+        obj = {e: None for e in obj}
       return Tick(obj)
 
     def save(self, tick):
@@ -67,6 +75,7 @@ def ModelsDummy():
         t['datetime'] = datetimeToStr(date)
         d[e] = t
       self.collection[k] = d
+      self.savedAt[k] = time.time()
   
   class TradesDummy(object):
     def __init__(self):
@@ -1,4 +1,5 @@
 import datetime
+import logging
 import os
 import pytest
 import sys
@@ -252,3 +253,21 @@ def test_createAction_closeForProfit_long(modelsDummy, accountId):
   action = creator.createAction()
   assert isinstance(action, Action)
   assert action.name == PlayerActions.CloseForProfit
+
+def test_getPositionVariation_staleTick(modelsDummy, accountId, caplog):
+  models = modelsDummy
+  position = OnePosition(Tick.BitFlyer, [1.0], [500000],
+                         side=OnePosition.SideLong)
+  savePositions(models, [Position(date(days=-1), Position.StatusOpen,
+                                  [position])], accountId)
+  models.Ticks.save(Tick({Tick.BitFlyer: OneTick(550000, 549000, date())}))
+  creator = MainOperator(models, accountId=accountId, ticksMaxSeconds=60)
+  variations = creator.getPositionVariation()
+  assert variations['long'] == [1.1]
+  assert variations['short'] == []
+  for k in models.Ticks.savedAt:
+    models.Ticks.savedAt[k] -= 120
+  with caplog.at_level(logging.WARNING):
+    variations = creator.getPositionVariation()
+  assert variations == {'long': [], 'short': []}
+  assert 'No recent tick' in caplog.text
@@ -1,6 +1,10 @@
 import datetime
+import logging
 import os
+import pymongo
+import pytest
 import sys
+import time
 
 CWD = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(CWD, '..', 'src'))
@@ -50,3 +54,423 @@ def test_Positions_filterOpen_closing():
   positions2 = Positions.filterOpen(positions1)
   assert len(positions2) == 0
 
+
+class ValuesCollection(object):
+  def __init__(self):
+    self.name = 'values'
+    self.kvs = []
+    self.finds = 0
+
+  def index_information(self):
+    return {'_id_': {'key': [('_id', 1)]}}
+
+  def create_index(self, keys, **options):
+    return '_'.join('{k}_{v}'.format(k=k, v=v) for k, v in keys)
+
+  def find(self, conditions):
+    self.finds += 1
+    return [kv for kv in self.kvs
+            if kv['account_id'] == conditions['account_id']]
+
+  def replace_one(self, conditions, kv, upsert=False):
+    class Result(object):
+      upserted_id = 1
+      matched_count = 0
+    self.kvs = [o for o in self.kvs
+                if (o['account_id'], o['k']) != (kv['account_id'], kv['k'])]
+    self.kvs.append(kv)
+    return Result()
+
+def ValuesCached(cacheSeconds):
+  class DB(object):
+    values = ValuesCollection()
+  return Values(DB(), cacheSeconds=cacheSeconds)
+
+def test_Values_cache():
+  values = ValuesCached(60)
+  values.set(Values.Enabled, True, 'a')
+  assert values.get(Values.Enabled, 'a') is True
+  assert values.get(Values.OperatorLotInit, 'a') is None
+  assert values.collection.finds == 1
+  values.set(Values.OperatorLotInit, 0.1, 'a')
+  assert values.get(Values.OperatorLotInit, 'a') == 0.1
+  assert values.all('a')[Values.OperatorLotInit] == (0.1, 'float')
+  assert values.get(Values.Enabled, 'b') is None
+  assert values.collection.finds == 2
+  values.invalidate('a')
+  assert values.get(Values.OperatorLotInit, 'a') == 0.1
+  assert values.collection.finds == 3
+
+def test_Values_noCache():
+  values = ValuesCached(0)
+  values.set(Values.Enabled, True, 'a')
+  assert values.get(Values.Enabled, 'a') is True
+  assert values.get(Values.Enabled, 'a') is True
+  assert values.collection.finds == 2
+
+class IndexedCollection(object):
+  def __init__(self, infos):
+    self.name = 'positions'
+    self.infos = infos
+    self.dropped = []
+
+  def index_information(self):
+    return self.infos
+
+  def drop_index(self, name):
+    self.dropped.append(name)
+
+  def create_index(self, keys, **options):
+    return '_'.join('{k}_{v}'.format(k=k, v=v) for k, v in keys)
+
+def test_ensureIndexes():
+  collection = IndexedCollection({
+    '_id_': {'key': [('_id', 1)]},
+    'account_id_text_timestamp_-1': {
+      'key': [('_fts', 'text'), ('_ftsx', 1), ('timestamp', -1)],
+      'weights': {'account_id': 1}},
+    'account_id_1_timestamp_-1': {
+      'key': [('account_id', 1), ('timestamp', -1)]}
+  })
+  created = ensureIndexes(collection, Positions.Indexes)
+  assert collection.dropped == ['account_id_text_timestamp_-1']
+  assert created == ['account_id_1_status_1_timestamp_-1']
+
+def test_ensureIndexes_otherText():
+  collection = IndexedCollection({
+    '_id_': {'key': [('_id', 1)]},
+    'account_id_text_k_text': {
+      'key': [('_fts', 'text'), ('_ftsx', 1)],
+      'weights': {'account_id': 1, 'k': 1}},
+    'memo_text': {
+      'key': [('_fts', 'text'), ('_ftsx', 1)],
+      'weights': {'memo': 1}},
+    'account_id_text_memo_text': {
+      'key': [('_fts', 'text'), ('_ftsx', 1)],
+      'weights': {'account_id': 1, 'memo': 1}}
+  })
+  ensureIndexes(collection, Values.Indexes)
+  assert collection.dropped == ['account_id_text_k_text']
+
+def planStages(plan):
+  stages = [plan.get('stage')]
+  for k in ['inputStage', 'queryPlan']:
+    if k in plan:
+      stages += planStages(plan[k])
+  for p in plan.get('inputStages', []):
+    stages += planStages(p)
+  return stages
+
+def test_indexes_explain():
+  client = pymongo.MongoClient(serverSelectionTimeoutMS=500)
+  try:
+    client.server_info()
+  except pymongo.errors.ServerSelectionTimeoutError:
+    pytest.skip('no mongod to explain queries')
+  db = client.test_btctai_indexes
+  values = Values(db)
+  positions = Positions(db)
+  confidences = Confidences(db)
+  trendStrengths = TrendStrengths(db)
+  trades = Trades(db)
+  account = {'account_id': 'a'}
+  before = {'timestamp': {'$lt': 1.0}}
+  queries = [
+    values.collection.find({'$and': [account, {'k': Values.Enabled}]}),
+    positions.collection.find({'$and': [account, {'status': 'open'}]})
+             .sort('timestamp', -1),
+    positions.collection.find({'$and': [account, before]})
+             .sort('timestamp', -1).limit(10),
+    confidences.collection.find({'$and': [account, {'status': 'new'}]})
+               .sort('timestamp', -1).limit(1),
+    trendStrengths.collection.find({'$and': [account, before]})
+                  .sort('timestamp', -1),
+    trades.collection.find({'$and': [account, before]})
+          .sort('timestamp', -1).limit(10)
+  ]
+  try:
+    for cur in queries:
+      stages = planStages(cur.explain()['queryPlanner']['winningPlan'])
+      assert 'COLLSCAN' not in stages
+      assert 'SORT' not in stages
+  finally:
+    client.drop_database(db)
+
+class TicksCursor(list):
+  def sort(self, key, direction):
+    self.sorted = (key, direction)
+    return TicksCursor(sorted(self, key=lambda o: o[key],
+                              reverse=direction < 0))
+
+  def limit(self, count):
+    return iter(self[:count])
+
+class TicksCollection(object):
+  def __init__(self, name):
+    self.name = name
+    self.objs = {}
+    self.finds = 0
+    self.bulks = []
+    self.deletes = []
+
+  def index_information(self):
+    return {'_id_': {'key': [('_id', 1)]}}
+
+  def create_index(self, keys, **options):
+    return 'datetime_-1'
+
+  def find(self):
+    self.finds += 1
+    self.cursor = TicksCursor(self.objs.values())
+    return self.cursor
+
+  def delete_many(self, conditions):
+    self.deletes.append(conditions)
+
+  def replace_one(self, conditions, obj, upsert=False):
+    class Result(object):
+      upserted_id = None
+    key = conditions.get('_id', conditions.get('datetime'))
+    result = Result()
+    if key not in self.objs:
+      result.upserted_id = key
+    self.objs[key] = obj
+    return result
+
+  def bulk_write(self, operations, ordered=True):
+    class Result(object):
+      bulk_api_result = {'nInserted': 0, 'nUpserted': len(operations),
+                         'nModified': 0}
+    self.bulks.append(operations)
+    return Result()
+
+class TicksDB(object):
+  def __init__(self, infos=None):
+    self.infos = infos or []
+    self.created = []
+    self.commands = []
+
+  def __getattr__(self, name):
+    collection = TicksCollection(name)
+    setattr(self, name, collection)
+    return collection
+
+  def list_collections(self):
+    return self.infos
+
+  def create_collection(self, name, **options):
+    self.created.append((name, options))
+
+  def command(self, *args, **options):
+    self.commands.append((args, options))
+
+def test_Ticks_one_snapshot():
+  db = TicksDB()
+  now = datetime.datetime.now()
+  ticker = Ticks(db)
+  ticker.save(Tick({Tick.BitFlyer: OneTick(100., 99., now)}))
+  ticks = Ticks(db, snapshotSeconds=60)
+  tick = ticks.one(exchangers=[Tick.BitFlyer])
+  assert tick.exchanger(Tick.BitFlyer).ask == 100.
+  assert db.tick_latest.finds == 1
+  ticker.save(Tick({Tick.BitFlyer: OneTick(101., 100., now)}))
+  bitflyer = [Tick.BitFlyer]
+  assert ticks.one(exchangers=bitflyer).exchanger(Tick.BitFlyer).ask == 100.
+  assert ticker.one(exchangers=bitflyer).exchanger(Tick.BitFlyer).ask == 101.
+  assert db.tick_latest.finds == 2
+  assert ticks.lastSaved(Tick.BitFlyer) <= datetime.datetime.now().timestamp()
+  ticks.savedAt[Tick.BitFlyer] -= 10
+  tick = ticks.one(exchangers=bitflyer, maxSeconds=5)
+  assert tick.exchanger(Tick.BitFlyer) is None
+
+def test_Ticks_save_publishing():
+  db = TicksDB()
+  ticks = Ticks(db, snapshotSeconds=60)
+  now = datetime.datetime.now()
+  ticks.save(Tick({Tick.BitFlyer: OneTick(100., 99., now)}))
+  ticks.save(Tick({Tick.BitFlyer: OneTick(101., 100., now)}))
+  ticks.save(Tick({Tick.Quoine: OneTick(200., 199., now)}))
+  # The latest ticks are written once in snapshotSeconds for each exchanger
+  assert db.tick_latest.objs[Tick.BitFlyer]['tick']['ask'] == 100.
+  assert db.tick_latest.objs[Tick.Quoine]['tick']['ask'] == 200.
+  assert ticks.one(exchangers=[Tick.BitFlyer]).exchanger(Tick.BitFlyer).ask \
+         == 101.
+  ticks.publishedAt[Tick.BitFlyer] -= 60
+  ticks.save(Tick({Tick.BitFlyer: OneTick(102., 101., now)}))
+  assert db.tick_latest.objs[Tick.BitFlyer]['tick']['ask'] == 102.
+
+def test_Ticks_storage():
+  db = TicksDB()
+  ticks = Ticks(db, storage=Ticks.Insert,
+                retentions={Tick.BitFlyer: 3600},
+                downsamples={Tick.BitFlyer: 60})
+  assert ticks.indexesOf(Tick.BitFlyer) == [
+    ([('datetime', DESC)], {'unique': True}),
+    ([('date', ASC)], {'expireAfterSeconds': 3600})
+  ]
+  assert ticks.indexesOf(Tick.Quoine) == [
+    ([('datetime', DESC)], {'unique': True})
+  ]
+  now = datetime.datetime.now()
+  assert not ticks.downsampled(Tick.BitFlyer, OneTick(1., 1., now))
+  later = now + datetime.timedelta(seconds=30)
+  assert ticks.downsampled(Tick.BitFlyer, OneTick(1., 1., later))
+  assert not ticks.downsampled(Tick.Quoine, OneTick(1., 1., later))
+  obj = ticks.documentOf(Tick.BitFlyer, OneTick(1., 1., now))
+  assert obj['date'].timestamp() == obj['datetime']
+  assert 'date' not in ticks.documentOf(Tick.Quoine, OneTick(1., 1., now))
+  # Ticks saved before without date are removed after the retention
+  assert db.tick_quoine.deletes == []
+  [conditions] = db.tick_bitflyer.deletes
+  assert conditions['date'] == {'$exists': False}
+  oldest = conditions['datetime']['$lt']
+  assert abs(now.timestamp() - 3600 - oldest) < 60
+  with pytest.raises(ValueError):
+    Ticks(db, storage='capped')
+
+def test_Ticks_oneOf():
+  now = datetime.datetime.now()
+  earlier = now - datetime.timedelta(seconds=10)
+  for storage, field in [(Ticks.Upsert, 'datetime'),
+                         (Ticks.TimeSeries, 'date')]:
+    db = TicksDB()
+    ticks = Ticks(db, storage=storage)
+    for i, date in enumerate([earlier, now]):
+      obj = ticks.documentOf(Tick.BitFlyer, OneTick(100. + i, 99., date))
+      db.tick_bitflyer.objs[i] = obj
+    tick = ticks.oneOf([Tick.BitFlyer, Tick.Quoine])
+    assert db.tick_bitflyer.cursor.sorted == (field, -1)
+    assert tick.exchanger(Tick.BitFlyer).ask == 101.
+    assert tick.exchanger(Tick.Quoine) is None
+    assert db.tick_bitflyer.deletes == []
+
+def test_ensureIndexes_options():
+  collection = IndexedCollection({
+    '_id_': {'key': [('_id', 1)]},
+    'datetime_-1': {'key': [('datetime', -1)]}
+  })
+  created = ensureIndexes(collection,
+                          [([('datetime', DESC)], {'unique': True})])
+  assert collection.dropped == ['datetime_-1']
+  assert created == ['datetime_-1']
+
+def test_Ticks_write():
+  db = TicksDB()
+  ticks = Ticks(db)
+  now = datetime.datetime.now()
+  saved = ticks.save(Tick({Tick.BitFlyer: OneTick(100., 99., now)}))
+  assert saved[Tick.BitFlyer].ask == 100.
+  saved = ticks.save(Tick({Tick.BitFlyer: OneTick(101., 100., now)}))
+  assert saved[Tick.BitFlyer] is None
+
+def test_Ticks_setup_timeSeries():
+  db = TicksDB([
+    {'name': 'tick_bitflyer', 'type': 'timeseries',
+     'options': {'expireAfterSeconds': 60}},
+    {'name': 'tick_quoine', 'type': 'timeseries', 'options': {}}
+  ])
+  Ticks(db, storage=Ticks.TimeSeries, retentions={Tick.BitFlyer: 3600})
+  assert db.commands == [(('collMod', 'tick_bitflyer'),
+                          {'expireAfterSeconds': 3600})]
+  names = [name for name, _ in db.created]
+  assert 'tick_bitflyer' not in names and 'tick_quoine' not in names
+  assert 'tick_binance_ethbtc' in names
+  db = TicksDB([{'name': 'tick_quoine', 'type': 'collection', 'options': {}}])
+  with pytest.raises(TicksStorageError):
+    Ticks(db, storage=Ticks.TimeSeries)
+
+def test_Ticks_setup_duplicated():
+  def createIndex(keys, **options):
+    raise pymongo.errors.DuplicateKeyError('E11000', code=11000)
+  db = TicksDB()
+  db.tick_quoine.create_index = createIndex
+  with pytest.raises(TicksStorageError):
+    Ticks(db, storage=Ticks.Insert)
+
+def test_ensureIndexes_restore():
+  class DuplicatedCollection(IndexedCollection):
+    def __init__(self, infos):
+      IndexedCollection.__init__(self, infos)
+      self.created = []
+
+    def create_index(self, keys, **options):
+      if options.get('unique'):
+        raise pymongo.errors.DuplicateKeyError('E11000', code=11000)
+      self.created.append((keys, options))
+  collection = DuplicatedCollection({
+    '_id_': {'key': [('_id', 1)]},
+    'datetime_-1': {'v': 2, 'key': [('datetime', -1)], 'sparse': True}
+  })
+  with pytest.raises(pymongo.errors.DuplicateKeyError):
+    ensureIndexes(collection, [([('datetime', DESC)], {'unique': True})])
+  assert collection.dropped == ['datetime_-1']
+  assert collection.created == [([('datetime', -1)],
+                                  {'name': 'datetime_-1', 'sparse': True})]
+
+def test_TicksWriter():
+  db = TicksDB()
+  ticks = Ticks(db, downsamples={Tick.Quoine: 60})
+  writer = TicksWriter(ticks, batchSize=2, flushSeconds=60.).start()
+  now = datetime.datetime.now()
+  writer.save(Tick({Tick.BitFlyer: OneTick(100., 99., now)}))
+  writer.save(Tick({Tick.Quoine: OneTick(200., 199., now),
+                    Tick.BitFlyer: OneTick(101., 100., now)}))
+  writer.save(Tick({Tick.Quoine: OneTick(201., 200., now)}))
+  writer.stop()
+  assert [len(b) for b in db.tick_bitflyer.bulks] == [2]
+  assert sum(len(b) for b in db.tick_quoine.bulks) == 1
+  assert ticks.snapshot[Tick.Quoine].ask == 201.
+  assert ticks.snapshot[Tick.BitFlyer].ask == 101.
+
+def quietLogger():
+  logger = logging.getLogger('test_models')
+  logger.propagate = False
+  return logger
+
+def failingBulkWrite(error):
+  def bulkWrite(operations, ordered=True):
+    raise error
+  return bulkWrite
+
+def test_Ticks_saveAll_failed():
+  db = TicksDB()
+  ticks = Ticks(db)
+  now = datetime.datetime.now()
+  db.tick_quoine.bulk_write = failingBulkWrite(
+    pymongo.errors.NetworkTimeout('timed out'))
+  db.tick_bitflyer_ethbtc.bulk_write = failingBulkWrite(
+    pymongo.errors.BulkWriteError({
+      'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'invalid'}],
+      'nInserted': 0, 'nUpserted': 0, 'nModified': 0}))
+  items = [(e, ticks.documentOf(e, OneTick(1., 1., now)), True)
+           for e in [Tick.BitFlyer, Tick.Quoine, Tick.BitFlyerETHBTC]]
+  items.append((Tick.Quoine, ticks.documentOf(Tick.Quoine,
+                                              OneTick(2., 2., now)), False))
+  written, failed = ticks.saveAll(items, logger=quietLogger())
+  # Only ticks to store of the exchanger failed transiently are returned
+  assert written == 1
+  assert failed == [items[1]]
+  assert len(db.tick_bitflyer.bulks) == 1
+  assert ticks.snapshot[Tick.Quoine].ask == 2.
+
+def test_TicksWriter_maxRetries():
+  db = TicksDB()
+  db.tick_quoine.bulk_write = failingBulkWrite(
+    pymongo.errors.AutoReconnect('down'))
+  writer = TicksWriter(Ticks(db), batchSize=1, flushSeconds=0.01,
+                       maxRetries=2, logger=quietLogger())
+  now = datetime.datetime.now()
+  writer.save(Tick({Tick.Quoine: OneTick(1., 1., now)}))
+  writer.start()
+  time.sleep(0.2)
+  assert len(writer.buffer) == 0
+  assert writer.retries == 0
+  writer.stop()
+
+def test_TicksWriter_maxBuffer():
+  writer = TicksWriter(Ticks(TicksDB()), batchSize=10, maxBuffer=2)
+  now = datetime.datetime.now()
+  for ask in [1., 2., 3.]:
+    writer.save(Tick({Tick.BitFlyer: OneTick(ask, ask, now)}))
+  assert [obj['ask'] for _, obj, _ in writer.buffer] == [2., 3.]
+  assert writer.dropped == 1